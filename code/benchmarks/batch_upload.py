@@ -0,0 +1,131 @@
+"""
+Time the upload of a batch to an SSH machine: one SFTP copy per folder against a single tar stream (see
+SSHMachine.put_tar). The remote is a stand-in SSH server on localhost (asyncssh, running commands with the local
+shell), every SFTP request and command waits --latency milliseconds like a round trip to toko.
+The copies are recorded in TRANSFER_LOG_PATH under the machine name "stand-in", which no queue uses.
+
+Usage (from code/): python -m benchmarks.batch_upload [--tasks 500] [--latency 20] [--compression 1]
+"""
+import argparse
+import asyncio
+import getpass
+import os
+import random
+import shutil
+import tempfile
+import time
+from pathlib import Path, PurePosixPath
+
+import asyncssh
+
+from config import config
+from config.config import POTENTIAL_PATH, LOCAL_MULTI_PY, RUN_SH, BATCH_INFO
+from lammps.simulation_task import SimulationTask
+from opt import GPUOpt, MPIOpt, OMPOpt
+from remote.machine.local_machine import LocalMachine
+from remote.machine.ssh_machine import SSHMachine, SSHBatchedExecutionQueue
+from service.transfer_model import UPLOAD_BYTES_PER_TASK
+
+# SFTP requests of a recursive put, each one waits the latency
+SFTP_REQUESTS = ["open", "close", "write", "lstat", "stat", "fstat", "setstat", "fsetstat", "mkdir", "realpath"]
+
+
+def stand_in_sftp(latency: float) -> type[asyncssh.SFTPServer]:
+    def delayed(method):
+        async def inner(self, *args):
+            await asyncio.sleep(latency)
+            return method(self, *args)
+
+        return inner
+
+    return type("StandInSFTPServer", (asyncssh.SFTPServer,),
+                {name: delayed(getattr(asyncssh.SFTPServer, name)) for name in SFTP_REQUESTS})
+
+
+class StandInServer(asyncssh.SSHServer):
+    def begin_auth(self, username: str) -> bool:
+        return False
+
+
+async def start_server(latency: float) -> asyncssh.SSHAcceptor:
+    async def run_command(process: asyncssh.SSHServerProcess) -> None:
+        await asyncio.sleep(latency)
+        shell = await asyncio.create_subprocess_shell(process.command, stdin=asyncio.subprocess.PIPE,
+                                                      stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        await process.redirect(stdin=shell.stdin, stdout=shell.stdout, stderr=shell.stderr)
+        process.exit(await shell.wait())
+
+    return await asyncssh.create_server(StandInServer, "127.0.0.1", 0, server_host_keys=[asyncssh.generate_private_key("ssh-ed25519")],
+                                        process_factory=run_command, sftp_factory=stand_in_sftp(latency), encoding=None)
+
+
+def make_batch(folder: Path, count: int, seed: int) -> tuple[LocalMachine, list[SimulationTask], str]:
+    """
+    A local execution folder with a batch and its simulation folders, like _setup_local_simulation_files leaves it
+    """
+    rng = random.Random(seed)
+    execution_path = folder / "simulations"
+    os.makedirs(execution_path)
+    shutil.copy(POTENTIAL_PATH, folder / "FeCuNi.eam.alloy")
+    tasks = []
+    for i in range(count):
+        cwd = execution_path / f"nanoparticle_{i}"
+        os.makedirs(cwd)
+        lines, size = [], 0
+        while size < UPLOAD_BYTES_PER_TASK:
+            lines.append(f"create_atoms 1 single {rng.uniform(-20, 20):.4f} {rng.uniform(-20, 20):.4f} {rng.uniform(-20, 20):.4f}")
+            size += len(lines[-1]) + 1
+        (cwd / "in.lmp").write_text("\n".join(lines) + "\n")
+        tasks.append(SimulationTask(cwd / "in.lmp", GPUOpt(), MPIOpt(), OMPOpt(), cwd))
+    batch_name = "batch_benchmark"
+    os.makedirs(execution_path / batch_name)
+    shutil.copy(LOCAL_MULTI_PY, execution_path / batch_name / "multi.py")
+    (execution_path / batch_name / RUN_SH).write_text("python3 multi.py\n")
+    (execution_path / batch_name / BATCH_INFO).write_text("\n".join(str(task.local_input_file) for task in tasks) + "\n")
+    return LocalMachine(execution_path, Path("lmp")), tasks, batch_name
+
+
+def files(path: Path) -> int:
+    return sum(len(names) for _, _, names in os.walk(path))
+
+
+async def run(args: argparse.Namespace) -> None:
+    server = await start_server(args.latency / 1000)
+    port = server.sockets[0].getsockname()[1]
+    with tempfile.TemporaryDirectory() as tmp:
+        local, tasks, batch_name = make_batch(Path(tmp) / "local", args.tasks, args.seed)
+        remote_root = Path(tmp) / "remote"
+        remote = SSHMachine("stand-in", 1, getpass.getuser(), "127.0.0.1", port, execution_path=PurePosixPath(remote_root / "simulations"))
+        remote.connection = await asyncssh.connect("127.0.0.1", port=port, username=remote.user, known_hosts=None, client_keys=None)
+        remote.sftp = await remote.connection.start_sftp_client()
+        queue = SSHBatchedExecutionQueue(remote, local)
+        print(f"{args.tasks} simulation folders, {args.latency:.0f} ms per request")
+        print(f"{'mode':>6} {'seconds':>8} {'files':>6}")
+        for mode, compression in [("sftp", 0), ("tar", 0), ("tar", args.compression)]:
+            shutil.rmtree(remote_root, ignore_errors=True)
+            os.makedirs(remote_root / "simulations")
+            config.SSH_UPLOAD_MODE = mode
+            config.SSH_TAR_COMPRESSION = compression
+            start = time.perf_counter()
+            await queue._copy_scripts_to_remote(tasks, batch_name)
+            seconds = time.perf_counter() - start
+            # The potential and the simulations, and the checksums of a tar stream
+            expected = files(Path(tmp) / "local") + (mode == "tar")
+            copied = files(remote_root)
+            label = mode if mode == "sftp" else f"{mode}:{compression}"
+            print(f"{label:>6} {seconds:8.2f} {copied:6}{'' if copied == expected else f' (expected {expected})'}")
+        remote.connection.close()
+    server.close()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--tasks", type=int, default=500)
+    arg_parser.add_argument("--latency", type=float, default=20.0, help="Milliseconds every SFTP request and command waits")
+    arg_parser.add_argument("--compression", type=int, default=1, help="Gzip level of the compressed tar stream")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(run(arg_parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Makespan of the local execution queues on tasks with heterogeneous run times.
+LAMMPS is replaced by a stand-in script that sleeps for a time proportional to the atom count written in its input,
+so the queues run their real subprocess path without simulating anything.
+
+Usage (from code/): python -m benchmarks.local_queue_makespan [--tasks 32] [--threads 4] [--seconds 8]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from multiprocessing.pool import ThreadPool
+from pathlib import Path
+
+from lammps.simulation_task import SimulationTask
+from opt import GPUOpt, MPIOpt, OMPOpt
+from remote.execution_queue.async_local_execution_queue import AsyncLocalExecutionQueue
+from remote.execution_queue.execution_queue import ExecutionQueue
+from remote.execution_queue.local_execution_queue import LocalExecutionQueue, SharedLocalExecutionQueue
+from remote.machine.local_machine import LocalMachine
+
+FAKE_LAMMPS = f"""#!{sys.executable}
+import sys, time
+with open(sys.argv[sys.argv.index("-in") + 1]) as f:
+    time.sleep(float(f.readline().split()[-1]))
+"""
+
+
+class RoundRobinQueue(ExecutionQueue):
+    """
+    The baseline: one LocalExecutionQueue per thread, the tasks dealt to them in turn before any of them runs
+    (the local:N queue before the shared deque)
+    """
+
+    def __init__(self, remote: LocalMachine, threads: int):
+        super().__init__()
+        self.queues: list[LocalExecutionQueue] = [LocalExecutionQueue(remote) for _ in range(threads)]
+        self.index: int = 0
+
+    def enqueue(self, simulation_task: SimulationTask):
+        self.queues[self.index % len(self.queues)].enqueue(simulation_task)
+        self.index += 1
+
+    def run(self) -> list[SimulationTask]:
+        with ThreadPool(len(self.queues)) as p:
+            return [task for tasks in p.map(LocalExecutionQueue.run, self.queues) for task in tasks]
+
+
+def make_tasks(folder: Path, count: int, seconds: float, seed: int) -> list[tuple[Path, int, float]]:
+    """
+    Input files with heavy tailed sizes, scaled so that the total run time is the given number of seconds
+    :return: (input file, atoms, run time) of every task
+    """
+    rng = random.Random(seed)
+    atoms = [int(rng.lognormvariate(8, 0.9)) for _ in range(count)]
+    scale = seconds / sum(atoms)
+    tasks = []
+    for i, atom_count in enumerate(atoms):
+        input_file = folder / f"task_{i}.in"
+        with open(input_file, "w") as f:
+            f.write(f"# runtime {atom_count * scale}\n")
+        tasks.append((input_file, atom_count, atom_count * scale))
+    return tasks
+
+
+def measure(queue: ExecutionQueue, tasks: list[tuple[Path, int, float]]) -> float:
+    for input_file, atoms, _ in tasks:
+        queue.enqueue(SimulationTask(input_file, GPUOpt(), MPIOpt(), OMPOpt(), input_file.parent, estimated_atoms=atoms))
+    start = time.perf_counter()
+    queue.run()
+    return time.perf_counter() - start
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--tasks", type=int, default=32)
+    arg_parser.add_argument("--threads", type=int, default=4)
+    arg_parser.add_argument("--seconds", type=float, default=8.0, help="Total run time of all the tasks")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args()
+    with tempfile.TemporaryDirectory() as folder:
+        folder = Path(folder)
+        fake_lammps = folder / "fake_lammps"
+        with open(fake_lammps, "w") as f:
+            f.write(FAKE_LAMMPS)
+        os.chmod(fake_lammps, 0o755)
+        machine = LocalMachine(folder, fake_lammps)
+        tasks = make_tasks(folder, args.tasks, args.seconds, args.seed)
+        runtimes = [runtime for _, _, runtime in tasks]
+        lower_bound = max(sum(runtimes) / args.threads, max(runtimes))
+        print(f"{args.tasks} tasks on {args.threads} threads, longest {max(runtimes):.2f}s, lower bound {lower_bound:.2f}s")
+        queues = {
+            "round robin": RoundRobinQueue(machine, args.threads),
+            "shared deque": SharedLocalExecutionQueue(machine, args.threads, largest_first=False),
+            "shared deque, largest first": SharedLocalExecutionQueue(machine, args.threads),
+            "asyncio, largest first": AsyncLocalExecutionQueue(machine, args.threads, stdout_file=None, runs=args.threads),
+        }
+        for name, queue in queues.items():
+            print(f"{name:>28}: {measure(queue, tasks):.2f}s")
+
+
+if __name__ == "__main__":
+    main()
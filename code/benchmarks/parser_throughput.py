@@ -0,0 +1,48 @@
+"""
+Parser throughput over the shape library, in lines per second.
+Files are read once up front, so only parsing is measured (the parse cache is not involved).
+
+Usage (from code/): python -m benchmarks.parser_throughput [--path ../Shapes] [--repeat 5]
+"""
+import argparse
+import time
+from pathlib import Path
+
+from lammps.nanoparticlebuilder import NanoparticleBuilder
+from lammps.nanoparticle_locator import NanoparticleLocator
+from lammps.poorly_coded_parser import PoorlyCodedParser
+
+
+def load_lines(path: Path) -> list[list[str]]:
+    shapes = []
+    for shape in NanoparticleLocator.sorted_search(path):
+        with open(shape, "r") as f:
+            lines = PoorlyCodedParser.locate_relevant_lines(f.readlines())
+        shapes.append([ll for line in lines if (ll := line.strip()) != ""])
+    return shapes
+
+
+def measure(shapes: list[list[str]], strict: bool, repeat: int) -> float:
+    line_count = sum(len(lines) for lines in shapes)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for lines in shapes:
+            PoorlyCodedParser.parse_shape(lines, NanoparticleBuilder(), strict)
+        best = min(best, time.perf_counter() - start)
+    return line_count / best
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--path", type=Path, default=Path("../Shapes"))
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    args = arg_parser.parse_args()
+    shapes = load_lines(args.path)
+    print(f"{len(shapes)} shapes, {sum(len(lines) for lines in shapes)} lines")
+    for strict in (True, False):
+        print(f"{'strict' if strict else 'fast':>6}: {measure(shapes, strict, args.repeat):,.0f} lines/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Makespan, utilization and tail latency of the scheduling policies, simulated offline (see service.schedule_simulator).
+The tasks are heavy tailed synthetic ones, or the completed executions of a folder (--samples), and run on a local
+machine and two toko partitions reached through SSH. Nothing is run on a cluster, so it is cheap enough for CI:
+it exits with an error when the lpt policy is more than --tolerance slower than another policy.
+The run times come from single_core_completion_time unless a runtime model is given with --model, so the result
+depends only on the arguments.
+
+Usage (from code/): python -m benchmarks.scheduling_policies [--tasks 500] [--noise 0.2] [--test] [--samples ../executions]
+                    [--model ../.cache/runtime_model.json]
+"""
+import argparse
+import random
+import sys
+from pathlib import Path
+
+from config.config import DESIRED_ATOM_COUNT
+from lammps.simulation_task import SimulationTask
+from remote.execution_queue.slurm_execution_queue import minutes_to_slurm
+from remote.machine.local_machine import LocalMachine
+from remote.machine.machine_factory import MachineFactory
+from service.runtime_model import RuntimeModel
+from service.schedule_simulator import SimulatedMachine, TaskTimes, compare
+from service.transfer_model import MachineTransfer
+
+
+def make_machines(local_cores: int, bandwidth: float, latency: float) -> list[SimulatedMachine]:
+    local = LocalMachine(Path("/tmp"), Path("/tmp/lmp"), single_core_completion_time=3 * 3155.91)
+    local.cores = local_cores
+    link = MachineTransfer(0, bandwidth, latency)
+    return [
+        SimulatedMachine(local, local_cores),
+        SimulatedMachine(MachineFactory.toko("mini"), 16, batched=True, queue_wait=120.0, link=link),
+        SimulatedMachine(MachineFactory.toko("XL"), 64, batched=True, queue_wait=900.0, link=link),
+    ]
+
+
+def make_tasks(count: int, seed: int, is_test: bool = False) -> list[SimulationTask]:
+    rng = random.Random(seed)
+    return [SimulationTask(f"task_{i}.in", is_test_run=is_test,
+                           estimated_atoms=max(50, int(rng.lognormvariate(0, 0.6) * DESIRED_ATOM_COUNT)))
+            for i in range(count)]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--tasks", type=int, default=500)
+    arg_parser.add_argument("--local-cores", type=int, default=8)
+    arg_parser.add_argument("--bandwidth", type=float, default=10e6, help="Bytes per second to and from toko")
+    arg_parser.add_argument("--latency", type=float, default=1.0, help="Seconds per SFTP operation to toko")
+    arg_parser.add_argument("--test", action="store_true", help="Simulate test runs")
+    arg_parser.add_argument("--noise", type=float, default=0.2, help="Log-normal error of the predicted run times")
+    arg_parser.add_argument("--samples", type=Path, default=None, help="Replay the completed executions of a folder")
+    arg_parser.add_argument("--model", type=Path, default=None, help="Runtime model to predict the run times with (see `sched runtime`)")
+    arg_parser.add_argument("--tolerance", type=float, default=0.1)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args()
+    machines = make_machines(args.local_cores, args.bandwidth, args.latency)
+    model: RuntimeModel | None = None
+    if args.model is not None:
+        model = RuntimeModel.load(args.model)
+        if model is None:
+            arg_parser.error(f"No runtime model in {args.model}")
+    if args.samples is not None:
+        samples = RuntimeModel.collect(args.samples)
+        times = TaskTimes.of_samples(machines, samples, model)
+        print(f"Replaying {len(samples)} executions of {args.samples}")
+    else:
+        times = TaskTimes.of_model(machines, make_tasks(args.tasks, args.seed, args.test), model, args.test,
+                                   noise=args.noise, seed=args.seed)
+        print(f"{args.tasks} synthetic {'test' if args.test else 'full'} runs, prediction noise {args.noise}")
+    reports = compare(machines, times)
+    print(f"{'policy':>16} {'makespan':>10} {'bound':>10} {'util':>6} {'p50':>10} {'p95':>10} {'p99':>10}   per machine")
+    for report in reports:
+        times_ = [minutes_to_slurm(minutes, 1.0) for minutes in (report.makespan, report.lower_bound, report.p50, report.p95, report.p99)]
+        per_machine = ", ".join(f"{m.name} {minutes_to_slurm(minutes, 1.0)}" for m, minutes in zip(machines, report.finish))
+        print(f"{report.policy:>16} {times_[0]:>10} {times_[1]:>10} {report.utilization:6.1%} {times_[2]:>10} {times_[3]:>10} {times_[4]:>10}   {per_machine}")
+    lpt = next(report for report in reports if report.policy == "lpt")
+    best = min(report.makespan for report in reports)
+    if lpt.makespan > best * (1 + args.tolerance):
+        print(f"lpt is {lpt.makespan / best - 1:.1%} slower than the best policy")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
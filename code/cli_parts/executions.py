@@ -28,10 +28,11 @@ from config import config
 from lammps import nanoparticle, poorly_coded_parser as parser
 from lammps.nanoparticle import Nanoparticle
 from lammps.nanoparticlebuilder import NanoparticleBuilder
+from model.execution_metadata import ExecutionMetadata
 from model.live_execution import LiveExecution
 from remote.machine.machine import Machine
 from remote.machine.ssh_machine import SSHMachine
-from service import executor_service
+from service import executor_service, result_store
 from service.executor_service import execute_nanoparticles, add_extra_nanoparticles
 from typing import Optional
 
@@ -144,12 +145,15 @@ def _load_single_nanoparticle(i: int, folder: str) -> tuple[dict[str, float | st
             f"[pink]{info.lammps_log.tpas:.2f}[/pink]",
         )
         out = utils.assign_nanoparticle_name(info.title)
+        metadata = ExecutionMetadata.load(config.LOCAL_EXECUTION_PATH / folder)
         data = {
             **out,
             "magnetism_val": float(info.magnetism[0]),
             "magnetism_std": float(info.magnetism[1]),
             "tpas": float(info.lammps_log.tpas),
-            "duration": float(info.lammps_log.exec_time)
+            "duration": float(info.lammps_log.exec_time),
+            # CPUs the run was pinned to, to compare the tpas of pinned runs
+            "cores": "" if metadata is None or metadata.cores is None else ",".join(str(cpu) for cpu in metadata.cores),
         }
         return data, row
     except Exception as e:
@@ -249,14 +253,15 @@ def execute(
     at: Annotated[
         str, typer.Option(help="Where to execute the nanoparticle simulation", show_default=True)] = "local",
     seed: Annotated[int, typer.Option(help="Seed for the random number generator", show_default=True)] = 123,
-    seed_count: Annotated[int, typer.Option(help="Number of extra nanoparticles to add", show_default=True)] = 1
+    seed_count: Annotated[int, typer.Option(help="Number of extra nanoparticles to add", show_default=True)] = 1,
+    resume: Annotated[bool, typer.Option(help="Resume an interrupted run: skip completed simulations and finish the interrupted ones", show_default=True)] = False
 ) -> list[Path | None]:
     """
     This command executes a list of nanoparticle simulations.
     """
     builders: list[tuple[str, NanoparticleBuilder]] = list(parser.PoorlyCodedParser.load_shapes_from_paths(paths))
     nanoparticles: list[tuple[str, Nanoparticle]] = add_extra_nanoparticles(builders, seed, seed_count)
-    results: list[tuple[str, nanoparticle.Nanoparticle]] = execute_nanoparticles(nanoparticles, at, test)
+    results: list[tuple[str, nanoparticle.Nanoparticle]] = execute_nanoparticles(nanoparticles, at, test, resume=resume)
     for path, nano in results:
         rprint(nano.asdict())
     result_paths: list[Path | None] = []
@@ -448,3 +453,38 @@ def raw_parse(folder, task_id, progress):
     nano = nanoparticle.Nanoparticle.from_executed(config.LOCAL_EXECUTION_PATH / folder)
     nano.on_post_execution("Some non-empty result")
     progress.update(task_id, advance=1)
+
+
+@executions.command()
+def reuse(
+    index_existing: Annotated[bool, typer.Option(help="Add the completed local executions to the result store", show_default=True)] = False,
+    clear: Annotated[bool, typer.Option(help="Empty the result store (executions are kept)", show_default=True)] = False,
+):
+    """
+    Show how often completed executions are reused instead of running LAMMPS again
+    """
+    store = result_store.get_result_store()
+    if store is None:
+        rprint("[yellow]The result store is disabled (RESULT_STORE_ENABLED)[/yellow]")
+        return
+    if clear:
+        rprint(f"Removed [green]{store.clear()}[/green] entries from {store.path}")
+        return
+    if index_existing:
+        added = 0
+        for folder in sorted(os.listdir(config.LOCAL_EXECUTION_PATH)):
+            folder_path: Path = config.LOCAL_EXECUTION_PATH / folder
+            code: str | None = utils.read_local_file(folder_path / config.NANOPARTICLE_IN)
+            if folder.startswith("batch") or code is None or not os.path.isfile(folder_path / config.LOG_LAMMPS):
+                continue
+            store.put(store.key(code), folder_path)
+            added += 1
+        rprint(f"Indexed [green]{added}[/green] completed executions")
+    stats = store.stats()
+    table = rich.table.Table(title="Result store", show_header=False)
+    table.add_row("Entries", str(stats["entries"]))
+    table.add_row("Lookups", str(stats["hits"] + stats["misses"]))
+    table.add_row("Hits", str(stats["hits"]))
+    table.add_row("Hit rate", f"{stats['hit_rate']:.1%}")
+    table.add_row("Space reclaimed", f"{stats['reclaimed_bytes'] / 1024 ** 2:.1f} MiB")
+    console.print(table)
@@ -1,29 +1,95 @@
+import csv
+import itertools
 import logging
 import re
+import threading
 from pathlib import Path
-from typing import Callable, Annotated
+from typing import Callable, Annotated, Optional
 
+import numpy as np
+import rich.table
 import typer
 from bayes_opt import BayesianOptimization
 from rich import print as rprint
 
+from cli_parts.number_highlighter import console
 from config import config
 from lammps import poorly_coded_parser as parser
+from lammps.lattice_estimator import LatticeEstimator
+from lammps.nanoparticle import Nanoparticle
 import utils
 from service import executor_service
+from service.evaluation_cache import EvaluationCache, ESTIMATE, LAMMPS
 
 fuzzer = typer.Typer(add_completion=False, no_args_is_help=True, name="fuzzer")
 
 
-def get_full_function(path: Path) -> tuple[list, Callable]:
+def get_keys(path: Path) -> list[str]:
     contents = utils.read_local_file(path)
-    keys = re.findall(r"{{(.*?)}}", contents)
+    return list(dict.fromkeys(re.findall(r"{{(.*?)}}", contents)))
+
+
+def get_param_space(keys: list[str]) -> dict[str, tuple[float, float]]:
+    param_space = {}
+    for key in keys:
+        split = key.split(":")
+        min_value = float(split[1])
+        max_value = float(split[2])
+        param_space[key] = (min_value, max_value)
+    return param_space
+
+
+def grid_samples(param_space: dict[str, tuple[float, float]], points: int) -> list[dict[str, float]]:
+    """
+    Full factorial grid with `points` evenly spaced values per parameter (bounds included)
+    """
+    axes = [np.linspace(low, high, points) for low, high in param_space.values()]
+    return [dict(zip(param_space.keys(), (float(v) for v in values))) for values in itertools.product(*axes)]
+
+
+def latin_hypercube_samples(param_space: dict[str, tuple[float, float]], samples: int, seed: int = 4) -> list[dict[str, float]]:
+    """
+    Latin hypercube sample: each parameter range is split in `samples` strata, and every stratum is used exactly once
+    """
+    rng = np.random.default_rng(seed)
+    columns = {}
+    for key, (low, high) in param_space.items():
+        strata = (rng.permutation(samples) + rng.random(samples)) / samples
+        columns[key] = low + strata * (high - low)
+    return [{key: float(columns[key][i]) for key in param_space} for i in range(samples)]
+
+
+def build_fuzzed_nanoparticle(path: Path, **kwargs) -> tuple[str, Nanoparticle]:
+    kwargs = {k: str(v) for k, v in kwargs.items()}
+    logging.debug(kwargs)
+    parsed_path, nano_builder = parser.PoorlyCodedParser.parse_single_shape(path, False, replacements=kwargs)
+    return parsed_path, nano_builder.build(title='Fuzzing ' + nano_builder.title)
+
+
+def compute_weighted_error(atom_count: int, ratio: float, target_values: list[float], target_importance: list[float]) -> float:
+    return sum(importance * ((actual - target) ** 2) for actual, target, importance in
+               zip((atom_count, ratio), target_values, target_importance))
+
+
+def get_estimator_function(path: Path) -> tuple[list, Callable]:
+    """
+    Like get_full_function, but estimates the atom count and ratio on the lattice instead of running LAMMPS
+    """
+    keys = get_keys(path)
+
+    def estimate(**kwargs):
+        _, nanoparticle = build_fuzzed_nanoparticle(path, **kwargs)
+        result = LatticeEstimator.estimate_nanoparticle(nanoparticle)
+        return result.atom_count, result.atom_type_ratio(config.NI_ATOM), nanoparticle
+
+    return keys, estimate
+
+
+def get_full_function(path: Path) -> tuple[list, Callable]:
+    keys = get_keys(path)
 
     def fuzz(**kwargs):
-        kwargs = {k: str(v) for k, v in kwargs.items()}
-        logging.debug(kwargs)
-        parsed_path, nano_builder = parser.PoorlyCodedParser.parse_single_shape(path, False, replacements=kwargs)
-        nanoparticle = nano_builder.build(title='Fuzzing ' + nano_builder.title)
+        parsed_path, nanoparticle = build_fuzzed_nanoparticle(path, **kwargs)
         executed_path, executed_nano = executor_service.execute_single_nanoparticle((
             parsed_path, nanoparticle),
             at="local",
@@ -70,9 +136,8 @@ def bayes(
         rprint(f"{{{kwargs_str}}} ({result_atom_count:5} atoms, {result_ratio:.4f} ratio) RMSE: {rmse_str:14}")
         return -rmse
 
-    def compute_rmse(result_atom_count: list[int], result_ratio: list[float]) -> float:
-        return sum(importance * ((actual - target) ** 2) for actual, target, importance in
-                   zip((result_atom_count, result_ratio), target_values, target_importance))
+    def compute_rmse(result_atom_count: int, result_ratio: float) -> float:
+        return compute_weighted_error(result_atom_count, result_ratio, target_values, target_importance)
 
     def print_final_result(optim: BayesianOptimization, fuz: Callable):
         atom_count, ratio, nano = fuz(**optim.max['params'])
@@ -83,12 +148,7 @@ def bayes(
         rprint(f"Final result: {atom_count=}, {ratio=} - Weighted RMSE {resulting_rmse}")
         return nano
 
-    param_space = {}
-    for key in keys:
-        split = key.split(":")
-        min_value = float(split[1])
-        max_value = float(split[2])
-        param_space[key] = (min_value, max_value)
+    param_space = get_param_space(keys)
     optimizer = BayesianOptimization(
         f=result,
         pbounds=param_space,
@@ -102,3 +162,207 @@ def bayes(
     nanoparticle = print_final_result(optimizer, run_fuzzer)
     if plot:
         nanoparticle.plot()
+
+
+@fuzzer.command()
+def multifidelity(
+        path: Annotated[Path, typer.Argument(help="The path to the nanoparticle (the [green].in[/green] file)")],
+        target_atom_count: Annotated[int, typer.Option(help="The target atom count")] = config.DESIRED_ATOM_COUNT,
+        target_ratio: Annotated[float, typer.Option(help="The target ratio")] = config.DESIRED_NI_RATIO,
+        target_atom_count_importance: Annotated[
+            float, typer.Option(help="The importance of getting the atom count right")] = 1,
+        target_ratio_importance: Annotated[
+            float, typer.Option(help="The importance of getting the ratio right")] = 10000,
+        explore_iter: Annotated[int, typer.Option(help="The number of estimated iterations to explore before tuning")] = 50,
+        tune_iter: Annotated[int, typer.Option(help="The number of estimated iterations to tune before confirming")] = 150,
+        confirm: Annotated[int, typer.Option(help="The number of top-ranked candidates to confirm with a LAMMPS test run")] = 5,
+        at: Annotated[str, typer.Option(help="Where to run the confirmation runs")] = "local",
+        cache_path: Annotated[Path, typer.Option(help="The evaluation cache file")] = config.FUZZER_CACHE_PATH,
+        plot: Annotated[bool, typer.Option(help="Whether to plot the best confirmed nanoparticle")] = False,
+):
+    """
+    Bayesian search scored with a lattice estimate, confirming only the best candidates with LAMMPS.\n
+    [gray][bold]Note 1[/bold]: The estimate counts atoms exactly, but random type changes pick different atoms than LAMMPS.[/gray]
+    [gray][bold]Note 2[/bold]: Evaluations are cached by file hash and parameters, re-running resumes the search.[/gray]
+    """
+    rprint(f"Using multi-fidelity search to find the correct value for a parameter in a nanoparticle")
+    keys, run_estimator = get_estimator_function(path)
+    target_values = [target_atom_count, target_ratio]
+    target_importance = [target_atom_count_importance, target_ratio_importance]
+    file_hash: str = utils.hash_file(path)
+    cache: EvaluationCache = EvaluationCache(cache_path)
+
+    def estimate(**kwargs) -> dict:
+        cached: dict | None = cache.get(file_hash, kwargs, ESTIMATE)
+        if cached is not None:
+            return cached
+        atom_count, ratio, _ = run_estimator(**kwargs)
+        result = {"atoms": atom_count, "ratio": ratio}
+        cache.put(file_hash, kwargs, ESTIMATE, result)
+        return result
+
+    def score(result: dict) -> float:
+        return compute_weighted_error(result["atoms"], result["ratio"], target_values, target_importance)
+
+    optimizer = BayesianOptimization(
+        f=lambda **kwargs: -score(estimate(**kwargs)),
+        pbounds=get_param_space(keys),
+        verbose=0,
+        random_state=4,
+        allow_duplicate_points=True
+    )
+    previous: list[tuple[dict[str, float], dict]] = cache.of_file(file_hash, ESTIMATE)
+    for params, result in previous:
+        optimizer.register(params=params, target=-score(result))
+    rprint(f"Resuming from [green]{len(previous)}[/green] cached estimates" if previous else "Starting a new search")
+    # Disable logging
+    level = logging.getLogger("").level
+    logging.getLogger("").setLevel(logging.WARN)
+    try:
+        optimizer.maximize(init_points=explore_iter, n_iter=tune_iter)
+    finally:
+        # Keep the estimates of an interrupted search, re-running resumes from them
+        cache.save()
+        logging.getLogger("").setLevel(level)
+
+    ranked: list[tuple[dict[str, float], dict]] = sorted(cache.of_file(file_hash, ESTIMATE), key=lambda pr: score(pr[1]))
+    top: list[dict[str, float]] = []
+    for params, _ in ranked:
+        if len(top) == confirm:
+            break
+        if params not in top:
+            top.append(params)
+    to_run: dict[str, tuple[dict[str, float], tuple[str, Nanoparticle]]] = {}
+    for params in top:
+        if cache.get(file_hash, params, LAMMPS) is None:
+            built = build_fuzzed_nanoparticle(path, **params)
+            to_run[built[1].id] = (params, built)
+    rprint(f"Confirming [green]{len(to_run)}[/green] candidates with LAMMPS ({len(top) - len(to_run)} cached)")
+    executed: dict[str, Nanoparticle] = {}
+    if len(to_run) > 0:
+        for _, nano in executor_service.execute_nanoparticles([built for _, built in to_run.values()], at=at, test=True):
+            executed[nano.id] = nano
+    for nano_id, (params, _) in to_run.items():
+        nano: Nanoparticle | None = executed.get(nano_id)
+        try:
+            cache.put(file_hash, params, LAMMPS, {"atoms": int(nano.total_atoms()), "ratio": float(nano.atom_type_ratio(config.NI_ATOM))})
+        except Exception as e:
+            logging.warning(f"Confirmation run failed for {params}: {e}")
+    cache.save()
+    logging.getLogger("").setLevel(config.LOG_LEVEL)
+
+    table = rich.table.Table(title="Top candidates")
+    for column in [*keys, "Est. atoms", "Est. ratio", "Atoms", "Ratio", "Error"]:
+        table.add_column(column)
+    best: tuple[float, dict[str, float]] | None = None
+    for params in top:
+        est = cache.get(file_hash, params, ESTIMATE)
+        real = cache.get(file_hash, params, LAMMPS)
+        error = None if real is None else score(real)
+        if error is not None and (best is None or error < best[0]):
+            best = error, params
+        table.add_row(
+            *[f"{params[key]:.4f}" for key in keys],
+            f"{est['atoms']}",
+            f"{est['ratio']:.4f}",
+            "-" if real is None else f"{real['atoms']}",
+            "-" if real is None else f"{real['ratio']:.4f}",
+            "-" if error is None else f"{error:.4f}",
+        )
+    console.print(table)
+    if best is None:
+        rprint("[red]No candidate could be confirmed[/red]")
+        return
+    rprint(best[1])
+    rprint(f"Final result: {cache.get(file_hash, best[1], LAMMPS)} - Weighted RMSE {best[0]}")
+    if plot:
+        for nano_id, (params, _) in to_run.items():
+            if params == best[1] and nano_id in executed:
+                executed[nano_id].plot()
+
+
+def _sweep_row(params: dict[str, float], nano: Nanoparticle | None) -> dict[str, float | int | str | None]:
+    row: dict[str, float | int | str | None] = {**params, "atoms": None, "ratio": None, "magnetization": None, "folder": None}
+    if nano is None:
+        return row
+    row["folder"] = str(nano.local_path)
+    try:
+        row["atoms"] = int(nano.total_atoms())
+        row["ratio"] = float(nano.atom_type_ratio(config.NI_ATOM))
+        row["magnetization"] = nano.run_magnetism[0]
+    except Exception as e:
+        logging.warning(f"Could not read results for {params}: {e}")
+    return row
+
+
+@fuzzer.command()
+def sweep(
+        path: Annotated[Path, typer.Argument(help="The path to the nanoparticle (the [green].in[/green] file)")],
+        method: Annotated[str, typer.Option(help="Sampling method: [b u]grid[/b u] or [b u]lhs[/b u] (Latin hypercube)")] = "grid",
+        points: Annotated[int, typer.Option(help="Values per parameter (grid)")] = 5,
+        samples: Annotated[int, typer.Option(help="Number of samples (lhs)")] = 50,
+        seed: Annotated[int, typer.Option(help="Seed for the Latin hypercube sample")] = 4,
+        at: Annotated[str, typer.Option(help="Where to run the simulations, e.g. [b u]local:8[/b u] or [b u]toko/XL:64,toko/Large:32[/b u]")] = "local",
+        test: Annotated[bool, typer.Option(help="Run test runs (no magnetization)")] = True,
+        output: Annotated[Optional[Path], typer.Option(help="CSV file where results are streamed as they complete")] = None,
+        count_only: Annotated[bool, typer.Option(help="Only count the variants without executing")] = False,
+):
+    """
+    Run every variant of a templated nanoparticle over a grid or a Latin hypercube of its parameters, as one batch.\n
+    [gray][bold]Note[/bold]: Parameters are the [yellow]{{name:min:max}}[/yellow] placeholders in the file.[/gray]
+    """
+    keys = get_keys(path)
+    param_space = get_param_space(keys)
+    if method == "grid":
+        variants = grid_samples(param_space, points)
+    elif method == "lhs":
+        variants = latin_hypercube_samples(param_space, samples, seed)
+    else:
+        raise ValueError(f"Unknown sampling method {method}")
+    rprint(f"Sweeping [green]{len(variants)}[/green] variants of {len(keys)} parameters with [b]{method}[/b]")
+    if count_only:
+        return len(variants)
+    nanoparticles: list[tuple[str, Nanoparticle]] = [build_fuzzed_nanoparticle(path, **params) for params in variants]
+    params_by_id: dict[str, dict[str, float]] = {nano.id: params for params, (_, nano) in zip(variants, nanoparticles)}
+    rows: dict[str, dict] = {}
+    lock = threading.Lock()
+    fieldnames = [*keys, "atoms", "ratio", "magnetization", "folder"]
+    if output is not None:
+        with open(output, "w", newline="") as f:
+            csv.DictWriter(f, fieldnames=fieldnames).writeheader()
+
+    def record(nano: Nanoparticle | None, nano_id: str):
+        row = _sweep_row(params_by_id[nano_id], nano)
+        with lock:
+            if nano_id in rows:
+                return
+            rows[nano_id] = row
+            if output is not None:
+                with open(output, "a", newline="") as f:
+                    csv.DictWriter(f, fieldnames=fieldnames).writerow(row)
+
+    def on_progress(task, **_):
+        nano: Nanoparticle | None = task[0].nanoparticle if task[0] is not None else None
+        if nano is not None and nano.id in params_by_id:
+            record(nano, nano.id)
+
+    results = executor_service.execute_nanoparticles(nanoparticles, at=at, test=test, listeners=[on_progress])
+    # Queues that run in other processes do not stream their progress, record what is missing
+    for _, nano in results:
+        if nano.id in params_by_id:
+            record(nano, nano.id)
+    for nano_id in params_by_id:
+        if nano_id not in rows:
+            record(None, nano_id)
+
+    table = rich.table.Table(title=f"Sweep of {path.name}")
+    for column in fieldnames:
+        table.add_column(column)
+    for nano_id in params_by_id:
+        row = rows[nano_id]
+        table.add_row(*[
+            "-" if row[key] is None else (f"{row[key]:.4f}" if isinstance(row[key], float) else str(row[key]))
+            for key in fieldnames
+        ])
+    console.print(table)
+    return [rows[nano_id] for nano_id in params_by_id]
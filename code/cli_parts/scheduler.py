@@ -1,14 +1,22 @@
 from pathlib import Path
+from typing import Optional
 
+import rich.table
 import typer
 from rich import print as rprint
 
+from config import config
+from config.config import DESIRED_ATOM_COUNT
+
 from lammps.nanoparticle import Nanoparticle
 from remote.execution_queue.execution_queue import ExecutionQueue
 from remote.execution_queue.mixed_execution_queue import MixedExecutionQueue, render_queue_plan
 from remote.execution_queue.slurm_execution_queue import minutes_to_slurm
 from service import executor_service
+from service.calibration import calibrate as calibrate_queue, save_calibration
 from service.executor_service import get_executor
+from service.journal import ExecutionJournal
+from service.runtime_model import RuntimeModel, get_runtime_model
 
 sched = typer.Typer(add_completion=False, no_args_is_help=True, name="sched")
 
@@ -39,6 +47,11 @@ def schedule(
         1,
         help="Time tolerance",
         show_default=True
+    ),
+    processes: Optional[int] = typer.Option(
+        None,
+        help="Processes used to parse the shapes (defaults to the number of cores)",
+        show_default=True
     )
 ):
     """
@@ -48,12 +61,92 @@ def schedule(
         [],
         Path("../Shapes"),
         seed,
-        seed_count
+        seed_count,
+        processes
     )
     queue: ExecutionQueue = get_executor(at)
-    for path, np in nanoparticles:
-        np.schedule_execution(execution_queue=queue, test_run=test)
+    Nanoparticle.schedule_executions([np for _, np in nanoparticles], execution_queue=queue, test_run=test)
     if isinstance(queue, MixedExecutionQueue):
         queue.schedule(test)
     estimated_min = max(render_queue_plan(queue, is_test=test, tolerance=tolerance))
     rprint(f"Estimated time: {minutes_to_slurm(estimated_min, tolerance=tolerance)}")
+
+
+@sched.command()
+def runtime(
+    path: Path = typer.Option(
+        config.LOCAL_EXECUTION_PATH,
+        help="Folder with the executions to learn from",
+        show_default=True
+    ),
+    atoms: int = typer.Option(
+        DESIRED_ATOM_COUNT,
+        help="Atom count of the example predictions",
+        show_default=True
+    )
+):
+    """
+    Refresh the runtime model from the completed executions
+    """
+    machines: dict[str, str] = ExecutionJournal().machines() if config.JOURNAL_ENABLED else {}
+    samples = RuntimeModel.collect(path, machines)
+    if len(samples) == 0:
+        rprint(f"[red]No completed executions with a known machine in {path}[/red]")
+        raise typer.Exit(1)
+    model = RuntimeModel.fit(samples)
+    model.save()
+    get_runtime_model.cache_clear()
+    table = rich.table.Table(title=f"Runtime model ({len(samples)} executions)")
+    for column in ["Machine", "Runs", "Scale", "Atom exp.", "Thread exp.", "Overhead", f"Full run ({atoms} atoms, 1 thread)"]:
+        table.add_column(column)
+    for machine, runtime_ in model.machines.items():
+        full_run = runtime_.predict(atoms, 1, config.FULL_RUN_DURATION)
+        table.add_row(
+            f"[cyan]{machine}[/cyan]",
+            str(runtime_.samples),
+            "-" if runtime_.scale is None else f"{runtime_.scale:.3e}",
+            f"{runtime_.atom_exponent:.2f}",
+            f"{runtime_.thread_exponent:.2f}",
+            f"{runtime_.overhead:.1f}s",
+            "-" if full_run is None else minutes_to_slurm(full_run / 60, 1.0),
+        )
+    rprint(table)
+    rprint(f"Saved to {config.RUNTIME_MODEL_PATH}")
+
+
+@sched.command()
+def calibrate(
+    at: str = typer.Option(
+        "local",
+        help="Machine to calibrate, optionally with the tasks it runs at the same time (e.g. toko/mini:16)",
+        show_default=True
+    ),
+    steps: int = typer.Option(
+        config.CALIBRATION_STEPS,
+        help="Steps of every benchmark simulation",
+        show_default=True
+    )
+):
+    """
+    Measure the launch time and single core completion time of a machine with a small benchmark
+    """
+    queue: ExecutionQueue = get_executor(at)
+    if isinstance(queue, MixedExecutionQueue):
+        rprint("[red]Calibrate one machine at a time[/red]")
+        raise typer.Exit(1)
+    machine = queue.remote
+    try:
+        calibration = calibrate_queue(queue, steps)
+    except AssertionError as e:
+        rprint(f"[red]{e}[/red]")
+        raise typer.Exit(1)
+    save_calibration(calibration)
+    table = rich.table.Table(title=f"Calibration of {machine.name} ({calibration.samples} runs of {steps} steps)")
+    for column in ["", "Before", "Calibrated"]:
+        table.add_column(column)
+    table.add_row("Launch time", f"{machine.launch_time:.1f}s", f"{calibration.launch_time:.1f}s")
+    table.add_row("Single core completion time", minutes_to_slurm(machine.single_core_completion_time / 60, 1.0),
+                  minutes_to_slurm(calibration.single_core_completion_time / 60, 1.0))
+    table.add_row("Cost per atom step", "-", f"{calibration.cost:.3e}s")
+    rprint(table)
+    rprint(f"Saved to {config.CALIBRATION_PATH}")
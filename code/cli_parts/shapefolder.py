@@ -1,6 +1,6 @@
 import os
 from pathlib import Path
-from typing import Annotated, Any
+from typing import Annotated, Any, Optional
 
 import matplotlib.pyplot as plt
 import pandas as pd
@@ -9,11 +9,13 @@ import typer
 from rich import print as rprint
 
 from config import config
-from lammps import poorly_coded_parser as parser, nanoparticle_locator
+from lammps import poorly_coded_parser as parser
 import service.executor_service
 from cli_parts.number_highlighter import console
 from cli_parts.ui_utils import do_plots, correct_highlighter
+from lammps.fingerprint import Fingerprint, FingerprintIndex
 from lammps.nanoparticle import Nanoparticle
+from lammps.nanoparticle_locator import ShapeIndex
 from service.executor_service import execute_nanoparticles
 from utils import parse_nanoparticle_name, assign_nanoparticle_name
 
@@ -21,16 +23,22 @@ shapefolder = typer.Typer(add_completion=False, no_args_is_help=True, name="shap
 
 
 @shapefolder.command()
-def ls(path: Path = Path("../Shapes"), plot_stats: bool = False, by: str = 'Shape'):
+def ls(path: Path = Path("../Shapes"), plot_stats: bool = False, by: str = 'Shape',
+       shape: Annotated[Optional[str], typer.Option(help="Only this shape")] = None,
+       distribution: Annotated[Optional[str], typer.Option(help="Only this distribution (or distribution type)")] = None,
+       interface: Annotated[Optional[str], typer.Option(help="Only this interface")] = None,
+       pores: Annotated[Optional[str], typer.Option(help="Only this pore configuration")] = None):
     """
     List available nanoparticles in folder
     """
+    paths = ShapeIndex.load(path).paths(shape=shape, distribution=distribution, interface=interface, pores=pores)
     table = rich.table.Table(title="Available nanoparticles", show_footer=True)
     for column in ["Index", "Path", "Shape", "Distribution", "Interface", "Pores", "Index", "R"]:
         table.add_column(column)
     data: list[dict[str, Any]] = []
     total_random = 0
-    for i, (path, nano) in enumerate(parser.PoorlyCodedParser.load_shapes(path, [])):
+    i = -1
+    for i, (path, nano) in enumerate(parser.PoorlyCodedParser.load_shapes_from_paths(paths)):
         shape, distribution, interface, pores, index = parse_nanoparticle_name(path)
         pathl = Path(path)
         table.add_row(
@@ -104,7 +112,7 @@ def parseshapes(
     at: Annotated[
         str,
         typer.Option(
-            help="Possible values: [b u]toko[/b u], [b u]toko:thread_count[/b u], [b u]local[/b u], [b u]local:thread_count[/b u]",
+            help="Possible values: [b u]toko[/b u], [b u]toko:thread_count[/b u], [b u]local[/b u], [b u]local:thread_count[/b u], [b u]local:cores=core_count[/b u], [b u]local:shared=thread_count[/b u], [b u]local:auto[/b u]",
             show_default=True
         )
     ] = "local",
@@ -136,6 +144,20 @@ def parseshapes(
             show_default=True
         )
     ] = False,
+    processes: Annotated[
+        Optional[int],
+        typer.Option(
+            help="Processes used to parse the shapes (defaults to the number of cores)",
+            show_default=True
+        )
+    ] = None,
+    resume: Annotated[
+        bool,
+        typer.Option(
+            help="Resume an interrupted run: skip completed simulations and finish the interrupted ones",
+            show_default=True
+        )
+    ] = False,
 ) -> list[tuple[str, Nanoparticle]] | int:
     """
     Runs all nanoparticle simulations in a folder
@@ -146,12 +168,13 @@ def parseshapes(
         [],
         path,
         seed,
-        seed_count
+        seed_count,
+        processes
     )
     if count_only:
         rprint(f"Found [green]{len(nanoparticles)}[/green] nanoparticle shapes.")
         return len(nanoparticles)
-    nanoparticles = execute_nanoparticles(nanoparticles, at, test)
+    nanoparticles = execute_nanoparticles(nanoparticles, at, test, resume=resume)
     table = rich.table.Table(title="Nanoparticle run results", show_footer=True)
     df: pd.DataFrame = pd.DataFrame([nanoparticle.asdict() for _, nanoparticle in nanoparticles])
     df.drop(columns=["np"], inplace=True)
@@ -261,20 +284,32 @@ def get_region(path: Path) -> int:
 
 
 @shapefolder.command()
-def find_dupes(path: Path = Path("../Shapes")):
+def find_dupes(
+    path: Path = Path("../Shapes"),
+    tolerance: Annotated[
+        float,
+        typer.Option(
+            help="Also report shapes whose atoms differ by at most this fraction (0 to only report exact duplicates)",
+            show_default=True
+        )
+    ] = 0.02,
+):
     """
-    Find duplicate nanoparticle shapes
+    Find nanoparticle shapes that produce the same atoms, up to rotations and reflections of the box
     """
-    gen = nanoparticle_locator.NanoparticleLocator.search(path)
-    hashes = {}
-    for path in gen:
-        _, nano = parser.PoorlyCodedParser.parse_single_shape(path)
-        region = nano.build(seeds=[123 for _ in nano.seed_values]).get_region()
-        h = hash(region)
-        if h in hashes:
-            rprint(f"Duplicate found: {path} and {hashes[h]}")
-        else:
-            hashes[h] = path
+    builders, errors = parser.PoorlyCodedParser.load_shapes_parallel(path, [])
+    for shape, error in errors:
+        rprint(f"[red]Could not parse {shape}[/red]: {error}")
+    index = FingerprintIndex()
+    for key, nano in builders:
+        index.add(key, Fingerprint.of_nanoparticle(nano.build(seeds=[123 for _ in nano.seed_values])))
+    groups = index.exact_duplicates()
+    for group in groups:
+        rprint("[yellow]Duplicates:[/yellow] " + ", ".join([os.path.relpath(key) for key in group]))
+    near = index.near_duplicates(tolerance) if tolerance > 0 else []
+    for key, other_key, distance in near:
+        rprint(f"[cyan]Near duplicates[/cyan] ({distance} atoms differ): {os.path.relpath(key)}, {os.path.relpath(other_key)}")
+    rprint(f"{len(builders)} shapes, [yellow]{len(groups)}[/yellow] groups of duplicates, [cyan]{len(near)}[/cyan] near duplicates")
 
 
 @shapefolder.command()
@@ -289,3 +324,16 @@ def inspect(path: Path):
     rprint(f"[bold underline green]Can seeds be modified?[/bold underline green] {is_random}")
     rprint(nano)
     rprint(region)
+
+
+@shapefolder.command()
+def clear_cache():
+    """
+    Remove every parsed shape from the parse cache
+    """
+    cache = parser.PoorlyCodedParser.get_parse_cache()
+    if cache is None:
+        rprint("[yellow]The parse cache is disabled[/yellow]")
+        return
+    removed = cache.clear()
+    rprint(f"Removed {removed} cached shapes from {cache.path}")
@@ -6,7 +6,8 @@ from pathlib import Path, PurePosixPath
 def load_machines():
     from remote.machine.local_machine import LocalMachine
     from remote.machine.machine_factory import MachineFactory
-    return {
+    from service.calibration import apply_calibrations
+    return apply_calibrations({
         'local': LocalMachine(Path(LOCAL_EXECUTION_PATH), Path(LAMMPS_EXECUTABLE)),
         'toko/mini': MachineFactory.toko('mini'),
         'toko/Small': MachineFactory.toko('Small'),
@@ -14,7 +15,7 @@ def load_machines():
         'toko/XL': MachineFactory.toko('XL'),
         'toko/XXL': MachineFactory.toko('XXL'),
         'toko/prueba': MachineFactory.toko('prueba'),
-    }
+    })
 
 
 LOG_LEVEL = logging.WARNING  # Levels: DEBUG, INFO, WARNING, ERROR, CRITICAL
@@ -24,6 +25,43 @@ SLURM_MULTI_TEMPLATE_PATH = Path("../slurm-multi.template").resolve().expanduser
 SSH_MULTI_TEMPLATE_PATH = Path("../ssh-multi.template").resolve().expanduser()  # Local path pointing to the slurm template
 LAMMPS_EXECUTABLE = Path("/tmp")  # Path to the lammps executable in local
 LOCAL_EXECUTION_PATH = Path("../executions").resolve().expanduser()  # Path in local where the simulations will be stored
+CACHE_PATH = Path("../.cache").resolve().expanduser()  # Path in local where persistent caches are stored
+FUZZER_CACHE_PATH = CACHE_PATH / "fuzzer.json"  # Evaluation cache for the multi-fidelity fuzzer
+PARSE_CACHE_PATH = CACHE_PATH / "parse"  # Parsed shape files, keyed by content hash
+SHAPE_INDEX_PATH = CACHE_PATH / "shapes"  # Listings of shape folders, see ShapeIndex
+PARSE_CACHE_ENABLED = True  # Reuse parsed shapes between invocations
+JOURNAL_PATH = CACHE_PATH / "journal.jsonl"  # State changes of executed tasks, used by --resume
+JOURNAL_ENABLED = True  # Record executions in the journal, so an interrupted invocation can be resumed
+QUARANTINE_PATH = CACHE_PATH / "quarantine.jsonl"  # Tasks that failed deterministically (e.g. LAMMPS input errors)
+RETRY_MAX_ATTEMPTS = 3  # Runs of a task failing transiently (lost connection, OOM kill, node failure) before giving up
+RETRY_BASE_DELAY = 30.0  # Seconds before the first retry, doubled on every attempt
+RETRY_MAX_DELAY = 600.0  # Longest wait between two attempts
+RETRY_FAILOVER = True  # Tasks that keep failing transiently on a machine of a mixed queue are run on another one
+RUNTIME_MODEL_PATH = CACHE_PATH / "runtime_model.json"  # Wall time predictor fitted on completed executions (sched runtime)
+CALIBRATION_PATH = CACHE_PATH / "calibration.json"  # Launch and single core completion times measured by `sched calibrate`
+CALIBRATION_EXECUTION_PATH = LOCAL_EXECUTION_PATH.parent / ".calibration"  # Path in local where the calibration simulations are stored, next to LOCAL_EXECUTION_PATH as the inputs load the potential from ../../
+CALIBRATION_STEPS = 2000  # Steps of every calibration simulation
+TRANSFER_LOG_PATH = CACHE_PATH / "transfers.jsonl"  # SFTP copies of the SSH machines, to measure their bandwidth and latency
+TRANSFER_RECENT = 200  # Copies of a machine its bandwidth and latency are fitted on
+TRANSFER_LOG_MAX_BYTES = 2 ** 20  # Size above which TRANSFER_LOG_PATH is cut down to the TRANSFER_RECENT copies of every machine
+TRANSFER_DEFAULT_BANDWIDTH = 5e6  # Bytes per second to an SSH machine without recorded copies
+TRANSFER_DEFAULT_LATENCY = 1.0  # Seconds per SFTP operation to an SSH machine without recorded copies
+SFTP_CONCURRENCY = 10  # SFTP copies in flight at once
+SSH_UPLOAD_MODE = "tar"  # How batches reach the SSH machines: "tar" streams them through one channel, "sftp" copies every folder
+SSH_TAR_COMPRESSION = 1  # Gzip level of the tar stream of the batches, 0 to send it uncompressed
+RESULT_STORE_PATH = CACHE_PATH / "results"  # Completed executions, keyed by the hash of their input
+RESULT_STORE_ENABLED = True  # Reuse completed executions with identical inputs instead of running them again
+POTENTIAL_PATH = Path("../FeCuNi.eam.alloy").resolve().expanduser()  # Potential used by lammps.template
+LAMMPS_IDENTITY: str | None = None  # Identifies the LAMMPS build in the result store, defaults to the local executable
+PARSER_STRICT = True  # Check that every parsed command renders back to the original line (slower)
+LOCAL_STDOUT_FILE: str | None = "lammps.out"  # Where local runs write their output (in the execution folder), None discards it
+LOCAL_PIN_CORES = True  # Pin every local run to its own CPUs (NUMA-local where possible), Linux only
+LOCAL_MIN_CORES = 1  # Bounds of the adaptive local concurrency (local:auto)
+LOCAL_MAX_CORES: int | None = None  # Defaults to the available CPUs
+LOCAL_MAX_LOAD = 1.0  # Load per CPU above which local:auto runs fewer simulations
+LOCAL_MIN_FREE_MEMORY = 2 * 2 ** 30  # Bytes of available memory below which local:auto runs fewer simulations
+LOCAL_TPAS_DEGRADATION = 0.2  # Relative tpas drop (recent runs against the best ones) that makes local:auto back off
+LOCAL_CONTROL_INTERVAL = 60.0  # Seconds between concurrency changes, the load average needs time to react
 LOCAL_MULTI_PY = Path("../multi.py").resolve().expanduser()  # Path in local to the multi.py file
 LOCAL_LAMMPS_NAME_WINDOWS = "lmp.exe"
 TOKO_PARTITION_TO_USE = "mini"
@@ -48,6 +86,7 @@ BATCH_EXECUTION: str = "Batch execution"  # Constant
 FINISHED_JOB: str = "Finished job"  # Constant
 NANOPARTICLE_IN: str = "nanoparticle.in"  # Constant
 LOG_LAMMPS: str = "log.lammps"  # Constant
+EXECUTION_METADATA: str = "execution.json"  # Constant
 DESIRED_ATOM_COUNT = 1250
 DESIRED_NI_RATIO = 0.3
 DESIRED_FE_RATIO = 1 - DESIRED_NI_RATIO
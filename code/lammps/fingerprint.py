@@ -0,0 +1,228 @@
+import hashlib
+import itertools
+from dataclasses import dataclass
+from functools import cached_property
+
+import numpy as np
+
+from config.config import NI_ATOM
+from lammps import shapes
+from lammps.lattice_estimator import LatticeEstimate, LatticeEstimator
+
+LATTICE_SPACING = 2.8665
+HALF_SPACING = LATTICE_SPACING / 2
+GRID_HALF = int(np.ceil(shapes.BOX_SIZE / HALF_SPACING))  # Cells on each side of the origin, in half lattice units
+GRID_SIZE = 2 * GRID_HALF + 1
+
+# Voxel codes
+EMPTY = 0
+FE = 1
+NI = 2
+RANDOM = 3  # Atom whose type is chosen at random (its final type depends on the seed)
+
+# The 48 rotations and reflections of the box axes, as (axis permutation, axes to mirror)
+ORIENTATIONS: list[tuple[tuple[int, ...], np.ndarray]] = [
+    (perm, np.array(flips, dtype=bool))
+    for perm in itertools.permutations(range(3))
+    for flips in itertools.product([False, True], repeat=3)
+]
+
+# One permutation MinHash over the (voxel, code) pairs, for the near duplicate buckets
+MINHASH_COUNT = 32
+MINHASH_BANDS = 8
+MINHASH_A = np.uint64(0x9E3779B97F4A7C15)
+MINHASH_B = np.uint64(0x632BE59BD9B4E019)
+
+
+def orient(coords: np.ndarray, orientation: tuple[tuple[int, ...], np.ndarray]) -> np.ndarray:
+    perm, flips = orientation
+    oriented = coords[:, perm]
+    return np.where(flips, GRID_SIZE - 1 - oriented, oriented)
+
+
+def flat_indices(coords: np.ndarray) -> np.ndarray:
+    coords = coords.astype(np.int64)
+    return (coords[:, 0] * GRID_SIZE + coords[:, 1]) * GRID_SIZE + coords[:, 2]
+
+
+def minhash(items: np.ndarray) -> np.ndarray:
+    """
+    Hash every item once (multiply-shift, the overflow is the modulo 2^64) and keep the minimum of each bin
+    """
+    signature = np.full(MINHASH_COUNT, np.iinfo(np.uint64).max, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        hashed = (items.astype(np.uint64) * MINHASH_A + MINHASH_B) >> np.uint64(16)
+    np.minimum.at(signature, (hashed % np.uint64(MINHASH_COUNT)).astype(np.intp), hashed // np.uint64(MINHASH_COUNT))
+    return signature
+
+
+@dataclass(frozen=True, eq=False)
+class Fingerprint:
+    """
+    Lattice occupancy of a nanoparticle in its canonical orientation.
+    coords are voxel indices in half lattice units (so every BCC site, with or without origin offsets, is a voxel)
+    and codes the content of each occupied voxel (FE, NI or RANDOM).
+    The canonical orientation is the smallest of the 48 box symmetries, so symmetric copies share the digest.
+    """
+    coords: np.ndarray
+    codes: np.ndarray
+    fe_count: int  # Fe atoms, not counting the random atoms
+    ni_count: int  # Ni atoms, not counting the random atoms
+    random_selections: tuple[tuple[int, int], ...] = ()
+
+    @staticmethod
+    def of_estimate(estimate: LatticeEstimate) -> 'Fingerprint':
+        coords = np.rint(estimate.positions / HALF_SPACING).astype(np.int64) + GRID_HALF
+        coords = np.clip(coords, 0, GRID_SIZE - 1)
+        codes = np.where(estimate.types == NI_ATOM, NI, FE).astype(np.uint8)
+        if estimate.randomized is not None:
+            codes[estimate.randomized] = RANDOM
+        best: tuple[bytes, np.ndarray, np.ndarray] | None = None
+        for orientation in ORIENTATIONS:
+            oriented = orient(coords, orientation)
+            indices = flat_indices(oriented)
+            order = np.argsort(indices, kind="stable")
+            sparse = indices[order].astype("<i4").tobytes() + codes[order].tobytes()
+            if best is None or sparse < best[0]:
+                best = (sparse, oriented[order], codes[order])
+        # The type of random atoms depends on the seed, so only the other atoms are counted
+        return Fingerprint(best[1], best[2], int(np.count_nonzero(codes == FE)), int(np.count_nonzero(codes == NI)),
+                           estimate.random_selections)
+
+    @staticmethod
+    def of_nanoparticle(nano) -> 'Fingerprint':
+        return Fingerprint.of_estimate(LatticeEstimator.estimate_nanoparticle(nano))
+
+    @property
+    def atom_count(self) -> int:
+        return int(self.codes.shape[0])
+
+    @cached_property
+    def dense(self) -> np.ndarray:
+        grid = np.zeros((GRID_SIZE, GRID_SIZE, GRID_SIZE), dtype=np.uint8)
+        grid[tuple(self.coords.T)] = self.codes
+        return grid
+
+    @cached_property
+    def bits(self) -> bytes:
+        """
+        Packed bitset of the canonical grid, two bits per voxel
+        """
+        grid = self.dense
+        return np.packbits(np.stack([grid & 1, grid >> 1]).astype(bool)).tobytes()
+
+    @cached_property
+    def digest(self) -> str:
+        counts = f"{self.fe_count}:{self.ni_count}:{self.random_selections}:{GRID_SIZE}".encode("utf-8")
+        return hashlib.sha256(counts + self.bits).hexdigest()
+
+    def signature(self, orientation: int = 0) -> np.ndarray:
+        """
+        MinHash signature of the (voxel, code) pairs
+        :param orientation: Index in ORIENTATIONS, 0 is the canonical orientation
+        """
+        return minhash(flat_indices(orient(self.coords, ORIENTATIONS[orientation])) * 4 + self.codes)
+
+    def count_distance(self, other: 'Fingerprint') -> int:
+        """
+        Atoms that differ according to the atom counts, and the number of atoms changed by random selections
+        """
+        changed = [count for count, _ in self.random_selections]
+        other_changed = [count for count, _ in other.random_selections]
+        length = max(len(changed), len(other_changed))
+        changed += [0] * (length - len(changed))
+        other_changed += [0] * (length - len(other_changed))
+        random_distance = sum(abs(a - b) for a, b in zip(changed, other_changed))
+        return max(abs(self.fe_count - other.fe_count), abs(self.ni_count - other.ni_count), random_distance)
+
+    def distance(self, other: 'Fingerprint', orientations: list[int] | None = None) -> int:
+        """
+        Number of atoms that differ, in the best alignment of the two fingerprints.
+        That is the number of voxels whose content differs, or the difference in Fe or Ni atoms when it is larger
+        (atoms chosen at random are the same voxels, but not necessarily the same number of changed atoms)
+        :param other: The other fingerprint
+        :param orientations: Orientations of this fingerprint to try (indices in ORIENTATIONS), defaults to all
+        """
+        grid = other.dense
+        lower_bound = self.count_distance(other)
+        best = self.atom_count + other.atom_count
+        for orientation in range(len(ORIENTATIONS)) if orientations is None else orientations:
+            oriented = orient(self.coords, ORIENTATIONS[orientation])
+            found = grid[tuple(oriented.T)]
+            overlap = int(np.count_nonzero(found))
+            same = int(np.count_nonzero(found == self.codes))
+            best = min(best, self.atom_count + other.atom_count - overlap - same)
+            if best <= lower_bound:
+                break
+        return max(best, lower_bound)
+
+
+class FingerprintIndex:
+    """
+    Library of fingerprints with exact (digest) and near duplicate (Hamming distance) search.
+    Near duplicates are found through MinHash buckets, so only shapes sharing a bucket are compared.
+    """
+    fingerprints: dict[str, Fingerprint]
+    buckets: dict[tuple[int, bytes], list[str]]
+
+    def __init__(self):
+        self.fingerprints = {}
+        self.buckets = {}
+
+    @staticmethod
+    def _bands(signature: np.ndarray) -> list[tuple[int, bytes]]:
+        rows = MINHASH_COUNT // MINHASH_BANDS
+        return [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(MINHASH_BANDS)]
+
+    def add(self, key: str, fingerprint: Fingerprint) -> None:
+        self.fingerprints[key] = fingerprint
+        # Stored in the canonical orientation, queries try every orientation
+        for bucket in FingerprintIndex._bands(fingerprint.signature()):
+            self.buckets.setdefault(bucket, []).append(key)
+
+    def exact_duplicates(self) -> list[list[str]]:
+        groups: dict[str, list[str]] = {}
+        for key, fingerprint in self.fingerprints.items():
+            groups.setdefault(fingerprint.digest, []).append(key)
+        return [group for group in groups.values() if len(group) > 1]
+
+    def candidates(self, key: str) -> dict[str, list[int]]:
+        """
+        Shapes sharing a bucket with a shape
+        :param key: The shape
+        :return: For every candidate, the orientations of the shape that matched it
+        """
+        found: dict[str, list[int]] = {}
+        fingerprint = self.fingerprints[key]
+        for orientation in range(len(ORIENTATIONS)):
+            matches = set()
+            for bucket in FingerprintIndex._bands(fingerprint.signature(orientation)):
+                matches.update(self.buckets.get(bucket, []))
+            for match in matches:
+                found.setdefault(match, []).append(orientation)
+        found.pop(key, None)
+        return found
+
+    def near_duplicates(self, tolerance: float) -> list[tuple[str, str, int]]:
+        """
+        Pairs of shapes that differ in at most a fraction of their atoms, exact duplicates excluded
+        :param tolerance: Maximum distance, relative to the atom count of the larger shape
+        :return: (key, other key, distance) for every pair
+        """
+        pairs = []
+        compared: set[frozenset[str]] = set()
+        for key, fingerprint in self.fingerprints.items():
+            for other_key, orientations in self.candidates(key).items():
+                other = self.fingerprints[other_key]
+                pair = frozenset((key, other_key))
+                if pair in compared or other.digest == fingerprint.digest:
+                    continue
+                compared.add(pair)
+                max_distance = tolerance * max(fingerprint.atom_count, other.atom_count)
+                if fingerprint.count_distance(other) > max_distance:
+                    continue
+                # Only the alignments suggested by the buckets are compared
+                distance = fingerprint.distance(other, orientations)
+                if distance <= max_distance:
+                    pairs.append((key, other_key, distance))
+        return pairs
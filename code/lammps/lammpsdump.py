@@ -12,6 +12,8 @@ from utils import get_index, opt, column_values_as_float, read_local_file, write
 
 DATA_START_PATTERN = re.compile("Step\\s+Temp")
 DATA_END_PATTERN = re.compile("Loop time")
+OMP_THREADS_PATTERN = re.compile(r"MPI tasks x (\d+) OpenMP threads")
+TOTAL_WALL_TIME_PATTERN = re.compile(r"Total wall time: (\d+):(\d+):(\d+)")
 LAST_N_MAGNETISM_AVG = (config.config_local.FULL_RUN_DURATION * 3) // 4
 
 
@@ -130,6 +132,22 @@ class LammpsLog:
     def exec_atoms(self) -> int:
         return self._exec_info['atoms']
 
+    @cached_property
+    def omp_threads(self) -> int:
+        match = OMP_THREADS_PATTERN.search("\n".join(self._content[self._df_end:]))
+        return 1 if match is None else int(match.group(1))
+
+    @cached_property
+    def total_wall_time(self) -> float | None:
+        """
+        Seconds LAMMPS ran, setup included (exec_time only covers the loop), None if it did not finish
+        """
+        match = TOTAL_WALL_TIME_PATTERN.search("\n".join(self._content[-10:]))
+        if match is None:
+            return None
+        hours, minutes, seconds = (int(group) for group in match.groups())
+        return float(hours * 3600 + minutes * 60 + seconds)
+
     @cached_property
     def _content(self) -> list[str]:
         if not self.path.exists():
@@ -0,0 +1,270 @@
+import re
+from dataclasses import dataclass
+from typing import Callable
+
+import numpy as np
+
+from config.config import FE_ATOM, NI_ATOM
+from lammps import shapes
+
+BCC_BASIS = np.array([[0.0, 0.0, 0.0], [0.5, 0.5, 0.5]])
+SPLIT_RE = re.compile(r"\s+")
+
+RegionMask = Callable[[np.ndarray], np.ndarray]
+
+
+@dataclass
+class LatticeEstimate:
+    """
+    Atoms produced by evaluating a nanoparticle region program on the lattice
+    """
+    positions: np.ndarray
+    types: np.ndarray
+    randomized: np.ndarray | None = None  # Atoms that were candidates of a random type selection
+    random_selections: tuple[tuple[int, int], ...] = ()  # (atoms changed, candidates) of every random selection
+
+    @property
+    def atom_count(self) -> int:
+        return int(self.types.shape[0])
+
+    def count_atoms_of_type(self, atom_type: int) -> int:
+        return int(np.count_nonzero(self.types == atom_type))
+
+    def atom_type_ratio(self, atom_type: int) -> float:
+        if self.atom_count == 0:
+            return 0.0
+        return self.count_atoms_of_type(atom_type) / self.atom_count
+
+    def __str__(self):
+        return f"LatticeEstimate(atoms={self.atom_count}, fe={self.count_atoms_of_type(FE_ATOM)}, ni={self.count_atoms_of_type(NI_ATOM)})"
+
+
+class LatticeEstimator:
+    """
+    Evaluates the normalised region program of a nanoparticle in Python.
+    Mirrors what LAMMPS does with the `lattice`, `region`, `create_atoms`, `set`, `group` and `delete_atoms`
+    commands inside the simulation box, so atom counts and type ratios can be known without running LAMMPS.
+    Random selections (type/subset, type/ratio) select the same number of atoms as LAMMPS, but not the same atoms.
+    """
+
+    def __init__(self, box_lo: float = -shapes.BOX_SIZE, box_hi: float = shapes.BOX_SIZE):
+        self.box_lo = box_lo
+        self.box_hi = box_hi
+        self.lattice_points: np.ndarray = np.empty((0, 3))
+        self.regions: dict[str, RegionMask] = {}
+        self.positions: np.ndarray = np.empty((0, 3))
+        self.types: np.ndarray = np.empty(0, dtype=int)
+        self.randomized: np.ndarray = np.empty(0, dtype=bool)
+        self.random_selections: list[tuple[int, int]] = []
+        self.groups: dict[str, np.ndarray] = {}
+
+    @staticmethod
+    def estimate(commands: list[str]) -> LatticeEstimate:
+        """
+        Evaluate a list of commands (as found in Nanoparticle.atom_manipulation)
+        :param commands: Normalised region commands, with seeds already replaced
+        :return: The resulting atoms
+        """
+        estimator = LatticeEstimator()
+        for command in commands:
+            estimator.run_command(command)
+        return estimator.result()
+
+    @staticmethod
+    def estimate_nanoparticle(nano) -> LatticeEstimate:
+        """
+        Evaluate the region program of a built nanoparticle
+        :param nano: A Nanoparticle (or anything with an atom_manipulation list)
+        :return: The resulting atoms
+        """
+        return LatticeEstimator.estimate(nano.atom_manipulation)
+
+    def result(self) -> LatticeEstimate:
+        return LatticeEstimate(self.positions.copy(), self.types.copy(), self.randomized.copy(),
+                               tuple(self.random_selections))
+
+    def run_command(self, command: str) -> None:
+        tokens = SPLIT_RE.split(command.strip())
+        if len(tokens) == 0 or tokens[0] == "" or tokens[0].startswith("#"):
+            return
+        name = tokens[0]
+        if name == "lattice":
+            self._lattice(tokens)
+        elif name == "region":
+            self._region(tokens)
+        elif name == "create_atoms":
+            self._create_atoms(tokens)
+        elif name == "set":
+            self._set(tokens)
+        elif name == "group":
+            self._group(tokens)
+        elif name == "delete_atoms":
+            self._delete_atoms(tokens)
+        else:
+            raise ValueError(f"Unknown command: {command}")
+
+    def _lattice(self, tokens: list[str]) -> None:
+        # lattice bcc 2.8665 [origin x y z]
+        assert tokens[1] == "bcc", f"Lattice {tokens[1]} is not supported"
+        spacing = float(tokens[2])
+        origin = np.zeros(3)
+        extra = tokens[3:]
+        for i in range(0, len(extra)):
+            if extra[i] == "origin":
+                origin = np.array([float(x) for x in extra[i + 1:i + 4]])
+        lo = int(np.floor(self.box_lo / spacing)) - 1
+        hi = int(np.ceil(self.box_hi / spacing)) + 1
+        cells = np.arange(lo, hi + 1)
+        grid = np.stack(np.meshgrid(cells, cells, cells, indexing="ij"), axis=-1).reshape(-1, 3)
+        points = ((grid[:, None, :] + BCC_BASIS[None, :, :] + origin).reshape(-1, 3)) * spacing
+        # Periodic box: lower bound included, upper bound excluded
+        inside = np.all((points >= self.box_lo) & (points < self.box_hi), axis=1)
+        self.lattice_points = points[inside]
+
+    def _region(self, tokens: list[str]) -> None:
+        name = tokens[1]
+        style = tokens[2]
+        args = tokens[3:]
+        if style == "intersect":
+            n = int(args[0])
+            masks = [self.regions[region] for region in args[1:1 + n]]
+            extra = args[1 + n:]
+            mask = LatticeEstimator._intersect(masks)
+        else:
+            mask, extra = LatticeEstimator._geometric_region(style, args)
+        if "side" in extra and extra[extra.index("side") + 1] == "out":
+            self.regions[name] = LatticeEstimator._outside(mask)
+        else:
+            self.regions[name] = mask
+
+    @staticmethod
+    def _intersect(masks: list[RegionMask]) -> RegionMask:
+        def inner(p: np.ndarray) -> np.ndarray:
+            result = np.ones(p.shape[0], dtype=bool)
+            for mask in masks:
+                result &= mask(p)
+            return result
+
+        return inner
+
+    @staticmethod
+    def _outside(mask: RegionMask) -> RegionMask:
+        return lambda p: ~mask(p)
+
+    @staticmethod
+    def _geometric_region(style: str, args: list[str]) -> tuple[RegionMask, list[str]]:
+        if style == "sphere":
+            x, y, z, r = [float(v) for v in args[:4]]
+            center = np.array([x, y, z])
+            return (lambda p: np.sum((p - center) ** 2, axis=1) <= r ** 2), args[4:]
+        if style == "ellipsoid":
+            x, y, z, rx, ry, rz = [float(v) for v in args[:6]]
+            center = np.array([x, y, z])
+            radii = np.array([rx, ry, rz])
+            return (lambda p: np.sum(((p - center) / radii) ** 2, axis=1) <= 1.0), args[6:]
+        if style == "plane":
+            values = [float(v) for v in args[:6]]
+            point = np.array(values[:3])
+            normal = np.array(values[3:])
+            return (lambda p: (p - point) @ normal >= 0), args[6:]
+        if style in ("cylinder", "cone"):
+            axis = "xyz".index(args[0])
+            others = [i for i in range(3) if i != axis]
+            if style == "cylinder":
+                c1, c2, radius, lo, hi = [float(v) for v in args[1:6]]
+                radlo, radhi = radius, radius
+                extra = args[6:]
+            else:
+                c1, c2, radlo, radhi, lo, hi = [float(v) for v in args[1:7]]
+                extra = args[7:]
+
+            def axial(p: np.ndarray) -> np.ndarray:
+                along = p[:, axis]
+                frac = (along - lo) / (hi - lo) if hi != lo else np.zeros_like(along)
+                radius_at = radlo + frac * (radhi - radlo)
+                dist_sq = (p[:, others[0]] - c1) ** 2 + (p[:, others[1]] - c2) ** 2
+                return (along >= lo) & (along <= hi) & (dist_sq <= radius_at ** 2)
+
+            return axial, extra
+        if style in ("prism", "block"):
+            if style == "prism":
+                xlo, xhi, ylo, yhi, zlo, zhi, xy, xz, yz = [float(v) for v in args[:9]]
+                extra = args[9:]
+            else:
+                xlo, xhi, ylo, yhi, zlo, zhi = [float(v) for v in args[:6]]
+                xy, xz, yz = 0.0, 0.0, 0.0
+                extra = args[6:]
+
+            def prism(p: np.ndarray) -> np.ndarray:
+                # Convert to the prism's fractional (lamda) coordinates
+                c = (p[:, 2] - zlo) / (zhi - zlo)
+                b = (p[:, 1] - ylo - c * yz) / (yhi - ylo)
+                a = (p[:, 0] - xlo - b * xy - c * xz) / (xhi - xlo)
+                return (a >= 0) & (a <= 1) & (b >= 0) & (b <= 1) & (c >= 0) & (c <= 1)
+
+            return prism, extra
+        raise ValueError(f"Unknown region type: {style}")
+
+    def _create_atoms(self, tokens: list[str]) -> None:
+        # create_atoms 1 region reg0
+        atom_type = int(tokens[1])
+        assert tokens[2] == "region", f"Unknown selector type: {tokens[2]}"
+        new_points = self.lattice_points[self.regions[tokens[3]](self.lattice_points)]
+        self.positions = np.concatenate([self.positions, new_points])
+        self.types = np.concatenate([self.types, np.full(new_points.shape[0], atom_type, dtype=int)])
+        self.randomized = np.concatenate([self.randomized, np.zeros(new_points.shape[0], dtype=bool)])
+        self.groups = {
+            group: np.concatenate([mask, np.zeros(new_points.shape[0], dtype=bool)])
+            for group, mask in self.groups.items()
+        }
+
+    def _select(self, selector_type: str, selector: str) -> np.ndarray:
+        if selector_type == "region":
+            return self.regions[selector](self.positions)
+        if selector_type == "group":
+            if selector == "all":
+                return np.ones(self.types.shape[0], dtype=bool)
+            return self.groups.get(selector, np.zeros(self.types.shape[0], dtype=bool))
+        raise ValueError(f"Unknown selector type: {selector_type}")
+
+    def _set(self, tokens: list[str]) -> None:
+        # set region reg0 type 2 / set group Fe type/subset 2 62 300 / set group Fe type/ratio 2 0.3 300
+        selected = np.flatnonzero(self._select(tokens[1], tokens[2]))
+        prop = tokens[3]
+        if prop == "type":
+            self.types[selected] = int(tokens[4])
+            self.randomized[selected] = False
+            return
+        if prop not in ("type/subset", "type/ratio"):
+            raise ValueError(f"Unknown set property: {prop}")
+        atom_type = int(tokens[4])
+        if prop == "type/subset":
+            count = int(tokens[5])
+        else:
+            count = int(float(tokens[5]) * selected.shape[0])
+        count = min(count, selected.shape[0])
+        rng = np.random.default_rng(int(tokens[6]))
+        self.randomized[selected] = True
+        self.random_selections.append((count, selected.shape[0]))
+        self.types[rng.choice(selected, size=count, replace=False)] = atom_type
+
+    def _group(self, tokens: list[str]) -> None:
+        # group Ni type 2 / group Fe region reg0
+        name = tokens[1]
+        if tokens[2] == "type":
+            mask = np.isin(self.types, [int(t) for t in tokens[3:]])
+        elif tokens[2] == "region":
+            mask = self.regions[tokens[3]](self.positions)
+        else:
+            raise ValueError(f"Unknown group property: {tokens[2]}")
+        if name in self.groups:
+            mask = mask | self.groups[name]
+        self.groups[name] = mask
+
+    def _delete_atoms(self, tokens: list[str]) -> None:
+        # delete_atoms region reg0 compress yes
+        keep = ~self._select(tokens[1], tokens[2])
+        self.positions = self.positions[keep]
+        self.types = self.types[keep]
+        self.randomized = self.randomized[keep]
+        self.groups = {group: mask[keep] for group, mask in self.groups.items()}
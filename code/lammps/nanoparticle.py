@@ -5,6 +5,7 @@ import re
 import subprocess
 import time
 from functools import cached_property, cache
+from multiprocessing.pool import ThreadPool
 from pathlib import Path
 from typing import AsyncGenerator
 
@@ -23,6 +24,9 @@ from lammps.simulation_task import SimulationTask
 from model.live_execution import LiveExecution
 from remote.execution_queue.execution_queue import ExecutionQueue
 from remote.machine.machine import Machine
+from remote.execution_queue import task_store
+from service import result_store, journal
+from service.journal import JournalEntry
 from utils import drop_index
 
 
@@ -37,6 +41,7 @@ class Nanoparticle:
     title: str
     local_path: Path
     extra_replacements: dict
+    input_hash: str | None
     coord: pd.DataFrame
     coord_fe: pd.DataFrame
     coord_ni: pd.DataFrame
@@ -58,6 +63,7 @@ class Nanoparticle:
         self.id = self._gen_identifier() if id_x is None else id_x
         self.local_path = (LOCAL_EXECUTION_PATH / self.id).resolve()
         self.run = None
+        self.input_hash = None
 
     @staticmethod
     def from_executed(path: Path):
@@ -79,6 +85,7 @@ class Nanoparticle:
         n.extra_replacements = n.run.extra_replacements
         n.region_name_map = {}
         n.title = n.run.title
+        n.input_hash = None
         return n
 
     @cached_property
@@ -272,21 +279,103 @@ class Nanoparticle:
         :param kwargs: Extra arguments to pass to the lammps run
         :return: A simulation task
         """
-        code = self._build_lammps_code(test_run)
+        return self._get_simulation_task(self._build_lammps_code(test_run), test_run, kwargs)
+
+    def _get_simulation_task(self, code: str, test_run: bool, kwargs: dict) -> SimulationTask:
         dumps, self.run = self._build_lammps_run(code, kwargs, test_run)
         sim_task = self.run.get_simulation_task(test_run)
         sim_task.add_callback(self.on_post_execution)
         sim_task.nanoparticle = self
+        sim_task.input_hash = self.input_hash
         return sim_task
 
-    def schedule_execution(self, execution_queue: ExecutionQueue, test_run: bool = True, **kwargs) -> None:
+    def _attach(self, folder: Path, code: str, test_run: bool, kwargs: dict) -> None:
+        """
+        Use an existing execution folder for this nanoparticle
+        """
+        self.local_path = folder
+        self.id = folder.name
+        _, self.run = self._build_lammps_run(code, kwargs, test_run)
+
+    def prepare_execution(self, test_run: bool = True, previous: dict[str, JournalEntry] | None = None,
+                          **kwargs) -> SimulationTask | None:
+        """
+        Generates a simulation task, unless an identical execution has already been completed.
+        In that case this nanoparticle is linked to the completed execution instead.
+        :param test_run: If true, only one dump will be generated
+        :param previous: Previous executions by input hash, to resume them (see ExecutionJournal.latest)
+        :param kwargs: Extra arguments to pass to the lammps run
+        :return: The simulation task, or None if a completed execution is reused
+        """
+        code = self._build_lammps_code(test_run)
+        self.input_hash = result_store.ResultStore.key(code)
+        resume_from = None if previous is None else previous.get(self.input_hash)
+        if resume_from is not None:
+            if journal.is_completed(resume_from.folder):
+                logging.info(f"Resuming: nanoparticle {self.title} already completed in {resume_from.folder}")
+                self._attach(resume_from.folder, code, test_run, kwargs)
+                if resume_from.state != task_store.DONE:
+                    # LAMMPS finished, but the process that ran it did not get to handle the results
+                    self.on_post_execution("")
+                return None
+            if resume_from.state in (task_store.PENDING, task_store.RUNNING) and os.path.isdir(resume_from.folder):
+                # Interrupted, it runs again in the same folder (a remote batch still running it is re-attached)
+                self._attach(resume_from.folder, code, test_run, kwargs)
+                return self._get_simulation_task(code, test_run, kwargs)
+        store = result_store.get_result_store()
+        if store is None:
+            return self._get_simulation_task(code, test_run, kwargs)
+        dumps, _ = self._build_lammps_run(code, kwargs, test_run)
+        existing = store.lookup(self.input_hash, [*dumps, "log.lammps"])
+        if existing is None:
+            return self._get_simulation_task(code, test_run, kwargs)
+        logging.info(f"Reusing execution {existing} for nanoparticle {self.title}")
+        self._attach(existing, code, test_run, kwargs)
+        return None
+
+    def schedule_execution(self, execution_queue: ExecutionQueue, test_run: bool = True, **kwargs) -> bool:
         """
         Schedules the execution of this nanoparticle
         :param execution_queue: The execution queue to use
         :param test_run: If true, only one dump will be generated
         :param kwargs: Extra arguments to pass to the lammps run
+        :return: False if a completed execution was reused instead
         """
-        execution_queue.enqueue(self.get_simulation_task(test_run, **kwargs))
+        task = self.prepare_execution(test_run, **kwargs)
+        if task is None:
+            return False
+        execution_queue.enqueue(task)
+        return True
+
+    @staticmethod
+    def schedule_executions(nanoparticles: list['Nanoparticle'], execution_queue: ExecutionQueue,
+                            test_run: bool = True, threads: int | None = None,
+                            execution_journal: journal.ExecutionJournal | None = None, resume: bool = False,
+                            **kwargs) -> list['Nanoparticle']:
+        """
+        Schedules the execution of many nanoparticles, rendering and writing their LAMMPS inputs in parallel
+        :param nanoparticles: The nanoparticles, they are enqueued in this order
+        :param execution_queue: The execution queue to use
+        :param test_run: If true, only one dump will be generated
+        :param threads: Threads used to write the inputs, defaults to the number of cores
+        :param execution_journal: Journal recording the executions
+        :param resume: Skip the executions the journal knows as completed, and run interrupted ones in their folder
+        :param kwargs: Extra arguments to pass to the lammps run
+        :return: The nanoparticles that reuse a completed execution, and were not enqueued
+        """
+        if len(nanoparticles) == 0:
+            return []
+        execution_queue.set_journal(execution_journal)
+        previous = execution_journal.latest() if resume and execution_journal is not None else None
+        with ThreadPool(threads) as pool:
+            tasks = pool.map(lambda nano: nano.prepare_execution(test_run, previous, **kwargs), nanoparticles)
+        reused = []
+        for nano, task in zip(nanoparticles, tasks):
+            if task is None:
+                reused.append(nano)
+            else:
+                execution_queue.enqueue(task)
+        return reused
 
     def on_post_execution(self, result: str | None) -> None:
         """
@@ -307,6 +396,9 @@ class Nanoparticle:
                     'dump': os.path.basename(self.run.dumps[FULL_RUN_DURATION].path)
                 }
             )
+        store = result_store.get_result_store()
+        if store is not None and self.input_hash is not None:
+            store.put(self.input_hash, self.local_path)
 
     @cached_property
     def lammps_log_path(self) -> Path:
@@ -331,7 +423,7 @@ class Nanoparticle:
         return dumps, lammps_run
 
     def _build_lammps_code(self, test_run):
-        return template.TemplateUtils.replace_with_doc(template.TemplateUtils.get_lammps_template(), {
+        return template.TemplateUtils.render_with_doc(template.TemplateUtils.get_compiled_lammps_template(), {
             "region": self.get_region(),
             "run_steps": str(0 if test_run else FULL_RUN_DURATION),
             "title": f"{self.title}",
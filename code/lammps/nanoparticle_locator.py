@@ -1,8 +1,17 @@
 import itertools
+import json
+import logging
 import os
+from dataclasses import dataclass, asdict
 from pathlib import Path
 from typing import Generator
 
+import utils
+from config.config import SHAPE_INDEX_PATH
+from utils import NanoparticleName
+
+SHAPE_INDEX_VERSION = 1
+
 
 class NanoparticleLocator:
 	@staticmethod
@@ -13,13 +22,16 @@ class NanoparticleLocator:
 		:param extension:  The extension to search for
 		:return: A generator of all files with the given extension in the given path
 		"""
-		for file in os.listdir(path):
-			if file.startswith("Test"):
+		with os.scandir(path) as entries:
+			entries = list(entries)
+		for entry in entries:
+			if entry.name.startswith("Test"):
 				continue
-			if os.path.isdir(path / file):
-				yield from NanoparticleLocator.search(path / file, extension)
-			elif file.endswith(extension):
-				yield path / file
+			# DirEntry caches the file type from the directory listing, so this does not stat on most filesystems
+			if entry.is_dir():
+				yield from NanoparticleLocator.search(path / entry.name, extension)
+			elif entry.name.endswith(extension):
+				yield path / entry.name
 
 	@staticmethod
 	def sorted_search(path: Path, extension: str = ".in") -> Generator[Path, None, None]:
@@ -29,13 +41,26 @@ class NanoparticleLocator:
 		:param extension:   The extension to search for
 		:return:
 		"""
-		for file in sorted(os.listdir(path)):
-			if file.startswith("Test"):
+		for entry, _ in NanoparticleLocator._sorted_walk(path, extension, {}):
+			yield path / entry
+
+	@staticmethod
+	def _sorted_walk(path: Path, extension: str, dirs: dict[str, int],
+					 relative: str = "") -> Generator[tuple[str, os.DirEntry], None, None]:
+		"""
+		Sorted walk yielding (path relative to the root, entry), and recording the mtime of every directory visited
+		"""
+		dirs[relative] = os.stat(path).st_mtime_ns
+		with os.scandir(path) as entries:
+			entries = sorted(entries, key=lambda e: e.name)
+		for entry in entries:
+			if entry.name.startswith("Test"):
 				continue
-			if os.path.isdir(path / file):
-				yield from NanoparticleLocator.sorted_search(path / file, extension)
-			elif file.endswith(extension):
-				yield path / file
+			child = entry.name if relative == "" else f"{relative}/{entry.name}"
+			if entry.is_dir():
+				yield from NanoparticleLocator._sorted_walk(path / entry.name, extension, dirs, child)
+			elif entry.name.endswith(extension):
+				yield child, entry
 
 	@staticmethod
 	def get_a_particle(path: Path = Path("../Shapes"), extension: str = ".in", index: int = 0) -> Path:
@@ -46,5 +71,117 @@ class NanoparticleLocator:
 		:param index:  The index of the particle to return
 		:return:
 		"""
+		if extension == ShapeIndex.EXTENSION:
+			return ShapeIndex.load(path).entries[index].path
 		generator = NanoparticleLocator.search(path, extension)
 		return next(itertools.islice(generator, index, None))
+
+
+@dataclass
+class ShapeEntry:
+	path: Path
+	size: int
+	mtime: int
+	shape: str | None
+	distribution: str | None
+	interface: str | None
+	pores: str | None
+	index: str | None
+
+	def matches(self, shape: str | None = None, distribution: str | None = None, interface: str | None = None,
+				pores: str | None = None) -> bool:
+		"""
+		Whether the entry matches every given filter.
+		A filter matches the whole field or its first dot separated part (e.g. "Multilayer" matches "Multilayer.2.Axis.X")
+		"""
+		for value, field in ((shape, self.shape), (distribution, self.distribution), (interface, self.interface),
+							 (pores, self.pores)):
+			if value is not None and (field is None or (value != field and value != field.split(".")[0])):
+				return False
+		return True
+
+
+class ShapeIndex:
+	"""
+	Persisted listing of a shapes folder, with the parsed name of every shape.
+	It is rebuilt when the modification time of any directory in the tree changes (a file was added, removed or renamed).
+	"""
+	EXTENSION: str = ".in"
+	root: Path
+	dirs: dict[str, int]
+	entries: list[ShapeEntry]
+
+	def __init__(self, root: Path, dirs: dict[str, int], entries: list[ShapeEntry]):
+		self.root = root
+		self.dirs = dirs
+		self.entries = entries
+
+	@staticmethod
+	def build(root: Path) -> 'ShapeIndex':
+		dirs: dict[str, int] = {}
+		entries = []
+		for relative, entry in NanoparticleLocator._sorted_walk(root, ShapeIndex.EXTENSION, dirs):
+			stat = entry.stat()
+			name = NanoparticleName.parse(entry.name)
+			entries.append(ShapeEntry(root / relative, stat.st_size, stat.st_mtime_ns, name.shape, name.distribution,
+									  name.interface, name.pores, name.index))
+		return ShapeIndex(root, dirs, entries)
+
+	def is_valid(self) -> bool:
+		for relative, mtime in self.dirs.items():
+			try:
+				if os.stat(self.root / relative).st_mtime_ns != mtime:
+					return False
+			except FileNotFoundError:
+				return False
+		return True
+
+	@staticmethod
+	def index_path(root: Path) -> Path:
+		return SHAPE_INDEX_PATH / f"{utils.hash_content(str(root.resolve()))[:16]}.json"
+
+	@staticmethod
+	def load(root: Path, persist: bool = True) -> 'ShapeIndex':
+		"""
+		Load the index of a shapes folder, rebuilding it if the folder changed
+		:param root: The shapes folder
+		:param persist: Whether to read and write the index on disk
+		:return: An up-to-date index
+		"""
+		index_path = ShapeIndex.index_path(root)
+		if persist and os.path.isfile(index_path):
+			try:
+				index = ShapeIndex.from_dict(root, json.loads(utils.read_local_file(index_path)))
+				if index is not None and index.is_valid():
+					return index
+			except (json.JSONDecodeError, KeyError, TypeError):
+				logging.warning(f"Ignoring corrupted shape index {index_path}")
+		index = ShapeIndex.build(root)
+		if persist:
+			index.save(index_path)
+		return index
+
+	@staticmethod
+	def from_dict(root: Path, data: dict) -> 'ShapeIndex | None':
+		if data["version"] != SHAPE_INDEX_VERSION:
+			return None
+		entries = [ShapeEntry(**{**entry, "path": root / entry["path"]}) for entry in data["entries"]]
+		return ShapeIndex(root, data["dirs"], entries)
+
+	def save(self, index_path: Path) -> None:
+		os.makedirs(index_path.parent, exist_ok=True)
+		data = {
+			"version": SHAPE_INDEX_VERSION,
+			"dirs": self.dirs,
+			"entries": [{**asdict(entry), "path": entry.path.relative_to(self.root).as_posix()} for entry in self.entries],
+		}
+		tmp_path = index_path.with_suffix(f".{os.getpid()}.tmp")
+		utils.write_local_file(tmp_path, json.dumps(data))
+		os.replace(tmp_path, index_path)
+
+	def filter(self, shape: str | None = None, distribution: str | None = None, interface: str | None = None,
+			   pores: str | None = None) -> list[ShapeEntry]:
+		return [entry for entry in self.entries if entry.matches(shape, distribution, interface, pores)]
+
+	def paths(self, **filters) -> list[Path]:
+		return [entry.path for entry in self.filter(**filters)]
@@ -1,10 +1,52 @@
 import json
+import re
 import typing
+from dataclasses import dataclass
 from typing_extensions import deprecated
 from lammps import shapes
 from lammps.nanoparticle import Nanoparticle
 
 SEED_LOCATOR = "zeed:"
+SEED_RE = re.compile(re.escape(SEED_LOCATOR) + r"(\d+)")
+
+
+@dataclass(frozen=True)
+class SeedProgram:
+    """
+    Atom manipulation commands split around their seed locators, so variants are produced by filling slots.
+    Each line is stored as (literals, seed indices), with one more literal than seed indices.
+    Matching the whole number of the locator avoids zeed:1 replacing the start of zeed:10.
+    """
+    lines: tuple[tuple[tuple[str, ...], tuple[int, ...]], ...]
+    seed_count: int
+
+    @staticmethod
+    def compile(atom_manipulation: list[str], seed_count: int) -> 'SeedProgram':
+        lines = []
+        for line in atom_manipulation:
+            parts = SEED_RE.split(line)
+            indices = tuple(int(i) for i in parts[1::2])
+            for i in indices:
+                if i >= seed_count:
+                    raise Exception(f"Seed {SEED_LOCATOR}{i} is out of range, there are {seed_count} seeds")
+            lines.append((tuple(parts[0::2]), indices))
+        return SeedProgram(tuple(lines), seed_count)
+
+    def fill(self, seeds: list) -> list[str]:
+        if len(seeds) != self.seed_count:
+            raise Exception(f"Expected {self.seed_count} seeds, got {len(seeds)}")
+        values = [str(seed) for seed in seeds]
+        out = []
+        for literals, indices in self.lines:
+            if len(indices) == 0:
+                out.append(literals[0])
+                continue
+            parts = [literals[0]]
+            for index, literal in zip(indices, literals[1:]):
+                parts.append(values[index])
+                parts.append(literal)
+            out.append("".join(parts))
+        return out
 
 
 class NanoparticleBuilder:
@@ -110,6 +152,26 @@ class NanoparticleBuilder:
         self.atom_manipulation.append(command)
         return command
 
+    def to_state(self) -> dict:
+        """
+        Parsed state of the builder, everything but the title
+        """
+        return {
+            "regions": self.regions,
+            "atom_manipulation": self.atom_manipulation,
+            "region_name_map": self.region_name_map,
+            "seed_values": self.seed_values,
+        }
+
+    @staticmethod
+    def from_state(state: dict, title: str = "Nanoparticle") -> 'NanoparticleBuilder':
+        nano = NanoparticleBuilder(title=title)
+        nano.regions = state["regions"]
+        nano.atom_manipulation = state["atom_manipulation"]
+        nano.region_name_map = state["region_name_map"]
+        nano.seed_values = state["seed_values"]
+        return nano
+
     def get_seed_count(self) -> int:
         return len(self.seed_values)
 
@@ -117,20 +179,30 @@ class NanoparticleBuilder:
         return self.get_seed_count() > 0
 
     def build(self, seeds=None, **kwargs):
-        seeds = self.seed_values if seeds is None else seeds
-        nano = Nanoparticle({'title': self.title, 'seeds': json.dumps(seeds), **kwargs})
-        nano.regions = self.regions
-        nano.atom_manipulation = self.atom_manipulation
-        nano.region_name_map = self.region_name_map
-        nano.atom_manipulation = self.replace_seeds(nano.atom_manipulation, self.get_seed_count(), seeds)
-        return nano
+        return self.build_variants([self.seed_values if seeds is None else seeds], **kwargs)[0]
+
+    def build_variants(self, seed_lists: list[list], **kwargs) -> list[Nanoparticle]:
+        """
+        Build one nanoparticle per list of seeds, compiling the seed slots only once
+        :param seed_lists: A list with the seeds of every variant
+        :param kwargs: Extra replacements for every variant
+        :return: The nanoparticles, in the order of seed_lists
+        """
+        program = self.compile_seeds()
+        nanos = []
+        for seeds in seed_lists:
+            nano = Nanoparticle({'title': self.title, 'seeds': json.dumps(seeds), **kwargs})
+            nano.regions = self.regions
+            nano.region_name_map = self.region_name_map
+            nano.atom_manipulation = program.fill(seeds)
+            nanos.append(nano)
+        return nanos
+
+    def compile_seeds(self) -> SeedProgram:
+        return SeedProgram.compile(self.atom_manipulation, self.get_seed_count())
 
     def replace_seeds(self, atom_manipulation: list[str], seed_count: int, seeds: list[int]):
-        if len(seeds) != seed_count:
-            raise Exception(f"Expected {seed_count} seeds, got {len(seeds)}")
-        for i in range(0, seed_count):
-            atom_manipulation = [x.replace(SEED_LOCATOR + str(i), str(seeds[i])) for x in atom_manipulation]
-        return atom_manipulation
+        return SeedProgram.compile(atom_manipulation, seed_count).fill(seeds)
 
     def new_seed(self, seed):
         self.seed_values.append(seed)
@@ -0,0 +1,62 @@
+import logging
+import os
+import pickle
+from pathlib import Path
+
+import utils
+from lammps.nanoparticlebuilder import NanoparticleBuilder
+
+
+class ParseCache:
+    """
+    On-disk cache of parsed shape files.
+    Each entry stores the state of a NanoparticleBuilder in its own pickle, named after the hash of the file contents,
+    the parser version and the parsing mode, so editing a shape or changing the parser invalidates it naturally.
+    """
+    path: Path
+    version: str
+
+    def __init__(self, path: Path, version: str):
+        self.path = path
+        self.version = version
+
+    def key(self, content: bytes, full_file: bool, strict: bool) -> str:
+        # A lenient parse never ran the round-trip check, so it cannot answer a strict one
+        return utils.hash_content(f"{self.version}:{int(full_file)}:{int(strict)}:".encode("utf-8") + content)
+
+    def entry_path(self, key: str) -> Path:
+        return self.path / key[:2] / f"{key}.pickle"
+
+    def get(self, key: str, title: str) -> NanoparticleBuilder | None:
+        entry_path = self.entry_path(key)
+        if not os.path.isfile(entry_path):
+            return None
+        try:
+            with open(entry_path, "rb") as f:
+                return NanoparticleBuilder.from_state(pickle.load(f), title=title)
+        except Exception as e:
+            logging.warning(f"Ignoring corrupted parse cache entry {entry_path}: {e}")
+            return None
+
+    def put(self, key: str, nano: NanoparticleBuilder) -> None:
+        entry_path = self.entry_path(key)
+        try:
+            os.makedirs(entry_path.parent, exist_ok=True)
+            # Write then rename, so concurrent readers never see a partial entry
+            tmp_path = entry_path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp_path, "wb") as f:
+                pickle.dump(nano.to_state(), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, entry_path)
+        except OSError as e:
+            logging.warning(f"Could not write parse cache entry {entry_path}: {e}")
+
+    def clear(self) -> int:
+        """
+        Remove every entry of the cache
+        :return: Number of removed entries
+        """
+        removed = 0
+        for entry in self.path.glob("*/*.pickle"):
+            entry.unlink()
+            removed += 1
+        return removed
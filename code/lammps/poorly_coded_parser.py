@@ -1,159 +1,65 @@
+import os
 import re
+import traceback
+from multiprocessing.pool import Pool
 from pathlib import Path
-from typing import Generator
+from typing import Generator, Callable
 
 from lammps import nanoparticlebuilder, shapes as s
 import template
-from lammps.nanoparticle_locator import NanoparticleLocator
+from config.config import PARSE_CACHE_PATH, PARSE_CACHE_ENABLED, PARSER_STRICT
+from lammps.nanoparticle_locator import NanoparticleLocator, ShapeIndex
+from lammps.parse_cache import ParseCache
+
+# Bump whenever the parser or NanoparticleBuilder output changes, so cached parses are invalidated
+PARSER_VERSION = "1"
+TOKEN_RE = re.compile(r"\s+")
+
+# handler(tokens, nano, strict): adds the command to the builder. When strict, it also checks the round trip
+CommandHandler = Callable[[list[str], nanoparticlebuilder.NanoparticleBuilder, bool], None]
+# Extracts the sub-style of a command from its tokens, e.g. "sphere" in "region a sphere 0 0 0 1 units box"
+SubStyleLocator = Callable[[list[str]], str]
 
 
 class PoorlyCodedParser:
     """
     Parse a lammps file and generate a Nanoparticle instance.
-    The code isn't great, but at least it's somewhat tested now
+    The code isn't great, but at least it's somewhat tested now.
+    Commands are dispatched through a table keyed by (command, sub-style), see register.
     """
+    handlers: dict[tuple[str, str | None], CommandHandler] = {}
+    sub_style_locators: dict[str, SubStyleLocator] = {}
 
     @staticmethod
-    def parse_region(line: str,
-                     nano: nanoparticlebuilder.NanoparticleBuilder) -> None | s.Shape:
-        # Remove multiple spaces
-        line = PoorlyCodedParser.split_command(line)
-        region_name = line[1]
-        region_type = line[2]
-        region_args = line[3:]
-        # Parse region
-        if region_type == "cylinder":
-            # region cylinder x 0 0 10 -22.5 22.5 units box
-            axis = region_args[0]
-            coord_a = float(region_args[1])
-            coord_b = float(region_args[2])
-            radius = float(region_args[3])
-            neg_length = float(region_args[4])
-            pos_length = float(region_args[5])
-            extra = region_args[6:]
-            assert extra[0] == "units", f"Unknown units: {extra[0]}"
-            assert extra[1] == "box", f"Unknown box: {extra[1]}"
-            extra = extra[2:]
-            full_length = abs(pos_length - neg_length)
-            coord_c = (pos_length + neg_length) / 2.0
-            shape = None
-            if axis == "x":
-                shape = s.Cylinder(radius, full_length, axis, (coord_c, coord_a, coord_b), check_in_box=False)
-            elif axis == "y":
-                shape = s.Cylinder(radius, full_length, axis, (coord_a, coord_c, coord_b), check_in_box=False)
-            elif axis == "z":
-                shape = s.Cylinder(radius, full_length, axis, (coord_a, coord_b, coord_c), check_in_box=False)
-            assert PoorlyCodedParser.is_correct_parsing(line, shape.get_region(
-                region_name)), f"Region {region_name} is not parsed correctly: \n{PoorlyCodedParser.split_command(shape.get_region(region_name))} != \n{line}"
-            nano.add_named_shape(shape, region_name, extra)
-            # logging.debug(shape)
-            return shape
-        elif region_type == "sphere":
-            # region sphere 0 0 0 10 units box
-            coord_a = float(region_args[0])
-            coord_b = float(region_args[1])
-            coord_c = float(region_args[2])
-            radius = float(region_args[3])
-            extra = region_args[4:]
-            assert extra[0] == "units", f"Unknown units: {extra[0]}"
-            assert extra[1] == "box", f"Unknown box: {extra[1]}"
-            extra = extra[2:]
-            shape = s.Sphere(radius, (coord_a, coord_b, coord_c))
-            assert PoorlyCodedParser.is_correct_parsing(line, shape.get_region(
-                region_name)), f"Region {region_name} is not parsed correctly: \n{PoorlyCodedParser.split_command(shape.get_region(region_name))} != \n{line}"
-            nano.add_named_shape(shape, region_name, extra)
-            # logging.debug(shape)
-            return shape
-        elif region_type == "plane":
-            # region plane 0 0 0 0 0 1 units box
-            coord_a = float(region_args[0])
-            coord_b = float(region_args[1])
-            coord_c = float(region_args[2])
-            normal_a = float(region_args[3])
-            normal_b = float(region_args[4])
-            normal_c = float(region_args[5])
-            extra = region_args[6:]
-            assert extra[0] == "units", f"Unknown units: {extra[0]}"
-            assert extra[1] == "box", f"Unknown box: {extra[1]}"
-            extra = extra[2:]
-            shape = s.Plane((coord_a, coord_b, coord_c), (normal_a, normal_b, normal_c))
-            assert PoorlyCodedParser.is_correct_parsing(line, shape.get_region(
-                region_name)), f"Region {region_name} is not parsed correctly: \n{PoorlyCodedParser.split_command(shape.get_region(region_name))} != \n{line}"
-            nano.add_named_shape(shape, region_name, extra)
-            # logging.debug(shape)
-            return shape
-        elif region_type == "cone":
-            # region_args = ['z', '0.0', '0.0', '18', '1', '-21', '21', 'units', 'box']
-            axis = region_args[0]
-            coord_a = float(region_args[1])
-            coord_b = float(region_args[2])
-            radlo = float(region_args[3])
-            radhi = float(region_args[4])
-            lo = float(region_args[5])
-            hi = float(region_args[6])
-            extra = region_args[7:]
-            assert extra[0] == "units", f"Unknown units: {extra[0]}"
-            assert extra[1] == "box", f"Unknown box: {extra[1]}"
-            extra = extra[2:]
-            shape = s.Cone(axis, coord_a, coord_b, radlo, radhi, lo, hi)
-            assert PoorlyCodedParser.is_correct_parsing(line, shape.get_region(
-                region_name)), f"Region {region_name} is not parsed correctly: \n{PoorlyCodedParser.split_command(shape.get_region(region_name))} != \n{line}"
-            nano.add_named_shape(shape, region_name, extra)
-            # logging.debug(shape)
-            return shape
-        elif region_type == "prism":
-            # region 		sq prism -20 20 -3 3 -16 16 0 0 0 units box
-            xlo = float(region_args[0])
-            xhi = float(region_args[1])
-            ylo = float(region_args[2])
-            yhi = float(region_args[3])
-            zlo = float(region_args[4])
-            zhi = float(region_args[5])
-            xy = float(region_args[6])
-            xz = float(region_args[7])
-            yz = float(region_args[8])
-            extra = region_args[9:]
-            assert extra[0] == "units", f"Unknown units: {extra[0]}"
-            assert extra[1] == "box", f"Unknown box: {extra[1]}"
-            extra = extra[2:]
-            shape = s.Prism(xlo, xhi, ylo, yhi, zlo, zhi, xy, xz, yz)
-            assert PoorlyCodedParser.is_correct_parsing(line, shape.get_region(
-                region_name)), f"Region {region_name} is not parsed correctly: \n{PoorlyCodedParser.split_command(shape.get_region(region_name))} != \n{line}"
-            nano.add_named_shape(shape, region_name, extra)
-            # logging.debug(shape)
-            return shape
-        elif region_type == "intersect":
-            # region		halfns intersect 2 sq ce units box
-            n = int(region_args[0])
-            reg_ids = region_args[1:1 + n]
-            extra = region_args[1 + n:]
-            command = nano.add_intersect(reg_ids, region_name, extra)
-            # logging.debug(command)
-            return None
-        elif region_type == "ellipsoid":
-            # region ellipsoid 0 0 0 10 10 10 units box
-            coord_a = float(region_args[0])
-            coord_b = float(region_args[1])
-            coord_c = float(region_args[2])
-            radius_a = float(region_args[3])
-            radius_b = float(region_args[4])
-            radius_c = float(region_args[5])
-            extra = region_args[6:]
-            assert extra[0] == "units", f"Unknown units: {extra[0]}"
-            assert extra[1] == "box", f"Unknown box: {extra[1]}"
-            extra = extra[2:]
-            shape = s.Ellipsoid(coord_a, coord_b, coord_c, radius_a, radius_b, radius_c)
-            assert PoorlyCodedParser.is_correct_parsing(line, shape.get_region(
-                region_name)), f"Region {region_name} is not parsed correctly: \n{PoorlyCodedParser.split_command(shape.get_region(region_name))} != \n{line}"
-            nano.add_named_shape(shape, region_name, extra)
-            # logging.debug(shape)
-            return shape
-        else:
-            raise ValueError(f"Unknown region type: {region_type}")
+    def register(command: str, sub_style: str | None = None,
+                 handler: CommandHandler | None = None) -> Callable[[CommandHandler], CommandHandler] | CommandHandler:
+        """
+        Register the handler of a command, can be used as a decorator.
+        Commands with sub-styles need a sub-style locator, see register_sub_style_locator.
+        :param command: First token of the line, e.g. "region"
+        :param sub_style: Sub-style of the command, e.g. "sphere", or None if the command has none
+        :param handler: The handler, or None when used as a decorator
+        """
+
+        def inner(h: CommandHandler) -> CommandHandler:
+            PoorlyCodedParser.handlers[(command, sub_style)] = h
+            return h
+
+        return inner if handler is None else inner(handler)
+
+    @staticmethod
+    def register_sub_style_locator(command: str, locator: SubStyleLocator) -> None:
+        PoorlyCodedParser.sub_style_locators[command] = locator
+
+    @staticmethod
+    def split_command(line: str) -> list[str]:
+        return TOKEN_RE.split(line.strip())
 
     @staticmethod
     def is_correct_parsing(line: list[str], command: str) -> bool:
         parsed_command = PoorlyCodedParser.split_command(command)
+        if parsed_command == line[:len(parsed_command)]:
+            return True
         for x in range(0, len(parsed_command)):
             if (
                     parsed_command[x] != line[x]
@@ -167,160 +73,189 @@ class PoorlyCodedParser:
         return True
 
     @staticmethod
-    def parse_create_atoms(line: str, nano: nanoparticlebuilder.NanoparticleBuilder) -> None:
-        # Remove multiple spaces
-        line = PoorlyCodedParser.split_command(line)
-        atom_type = line[1]
-        selector_type = line[2]
-        selector_args = line[3:]
-        # Parse region
-        if selector_type == "region":
-            result = nano.add_create_atoms(atom_type, selector_args[0])
-            # logging.debug(result)
+    def parse_line(line: str, nano: nanoparticlebuilder.NanoparticleBuilder, strict: bool | None = None) -> None:
+        """
+        Parse a single line into the builder
+        :param line: The line
+        :param nano: The builder
+        :param strict: Check that every parsed command renders back to the original line, defaults to PARSER_STRICT
+        """
+        strict = PARSER_STRICT if strict is None else strict
+        tokens = PoorlyCodedParser.split_command(line)
+        command = tokens[0]
+        if command.startswith("#"):
             return
-        else:
-            raise ValueError(f"Unknown selector type: {selector_type}")
+        locator = PoorlyCodedParser.sub_style_locators.get(command)
+        try:
+            sub_style = None if locator is None else locator(tokens)
+        except IndexError:
+            raise ValueError(f"Incomplete {command} command: {line}")
+        handler = PoorlyCodedParser.handlers.get((command, sub_style))
+        if handler is None:
+            if locator is None:
+                raise ValueError(f"Unknown line: {line}")
+            raise ValueError(f"Unknown {command} style: {sub_style}")
+        handler(tokens, nano, strict)
 
     @staticmethod
-    def split_command(line: str) -> list[str]:
-        return re.split("\\s+", line.strip())
-
-    @staticmethod
-    def parse_set(line: str, nano: nanoparticlebuilder.NanoparticleBuilder) -> None:
-        # Remove multiple spaces
-        line = PoorlyCodedParser.split_command(line)
-        set_type = line[1]
-        set_args = line[2:]
-        # Parse region
-        if set_type == "region":
-            region_name = set_args[0]
-            prop = set_args[1]
-            if prop == "type":
-                value = set_args[2]
-                result = nano.add_set_type_region(value, region_name)
-                # logging.debug(result)
-                return
-            elif prop == "type/subset":
-                value = set_args[2]
-                count = set_args[3]
-                seed = set_args[4]
-                result = nano.add_set_type_subset_region(value, region_name, count, seed)
-                # logging.debug(result)
-                return
-            elif prop == "type/ratio":
-                value = set_args[2]
-                ratio = set_args[3]
-                seed = set_args[4]
-                result = nano.add_set_type_ratio_region(value, region_name, ratio, seed)
-                # logging.debug(result)
-                return
-            else:
-                raise ValueError(f"Unknown set property: {prop}")
-        elif set_type == "group":
-            group_name = set_args[0]
-            prop = set_args[1]
-            if prop == "type/subset":
-                value = set_args[2]
-                count = set_args[3]
-                seed = set_args[4]
-                result = nano.add_set_type_subset_group(value, group_name, count, seed)
-                assert PoorlyCodedParser.is_correct_parsing(line,
-                                                            result), f"Set type subset group {group_name} is not parsed correctly: \n{result} != \n{line}"
-                # logging.debug(result)
-                return
-            elif prop == "type/ratio":
-                value = set_args[2]
-                ratio = set_args[3]
-                seed = set_args[4]
-                result = nano.add_set_type_ratio_group(value, group_name, ratio, seed)
-                assert PoorlyCodedParser.is_correct_parsing(line,
-                                                            result), f"Set type ratio group {group_name} is not parsed correctly: \n{result} != \n{line}"
-                # logging.debug(result)
-                return
-            else:
-                raise ValueError(f"Unknown set property: {prop}")
+    def parse_shape(lines: list[str], nano: nanoparticlebuilder.NanoparticleBuilder,
+                    strict: bool | None = None) -> None:
+        for line in lines:
+            PoorlyCodedParser.parse_line(line, nano, strict)
+
+    @staticmethod
+    def add_region_shape(tokens: list[str], nano: nanoparticlebuilder.NanoparticleBuilder, strict: bool,
+                         shape: s.Shape, extra: list[str]) -> s.Shape:
+        """
+        Common tail of the geometric region handlers
+        :param tokens: The tokens of the region line
+        :param nano: The builder
+        :param strict: Whether to check the round trip
+        :param shape: The parsed shape
+        :param extra: The tokens after the shape arguments, starting with "units box"
+        """
+        region_name = tokens[1]
+        assert extra[0] == "units", f"Unknown units: {extra[0]}"
+        assert extra[1] == "box", f"Unknown box: {extra[1]}"
+        if strict:
+            assert PoorlyCodedParser.is_correct_parsing(tokens, shape.get_region(region_name)), \
+                f"Region {region_name} is not parsed correctly: \n{PoorlyCodedParser.split_command(shape.get_region(region_name))} != \n{tokens}"
+        nano.add_named_shape(shape, region_name, extra[2:])
+        return shape
+
+    @staticmethod
+    def region_cylinder(tokens: list[str], nano: nanoparticlebuilder.NanoparticleBuilder, strict: bool) -> None:
+        # region cylinder x 0 0 10 -22.5 22.5 units box
+        region_args = tokens[3:]
+        axis = region_args[0]
+        coord_a = float(region_args[1])
+        coord_b = float(region_args[2])
+        radius = float(region_args[3])
+        neg_length = float(region_args[4])
+        pos_length = float(region_args[5])
+        full_length = abs(pos_length - neg_length)
+        coord_c = (pos_length + neg_length) / 2.0
+        if axis == "x":
+            center = (coord_c, coord_a, coord_b)
+        elif axis == "y":
+            center = (coord_a, coord_c, coord_b)
+        elif axis == "z":
+            center = (coord_a, coord_b, coord_c)
         else:
-            raise ValueError(f"Unknown selector type: {set_type}")
+            raise ValueError(f"Unknown axis: {axis}")
+        shape = s.Cylinder(radius, full_length, axis, center, check_in_box=False)
+        PoorlyCodedParser.add_region_shape(tokens, nano, strict, shape, region_args[6:])
+
+    @staticmethod
+    def region_sphere(tokens: list[str], nano: nanoparticlebuilder.NanoparticleBuilder, strict: bool) -> None:
+        # region sphere 0 0 0 10 units box
+        region_args = tokens[3:]
+        coord_a, coord_b, coord_c, radius = [float(x) for x in region_args[:4]]
+        shape = s.Sphere(radius, (coord_a, coord_b, coord_c))
+        PoorlyCodedParser.add_region_shape(tokens, nano, strict, shape, region_args[4:])
+
+    @staticmethod
+    def region_plane(tokens: list[str], nano: nanoparticlebuilder.NanoparticleBuilder, strict: bool) -> None:
+        # region plane 0 0 0 0 0 1 units box
+        region_args = tokens[3:]
+        coord_a, coord_b, coord_c, normal_a, normal_b, normal_c = [float(x) for x in region_args[:6]]
+        shape = s.Plane((coord_a, coord_b, coord_c), (normal_a, normal_b, normal_c))
+        PoorlyCodedParser.add_region_shape(tokens, nano, strict, shape, region_args[6:])
+
+    @staticmethod
+    def region_cone(tokens: list[str], nano: nanoparticlebuilder.NanoparticleBuilder, strict: bool) -> None:
+        # region_args = ['z', '0.0', '0.0', '18', '1', '-21', '21', 'units', 'box']
+        region_args = tokens[3:]
+        axis = region_args[0]
+        coord_a, coord_b, radlo, radhi, lo, hi = [float(x) for x in region_args[1:7]]
+        shape = s.Cone(axis, coord_a, coord_b, radlo, radhi, lo, hi)
+        PoorlyCodedParser.add_region_shape(tokens, nano, strict, shape, region_args[7:])
+
+    @staticmethod
+    def region_prism(tokens: list[str], nano: nanoparticlebuilder.NanoparticleBuilder, strict: bool) -> None:
+        # region 		sq prism -20 20 -3 3 -16 16 0 0 0 units box
+        region_args = tokens[3:]
+        xlo, xhi, ylo, yhi, zlo, zhi, xy, xz, yz = [float(x) for x in region_args[:9]]
+        shape = s.Prism(xlo, xhi, ylo, yhi, zlo, zhi, xy, xz, yz)
+        PoorlyCodedParser.add_region_shape(tokens, nano, strict, shape, region_args[9:])
+
+    @staticmethod
+    def region_ellipsoid(tokens: list[str], nano: nanoparticlebuilder.NanoparticleBuilder, strict: bool) -> None:
+        # region ellipsoid 0 0 0 10 10 10 units box
+        region_args = tokens[3:]
+        coord_a, coord_b, coord_c, radius_a, radius_b, radius_c = [float(x) for x in region_args[:6]]
+        shape = s.Ellipsoid(coord_a, coord_b, coord_c, radius_a, radius_b, radius_c)
+        PoorlyCodedParser.add_region_shape(tokens, nano, strict, shape, region_args[6:])
+
+    @staticmethod
+    def region_intersect(tokens: list[str], nano: nanoparticlebuilder.NanoparticleBuilder, strict: bool) -> None:
+        # region		halfns intersect 2 sq ce units box
+        region_args = tokens[3:]
+        n = int(region_args[0])
+        nano.add_intersect(region_args[1:1 + n], tokens[1], region_args[1 + n:])
+
+    @staticmethod
+    def create_atoms_region(tokens: list[str], nano: nanoparticlebuilder.NanoparticleBuilder, strict: bool) -> None:
+        # create_atoms 1 region reg0
+        nano.add_create_atoms(tokens[1], tokens[3])
+
+    @staticmethod
+    def set_region_type(tokens: list[str], nano: nanoparticlebuilder.NanoparticleBuilder, strict: bool) -> None:
+        # set region reg0 type 2
+        nano.add_set_type_region(tokens[4], tokens[2])
+
+    @staticmethod
+    def set_region_type_subset(tokens: list[str], nano: nanoparticlebuilder.NanoparticleBuilder, strict: bool) -> None:
+        # set region reg0 type/subset 2 62 300
+        nano.add_set_type_subset_region(tokens[4], tokens[2], tokens[5], tokens[6])
+
+    @staticmethod
+    def set_region_type_ratio(tokens: list[str], nano: nanoparticlebuilder.NanoparticleBuilder, strict: bool) -> None:
+        # set region reg0 type/ratio 2 0.3 300
+        nano.add_set_type_ratio_region(tokens[4], tokens[2], tokens[5], tokens[6])
+
+    @staticmethod
+    def set_group_type_subset(tokens: list[str], nano: nanoparticlebuilder.NanoparticleBuilder, strict: bool) -> None:
+        # set group Fe type/subset 2 230 300
+        result = nano.add_set_type_subset_group(tokens[4], tokens[2], tokens[5], tokens[6])
+        if strict:
+            assert PoorlyCodedParser.is_correct_parsing(tokens, result), \
+                f"Set type subset group {tokens[2]} is not parsed correctly: \n{result} != \n{tokens}"
+
+    @staticmethod
+    def set_group_type_ratio(tokens: list[str], nano: nanoparticlebuilder.NanoparticleBuilder, strict: bool) -> None:
+        # set group Fe type/ratio 2 0.2 300
+        result = nano.add_set_type_ratio_group(tokens[4], tokens[2], tokens[5], tokens[6])
+        if strict:
+            assert PoorlyCodedParser.is_correct_parsing(tokens, result), \
+                f"Set type ratio group {tokens[2]} is not parsed correctly: \n{result} != \n{tokens}"
 
     @staticmethod
-    def parse_group(line: str, nano: nanoparticlebuilder.NanoparticleBuilder) -> None:
+    def group_type(tokens: list[str], nano: nanoparticlebuilder.NanoparticleBuilder, strict: bool) -> None:
         # group		Ni type 2
-        line = PoorlyCodedParser.split_command(line)
-        group_name = line[1]
-        prop = line[2]
-        if prop == "type":
-            value = line[3]
-            result = nano.add_group_type(value, group_name)
-            assert \
-                PoorlyCodedParser.is_correct_parsing(line, result), \
-                f"Group type {group_name} is not parsed correctly: \n{result} != \n{line}"
-            # logging.debug(result)
-            return
-        elif prop == "region":
-            region_name = line[3]
-            result = nano.add_group_region(region_name, group_name)
-            # logging.debug(result)
-            return
-        else:
-            raise ValueError(f"Unknown group property: {prop}")
+        result = nano.add_group_type(tokens[3], tokens[1])
+        if strict:
+            assert PoorlyCodedParser.is_correct_parsing(tokens, result), \
+                f"Group type {tokens[1]} is not parsed correctly: \n{result} != \n{tokens}"
+
+    @staticmethod
+    def group_region(tokens: list[str], nano: nanoparticlebuilder.NanoparticleBuilder, strict: bool) -> None:
+        # group Fe region reg0
+        nano.add_group_region(tokens[3], tokens[1])
 
     @staticmethod
-    def parse_delete_atoms(line, nano):
+    def delete_atoms_region(tokens: list[str], nano: nanoparticlebuilder.NanoparticleBuilder, strict: bool) -> None:
         # delete_atoms region v compress yes
-        line = PoorlyCodedParser.split_command(line)
-        selector_type = line[1]
-        # Parse region
-        if selector_type == "region":
-            region_name = line[2]
-            keywords = line[3:]  # [key1, value1, key2, value2, ...]
-            # keywords = {keywords[i]: keywords[i + 1] for i in range(0, len(keywords), 2)}
-            keywords = " ".join(keywords)
-            result = nano.add_delete_atoms_region(region_name, keywords)
-            # logging.debug(result)
-            return
-        else:
-            raise ValueError(f"Unknown selector type: {selector_type}")
+        nano.add_delete_atoms_region(tokens[2], " ".join(tokens[3:]))
 
     @staticmethod
-    def lattice(line: str, nano: nanoparticlebuilder.NanoparticleBuilder):
-        line = PoorlyCodedParser.split_command(line)
-        lattice_type = line[1]
-        lattice_spacing = line[2]
-        lattice_extra = line[3:]
+    def lattice(tokens: list[str], nano: nanoparticlebuilder.NanoparticleBuilder, strict: bool) -> None:
+        # lattice bcc 2.8665 origin 0 0 0.5
+        lattice_type = tokens[1]
+        lattice_spacing = tokens[2]
         assert lattice_type == "bcc", "Lattice is not BCC"
         assert lattice_spacing == "2.8665", "Lattice incorrect spacing"
-        nano.configure_lattice(lattice_type, lattice_spacing, lattice_extra)
-
-    @staticmethod
-    def parse_line(line: str, nano: nanoparticlebuilder.NanoparticleBuilder) -> None:
-        if line.startswith("#"):
-            # logging.debug(f"[blue]{line}[/blue]", extra={"markup": True})
-            pass
-        elif line.startswith("region"):
-            # logging.debug(f"[green]{line}[/green]", extra={"markup": True})
-            PoorlyCodedParser.parse_region(line, nano)
-        elif line.startswith("create_atoms"):
-            # logging.debug(f"[magenta bold]{line}[/magenta bold]", extra={"markup": True})
-            PoorlyCodedParser.parse_create_atoms(line, nano)
-        elif line.startswith("set"):
-            # logging.debug(f"[magenta]{line}[/magenta]", extra={"markup": True})
-            PoorlyCodedParser.parse_set(line, nano)
-        elif line.startswith("group"):
-            # logging.debug(f"[grey]{line}[/grey]", extra={"markup": True})
-            PoorlyCodedParser.parse_group(line, nano)
-        elif line.startswith("delete_atoms"):
-            # logging.debug(f"[red]{line}[/red]", extra={"markup": True})
-            PoorlyCodedParser.parse_delete_atoms(line, nano)
-        elif line.startswith("lattice"):
-            # logging.debug(f"[yellow]{line}[/yellow]", extra={"markup": True})
-            PoorlyCodedParser.lattice(line, nano)
-        else:
-            raise ValueError(f"Unknown line: {line}")
-
-    @staticmethod
-    def parse_shape(lines: list[str], nano: nanoparticlebuilder.NanoparticleBuilder) -> None:
-        for line in lines:
-            PoorlyCodedParser.parse_line(line, nano)
+        nano.configure_lattice(lattice_type, lattice_spacing, tokens[3:])
 
     @staticmethod
     def load_shapes(path: Path, ignore: list[str]) -> Generator[tuple[
@@ -336,26 +271,93 @@ class PoorlyCodedParser:
             yield PoorlyCodedParser.parse_single_shape(shape)
 
     @staticmethod
-    def parse_single_shape(shape_path: Path, full_file: bool = False, replacements: dict | None = None) -> tuple[
-        str, nanoparticlebuilder.NanoparticleBuilder]:
+    def load_shapes_parallel(path: Path, ignore: list[str], processes: int | None = None,
+                             chunk_size: int | None = None) -> tuple[
+        list[tuple[str, nanoparticlebuilder.NanoparticleBuilder]], list[tuple[Path, str]]]:
+        """
+        Parallel version of load_shapes
+        :param path: Folder with the shapes
+        :param ignore: Shapes whose path contains any of these strings are skipped
+        :param processes: Number of worker processes, defaults to the number of cores
+        :param chunk_size: Shapes sent to a worker at once, defaults to a few chunks per worker
+        :return: The parsed shapes in the same order as load_shapes, and the (path, error) of every shape that failed
+        """
+        paths = [shape for shape in ShapeIndex.load(path).paths()
+                 if not any([section in str(shape) for section in ignore])]
+        return PoorlyCodedParser.load_shapes_from_paths_parallel(paths, processes, chunk_size)
+
+    @staticmethod
+    def load_shapes_from_paths_parallel(paths: list[Path], processes: int | None = None,
+                                        chunk_size: int | None = None) -> tuple[
+        list[tuple[str, nanoparticlebuilder.NanoparticleBuilder]], list[tuple[Path, str]]]:
+        processes = processes or os.cpu_count() or 1
+        if len(paths) == 0:
+            return [], []
+        if chunk_size is None:
+            chunk_size = max(1, len(paths) // (processes * 4))
+        if processes == 1:
+            outcomes = [PoorlyCodedParser.try_parse_single_shape(shape) for shape in paths]
+        else:
+            with Pool(min(processes, len(paths))) as pool:
+                # map keeps the order of the input, so the sorted order is preserved
+                outcomes = pool.map(PoorlyCodedParser.try_parse_single_shape, paths, chunksize=chunk_size)
+        shapes: list[tuple[str, nanoparticlebuilder.NanoparticleBuilder]] = []
+        errors: list[tuple[Path, str]] = []
+        for shape, (result, error) in zip(paths, outcomes):
+            if error is not None:
+                errors.append((shape, error))
+            else:
+                shapes.append(result)
+        return shapes, errors
+
+    @staticmethod
+    def try_parse_single_shape(shape_path: Path) -> tuple[
+        tuple[str, nanoparticlebuilder.NanoparticleBuilder] | None, str | None]:
+        """
+        Parses a single shape file, returning the error instead of raising it
+        """
+        try:
+            return PoorlyCodedParser.parse_single_shape(shape_path), None
+        except Exception as e:
+            return None, "".join(traceback.format_exception_only(e)).strip()
+
+    @staticmethod
+    def parse_single_shape(shape_path: Path, full_file: bool = False, replacements: dict | None = None,
+                           strict: bool | None = None) -> tuple[str, nanoparticlebuilder.NanoparticleBuilder]:
         """
         Parses a single shape file
         :param shape_path:  Path to shape file
         :param full_file:  Whether to parse the full file (.shink) or just the first region (.in)
         :param replacements:  Dictionary of replacements to make in the shape file
+        :param strict:  Check the round trip of every parsed command, defaults to PARSER_STRICT
         :return:
         """
         replacements = replacements or {}
-        with open(shape_path, "r") as f:
-            # logging.debug(f"[yellow]=== {shape_path} ===[/yellow]", extra={"markup": True})
-            nano = nanoparticlebuilder.NanoparticleBuilder(title=shape_path.name)
-            lines = f.readlines()
-            if not full_file:
-                lines = PoorlyCodedParser.locate_relevant_lines(lines)
-            lines = [template.TemplateUtils.replace_templates(ll.strip(), replacements) for line in lines if
-                     (ll := line.strip()) != ""]
-            PoorlyCodedParser.parse_shape(lines, nano)
+        strict = PARSER_STRICT if strict is None else strict
+        with open(shape_path, "rb") as f:
+            content = f.read()
+        # Templated shapes depend on the replacements, so only plain parses are cached
+        cache = PoorlyCodedParser.get_parse_cache() if len(replacements) == 0 else None
+        key = cache.key(content, full_file, strict) if cache is not None else None
+        if cache is not None and (nano := cache.get(key, shape_path.name)) is not None:
             return str(shape_path.resolve()), nano
+        # logging.debug(f"[yellow]=== {shape_path} ===[/yellow]", extra={"markup": True})
+        nano = nanoparticlebuilder.NanoparticleBuilder(title=shape_path.name)
+        lines = content.decode("utf-8").splitlines(keepends=True)
+        if not full_file:
+            lines = PoorlyCodedParser.locate_relevant_lines(lines)
+        lines = [template.TemplateUtils.replace_templates(ll.strip(), replacements) for line in lines if
+                 (ll := line.strip()) != ""]
+        PoorlyCodedParser.parse_shape(lines, nano, strict)
+        if cache is not None:
+            cache.put(key, nano)
+        return str(shape_path.resolve()), nano
+
+    @staticmethod
+    def get_parse_cache() -> ParseCache | None:
+        if not PARSE_CACHE_ENABLED:
+            return None
+        return ParseCache(PARSE_CACHE_PATH, PARSER_VERSION)
 
     @staticmethod
     def locate_relevant_lines(lines):
@@ -372,3 +374,27 @@ class PoorlyCodedParser:
         assert len(out) > 0, \
             f"Could not find line that starts with {start} - Perhaps you meant to use full_file = True?"
         return out[0]
+
+
+PoorlyCodedParser.register_sub_style_locator("region", lambda tokens: tokens[2])
+PoorlyCodedParser.register_sub_style_locator("create_atoms", lambda tokens: tokens[2])
+PoorlyCodedParser.register_sub_style_locator("set", lambda tokens: f"{tokens[1]} {tokens[3]}")
+PoorlyCodedParser.register_sub_style_locator("group", lambda tokens: tokens[2])
+PoorlyCodedParser.register_sub_style_locator("delete_atoms", lambda tokens: tokens[1])
+PoorlyCodedParser.register("region", "cylinder", PoorlyCodedParser.region_cylinder)
+PoorlyCodedParser.register("region", "sphere", PoorlyCodedParser.region_sphere)
+PoorlyCodedParser.register("region", "plane", PoorlyCodedParser.region_plane)
+PoorlyCodedParser.register("region", "cone", PoorlyCodedParser.region_cone)
+PoorlyCodedParser.register("region", "prism", PoorlyCodedParser.region_prism)
+PoorlyCodedParser.register("region", "ellipsoid", PoorlyCodedParser.region_ellipsoid)
+PoorlyCodedParser.register("region", "intersect", PoorlyCodedParser.region_intersect)
+PoorlyCodedParser.register("create_atoms", "region", PoorlyCodedParser.create_atoms_region)
+PoorlyCodedParser.register("set", "region type", PoorlyCodedParser.set_region_type)
+PoorlyCodedParser.register("set", "region type/subset", PoorlyCodedParser.set_region_type_subset)
+PoorlyCodedParser.register("set", "region type/ratio", PoorlyCodedParser.set_region_type_ratio)
+PoorlyCodedParser.register("set", "group type/subset", PoorlyCodedParser.set_group_type_subset)
+PoorlyCodedParser.register("set", "group type/ratio", PoorlyCodedParser.set_group_type_ratio)
+PoorlyCodedParser.register("group", "type", PoorlyCodedParser.group_type)
+PoorlyCodedParser.register("group", "region", PoorlyCodedParser.group_region)
+PoorlyCodedParser.register("delete_atoms", "region", PoorlyCodedParser.delete_atoms_region)
+PoorlyCodedParser.register("lattice", None, PoorlyCodedParser.lattice)
@@ -1,10 +1,12 @@
 import dataclasses
 import os
+import uuid
 from dataclasses import field
 from pathlib import Path
 from typing import Callable, Any, Optional
 
 import utils
+from model.execution_metadata import ExecutionMetadata
 from opt import GPUOpt, MPIOpt, OMPOpt
 
 
@@ -19,6 +21,13 @@ class SimulationTask:
     callbacks: list[Callable[[str], None]] = field(default_factory=list)
     ok: bool = field(default_factory=lambda: True)
     nanoparticle: Optional['Nanoparticle'] = field(default_factory=lambda: None)
+    estimated_atoms: int | None = field(default_factory=lambda: None)  # Used to run the largest tasks first
+    metadata: ExecutionMetadata | None = field(default_factory=lambda: None)  # Set by the async local queue
+    task_id: str = field(default_factory=lambda: uuid.uuid4().hex)  # Identifies the task in the queues, see TaskStore
+    input_hash: str | None = field(default_factory=lambda: None)  # Identifies the input across invocations, see ResultStore.key
+    attempts: int = field(default_factory=lambda: 0)  # Failed runs on the current machine, see RetryPolicy
+    failure: str | None = field(default_factory=lambda: None)  # Class of the last failure, see retry_policy.classify
+    failed_on: list[str] = field(default_factory=list)  # Machines that gave up on the task (failover in mixed queues)
 
     def add_callback(self, callback: Callable[[str], None]):
         self.callbacks.append(callback)
@@ -61,6 +70,7 @@ class SimulationWrapper:
         :param file_to_use:
         :return:
         """
+        # CompiledTemplate checks its own placeholders, the values it inserts (shape regions) may still have some
         assert "{{" not in code, "Not all templates were replaced"
         os.makedirs(file_to_use.parent, exist_ok=True)
         utils.write_local_file(file_to_use, code)
@@ -0,0 +1,37 @@
+import json
+import os
+from dataclasses import dataclass, asdict
+from pathlib import Path
+
+import utils
+from config.config import EXECUTION_METADATA
+
+
+@dataclass
+class ExecutionMetadata:
+    """
+    Outcome of a LAMMPS process
+    """
+    exit_code: int | None  # None if the process could not be started (or, for remote runs, did not finish)
+    wall_time: float  # Seconds
+    stdout_path: Path | None  # None if the output was discarded
+    cores: list[int] | None = None  # CPUs the process was pinned to, None if it was not pinned
+    machine: str | None = None  # Name of the machine it ran on, see RuntimeModel
+
+    @property
+    def ok(self) -> bool:
+        return self.exit_code == 0
+
+    def save(self, folder: Path) -> None:
+        data = {**asdict(self), "stdout_path": None if self.stdout_path is None else str(self.stdout_path)}
+        utils.write_local_file(folder / EXECUTION_METADATA, json.dumps(data))
+
+    @staticmethod
+    def load(folder: Path) -> 'ExecutionMetadata | None':
+        if not os.path.isfile(folder / EXECUTION_METADATA):
+            return None
+        data = json.loads(utils.read_local_file(folder / EXECUTION_METADATA))
+        return ExecutionMetadata(**{**data, "stdout_path": None if data["stdout_path"] is None else Path(data["stdout_path"])})
+
+    def __str__(self):
+        return f"[exit {self.exit_code} - {self.wall_time:.1f}s]"
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import platform
+import subprocess
+import time
+from pathlib import Path
+
+from config.config import LOCAL_STDOUT_FILE, LOCAL_PIN_CORES, LOG_LAMMPS
+from lammps.lammpsdump import LammpsLog
+from lammps.simulation_task import SimulationTask
+from model.execution_metadata import ExecutionMetadata
+from remote.execution_queue.execution_queue import ExecutionQueue
+from remote.execution_queue.local_execution_queue import lammps_command, lammps_args, estimate_atoms
+from remote.execution_queue.task_store import TaskStore
+from remote.machine.affinity import AffinityManager
+from remote.machine.local_machine import LocalMachine
+from service.concurrency_controller import ConcurrencyController
+from service.core_budget import CoreBudget
+
+
+def run_tpas(simulation_task: SimulationTask) -> float | None:
+    try:
+        return LammpsLog(Path(simulation_task.local_cwd) / LOG_LAMMPS).tpas
+    except Exception as e:
+        logging.debug(f"No tpas for {simulation_task.local_cwd}: {e}")
+        return None
+
+
+class AsyncLocalExecutionQueue(ExecutionQueue):
+    """
+    Local queue running many LAMMPS processes from a single event loop (no thread per run).
+    Tasks are packed on the cores by their thread count (MPI x OMP), see CoreBudget,
+    and with pin_cores every run is pinned to its own CPUs, see AffinityManager.
+    With a controller the number of cores changes while the queue runs, see ConcurrencyController.
+    With runs at most that many processes run at once, whatever their thread count (local:N).
+    The output of every process goes straight to a file in its execution folder (or is discarded),
+    instead of being buffered in memory: the thermo output is in log.lammps anyway.
+    The exit code and wall time of every run are stored in SimulationTask.metadata.
+    Callbacks get the path of the output file ("" if it was discarded), or None if the run failed.
+    """
+    remote: LocalMachine
+
+    def __init__(self, remote: LocalMachine, cores: int, largest_first: bool = True,
+                 stdout_file: str | None = LOCAL_STDOUT_FILE, pin_cores: bool = LOCAL_PIN_CORES,
+                 controller: ConcurrencyController | None = None, runs: int | None = None):
+        super().__init__()
+        self.cores: int = cores
+        self.runs: int | None = runs
+        self.active: int = 0
+        self.controller: ConcurrencyController | None = controller
+        self.parallelism_count = cores if runs is None else min(cores, runs)
+        self.largest_first: bool = largest_first
+        self.stdout_file: str | None = stdout_file
+        self.pin_cores: bool = pin_cores
+        self.remote = remote
+        self.store = TaskStore()
+        self.completed: list[SimulationTask] = []
+        self.utilization: dict[str, float] = {}
+
+    def run(self) -> list[SimulationTask]:
+        return asyncio.run(self.main())
+
+    async def run_async(self) -> list[SimulationTask]:
+        return await self.main()
+
+    async def main(self) -> list[SimulationTask]:
+        if self.largest_first:
+            self.store.sort_pending(key=estimate_atoms, reverse=True)
+        total: int = self.store.pending_count
+        self.completed = []
+        budget = CoreBudget(self.cores)
+        affinity = AffinityManager.from_system() if self.pin_cores else None
+        if affinity is not None and affinity.cpu_count < self.cores:
+            logging.warning(f"Only {affinity.cpu_count} CPUs available for {self.cores} cores, some runs will not be pinned")
+        running: set[asyncio.Task] = set()
+        fits = lambda simulation_task: (self.runs is None or self.active < self.runs) and budget.fits(budget.demand(simulation_task))
+        while self.store.pending_count > 0 or len(running) > 0:
+            if self.controller is not None:
+                budget.resize(self.controller.update(budget.cores))
+            # The first pending task that fits the free cores, so small tasks fill the gaps left by larger ones
+            while (task := self.store.pop(fits)) is not None:
+                demand = budget.demand(task)
+                budget.acquire(demand)
+                self.active += 1
+                running.add(asyncio.create_task(self._run(task, demand, budget, affinity, total)))
+            timeout = None if self.controller is None else self.controller.interval
+            _, running = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        self.utilization = budget.utilization()
+        logging.info(f"Local cores utilization: {self.utilization['utilization']:.0%} "
+                     f"({self.utilization['busy_core_seconds']:.0f} of {self.utilization['capacity_core_seconds']:.0f} core-seconds)")
+        return self.completed
+
+    async def _run(self, task: SimulationTask, demand: int, budget: CoreBudget, affinity: AffinityManager | None,
+                   total: int) -> None:
+        result: str | None = None
+        error: Exception | None = None
+        cpus = None if affinity is None else affinity.acquire(demand)
+        try:
+            result = await self._simulate(task, cpus)
+            if result is not None and self.controller is not None and (tpas := run_tpas(task)) is not None:
+                self.controller.observe(tpas)
+        except Exception as e:
+            error = e
+            task.ok = False
+            logging.error(f"Error in {type(self)}: {e}")
+            logging.debug(f"Error in {type(self)}: {e}", exc_info=e, stack_info=True)
+        finally:
+            if cpus is not None:
+                affinity.release(cpus)
+            budget.release(demand)
+            self.active -= 1
+        if (delay := self._retry_delay(task, result, error)) is not None:
+            # The cores are free while it waits, this coroutine stays in the running set so the loop waits for it
+            await asyncio.sleep(delay)
+            self.store.retry(task)
+        else:
+            self.store.finish(task, result is not None and task.ok)
+            ExecutionQueue.run_callback(task, result)
+            self.completed.append(task)
+            self.dispatch_message(ExecutionQueue.PROGRESS, progress=len(self.completed), total=total, task=(task, result))
+
+    async def _simulate(self, simulation_task: SimulationTask, cpus: list[int] | None = None) -> str | None:
+        cmd = lammps_command(simulation_task, self.remote.lammps_executable)
+        logging.info(
+            f"[bold blue]AsyncLocalExecutionQueue[/bold blue] Running [bold yellow]{cmd}[/bold yellow] in [cyan]{simulation_task.local_cwd}[/cyan]",
+            extra={"markup": True, "highlighter": None}
+        )
+        stdout_path: Path | None = None if self.stdout_file is None else Path(simulation_task.local_cwd) / self.stdout_file
+        # The child writes to the file descriptor directly, nothing goes through this process
+        out = open(stdout_path, "wb") if stdout_path is not None else None
+        pinning = {}
+        if cpus is not None:
+            omp_threads = simulation_task.omp.n_threads if simulation_task.omp.use else 1
+            pinning = {"env": AffinityManager.environment(cpus, omp_threads), "preexec_fn": AffinityManager.pin(cpus)}
+        start = time.perf_counter()
+        try:
+            options = dict(cwd=simulation_task.local_cwd, stdout=subprocess.DEVNULL if out is None else out,
+                           stderr=subprocess.STDOUT, **pinning)
+            if platform.system() == "Windows":
+                process = await asyncio.create_subprocess_shell(lammps_args(cmd), **options)
+            else:
+                process = await asyncio.create_subprocess_exec(*lammps_args(cmd), **options)
+            exit_code = await process.wait()
+        except OSError as e:
+            simulation_task.ok = False
+            simulation_task.metadata = ExecutionMetadata(None, time.perf_counter() - start, stdout_path, cpus, self.remote.name)
+            raise ValueError(f"Is LAMMPS ({self.remote.lammps_executable}) installed?") from e
+        finally:
+            if out is not None:
+                out.close()
+        simulation_task.metadata = ExecutionMetadata(exit_code, time.perf_counter() - start, stdout_path, cpus, self.remote.name)
+        simulation_task.metadata.save(Path(simulation_task.local_cwd))
+        if exit_code != 0:
+            simulation_task.ok = False
+            logging.error(f"LAMMPS exited with code {exit_code} in {simulation_task.local_cwd} {simulation_task.metadata}")
+            return None
+        return "" if stdout_path is None else str(stdout_path)
+
+    def __str__(self):
+        runs = "" if self.runs is None else f", {self.runs} runs"
+        return f"{type(self).__name__}({self.cores} cores{runs}, {self.store.pending_count} items)"
@@ -1,15 +1,74 @@
+import asyncio
+import heapq
 import logging
+import time
 from abc import ABC, abstractmethod
 from lammps.simulation_task import SimulationTask
+from remote.execution_queue.retry_policy import RetryPolicy
+from remote.execution_queue.task_store import TaskStore
+from service.journal import ExecutionJournal
 from remote.machine.machine import Machine
 from pydispatch import dispatcher
 
 
 class ExecutionQueue(ABC):
     PROGRESS = "PROGRESS"
-    queue: list[SimulationTask]
+    store: TaskStore
     parallelism_count: int
     remote: Machine
+    retry_policy: RetryPolicy | None = None
+
+    @property
+    def name(self) -> str:
+        """
+        Name of the machine the queue runs on, recorded in SimulationTask.failed_on when its tasks fail over
+        """
+        return self.remote.name
+
+    @property
+    def queue(self) -> list[SimulationTask]:
+        """
+        Pending tasks, in order (a copy)
+        """
+        return self.store.pending_tasks()
+
+    def set_journal(self, journal: ExecutionJournal | None) -> None:
+        """
+        Record the state changes of the tasks of this queue (set before enqueueing)
+        """
+        self.store.journal = journal
+
+    def set_retry_policy(self, retry_policy: RetryPolicy | None) -> None:
+        """
+        Retry the failed runs of this queue according to a policy (without one, failed runs are not retried)
+        """
+        self.retry_policy = retry_policy
+
+    def reset(self) -> None:
+        """
+        Forget every task (e.g. between the rounds of a MixedExecutionQueue), keeping the journal
+        """
+        journal = self.store.journal
+        self.store = TaskStore()
+        self.store.journal = journal
+
+    def _retry_delay(self, simulation_task: SimulationTask, result: str | None, error: BaseException | None = None,
+                     output: str = "") -> float | None:
+        """
+        Ask the retry policy about a finished run
+        :param simulation_task: The task that ran
+        :param result: Result of the run, None if it failed
+        :param error: Exception raised by the run, if any
+        :param output: Extra output that may explain a failure
+        :return: Seconds to wait before running the task again, or None if it is finished (successfully or not)
+        """
+        if (result is not None and simulation_task.ok) or self.retry_policy is None:
+            return None
+        delay = self.retry_policy.on_failure(simulation_task, error, output)
+        if delay is not None:
+            logging.warning(f"Run in {simulation_task.local_cwd} failed ({simulation_task.failure}), "
+                            f"retrying in {delay:.0f}s (attempt {simulation_task.attempts + 1} of {self.retry_policy.max_attempts})")
+        return delay
 
     def enqueue(self, simulation_task: SimulationTask):
         """
@@ -23,8 +82,8 @@ class ExecutionQueue(ABC):
         assert simulation_task.mpi is not None
         assert simulation_task.omp is not None
         assert simulation_task.gpu is not None
-        assert simulation_task not in self.queue
-        self.queue.append(simulation_task)
+        assert simulation_task not in self.store
+        self.store.add(simulation_task)
 
     @abstractmethod
     def run(self) -> list[SimulationTask]:
@@ -34,6 +93,13 @@ class ExecutionQueue(ABC):
         """
         pass
 
+    async def run_async(self) -> list[SimulationTask]:
+        """
+        Run all simulation tasks from a running event loop (see MixedExecutionQueue).
+        Queues with their own event loop override it, the others run in a worker thread.
+        """
+        return await asyncio.to_thread(self.run)
+
     def dispatch_message(self, signal: str, **kwargs) -> None:
         dispatcher.send(**kwargs, signal=signal, sender=self)
 
@@ -59,45 +125,56 @@ class ExecutionQueue(ABC):
 
 
 class SingleExecutionQueue(ExecutionQueue, ABC):
-    queue: list[SimulationTask]
     completed: list[SimulationTask]
 
     def __init__(self, remote: Machine):
         super().__init__()
         self.remote = remote
-        self.queue = []
+        self.store = TaskStore()
         self.parallelism_count = 1
         self.completed = []
 
+    def reset(self) -> None:
+        super().reset()
+        self.completed = []
+
     def _get_next_task(self) -> SimulationTask | None:
-        if len(self.queue) == 0:
-            return None
-        element = self.queue[0]
-        self.queue = self.queue[1:]
-        return element
+        return self.store.pop()
 
     def print_error(self, e, **kwargs):
-        kwargs['queue'] = type(self)
-        kwargs['queue'] = len(self.queue)
+        kwargs['queue'] = type(self).__name__
+        kwargs['pending'] = self.store.pending_count
         params = "\n".join([f"{key}={value}" for key, value in kwargs.items()]) if kwargs else ""
         logging.error("ERROR:" + str(e) + " " + params, extra={"markup": True})
 
     def run(self) -> list[SimulationTask]:
-        total: int = len(self.queue)
-        while len(self.queue) > 0:
-            task: SimulationTask | None = self._get_next_task()
+        total: int = self.store.pending_count
+        # Tasks waiting out their retry backoff: (time they can run again, order, task), the others keep running meanwhile
+        backoff: list[tuple[float, int, SimulationTask]] = []
+        while True:
+            while len(backoff) > 0 and backoff[0][0] <= time.monotonic():
+                self.store.retry(heapq.heappop(backoff)[2])
+            if (task := self._get_next_task()) is None:
+                if len(backoff) == 0:
+                    break
+                # Nothing else to run until the first backoff ends
+                time.sleep(max(0.0, backoff[0][0] - time.monotonic()))
+                continue
             result: tuple[SimulationTask, str | None] = (task, None)
-            if task is None:
-                break
+            error: Exception | None = None
             try:
                 result = self._simulate(task)
             except Exception as e:
+                error = e
                 logging.error(f"Error in {type(self)}: {e}")
                 logging.debug(f"Error in {type(self)}: {e}", exc_info=e, stack_info=True)
-            finally:
-                self.completed.append(result[0])
-                ExecutionQueue.run_callback(result[0], result[1])
-                self.dispatch_message(ExecutionQueue.PROGRESS, progress=len(self.completed), total=total, task=result)
+            if (delay := self._retry_delay(task, result[1], error)) is not None:
+                heapq.heappush(backoff, (time.monotonic() + delay, len(self.completed) + len(backoff), task))
+                continue
+            self.store.finish(task, result[1] is not None and task.ok)
+            self.completed.append(result[0])
+            ExecutionQueue.run_callback(result[0], result[1])
+            self.dispatch_message(ExecutionQueue.PROGRESS, progress=len(self.completed), total=total, task=result)
         return self.completed
 
     @abstractmethod
@@ -105,4 +182,4 @@ class SingleExecutionQueue(ExecutionQueue, ABC):
         pass
 
     def __str__(self):
-        return f"{type(self).__name__}({len(self.queue)} items)"
+        return f"{type(self).__name__}({self.store.pending_count} items)"
@@ -1,15 +1,36 @@
 import logging
 import platform
 import re
+import shlex
 import subprocess
-from multiprocessing.pool import ThreadPool
+import threading
+import time
 from pathlib import PurePath
 
 from remote.execution_queue.execution_queue import SingleExecutionQueue, ExecutionQueue
+from remote.execution_queue.task_store import TaskStore
 from remote.machine.local_machine import LocalMachine
+from lammps.lattice_estimator import LatticeEstimator
 from lammps.simulation_task import SimulationTask
 
 
+def lammps_command(simulation_task: SimulationTask, lammps_executable: PurePath) -> str:
+    """
+    Command line of a run, with the paths quoted for the shell of the platform (see lammps_args)
+    """
+    quote = subprocess.list2cmdline if platform.system() == "Windows" else shlex.join
+    cmd = f"{simulation_task.mpi} {quote([str(lammps_executable)])} {simulation_task.omp} {simulation_task.gpu} -in {quote([str(simulation_task.local_input_file)])}"
+    return re.sub(r' +', " ", cmd).strip()
+
+
+def lammps_args(cmd: str) -> str | list[str]:
+    """
+    What to pass to subprocess for a command line: Windows runs it through the shell, elsewhere it is split like
+    the shell would, so paths with spaces stay one argument
+    """
+    return cmd if platform.system() == "Windows" else shlex.split(cmd)
+
+
 class LocalExecutionQueue(SingleExecutionQueue):
     remote: LocalMachine
 
@@ -19,15 +40,14 @@ class LocalExecutionQueue(SingleExecutionQueue):
 
     def _simulate(self, simulation_task: SimulationTask) -> tuple[SimulationTask, str]:
         lammps_executable: PurePath = self.remote.lammps_executable
-        cmd = f"{simulation_task.mpi} {lammps_executable} {simulation_task.omp} {simulation_task.gpu} -in {simulation_task.local_input_file}"
-        cmd = re.sub(r' +', " ", cmd).strip()
+        cmd = lammps_command(simulation_task, lammps_executable)
         logging.info(
             f"[bold blue]LocalExecutionQueue[/bold blue] Running [bold yellow]{cmd}[/bold yellow] in [cyan]{simulation_task.local_cwd}[/cyan]",
             extra={"markup": True, "highlighter": None}
         )
         try:
             result = subprocess.check_output(
-                cmd.split(" "),
+                lammps_args(cmd),
                 cwd=simulation_task.local_cwd,
                 shell=platform.system() == "Windows"
             )
@@ -42,45 +62,73 @@ class LocalExecutionQueue(SingleExecutionQueue):
             raise ValueError(f"Is LAMMPS ({lammps_executable}) installed?") from e
 
 
-def _run_queue(queue: ExecutionQueue) -> list[SimulationTask]:
-    return queue.run()
+def estimate_atoms(simulation_task: SimulationTask) -> int:
+    """
+    Estimated atom count of a task, computed from its nanoparticle on the lattice if it was not given
+    :return: The estimate, or 0 if it is unknown
+    """
+    if simulation_task.estimated_atoms is None and simulation_task.nanoparticle is not None:
+        try:
+            simulation_task.estimated_atoms = LatticeEstimator.estimate_nanoparticle(simulation_task.nanoparticle).atom_count
+        except Exception as e:
+            logging.debug(f"Could not estimate the atoms of {simulation_task.local_input_file}: {e}")
+    return simulation_task.estimated_atoms or 0
 
 
-class ThreadedLocalExecutionQueue(ExecutionQueue):
+class SharedLocalExecutionQueue(ExecutionQueue):
+    """
+    Local queue where every worker takes the next task from a shared deque when it becomes idle,
+    so a worker that got large nanoparticles does not delay the others.
+    With largest_first the tasks are sorted by estimated atom count (longest processing time first).
+    """
     remote: LocalMachine
-    queue: list[SimulationTask]
 
-    def __init__(self, remote: LocalMachine, threads: int):
+    def __init__(self, remote: LocalMachine, threads: int, largest_first: bool = True):
         super().__init__()
         self.threads: int = threads
         self.parallelism_count = threads
-        self.index: int = 0
+        self.largest_first: bool = largest_first
         self.remote = remote
-        self.queue = []
-        self.queues: list[LocalExecutionQueue] = [LocalExecutionQueue(self.remote) for _ in range(threads)]
-        self.full_queue: list[SimulationTask] = []
-        self.full_count: int = 0
-        self.full_completed_count: int = 0
-
-    def enqueue(self, simulation_task: SimulationTask):
-        queue_to_use: int = self.index % len(self.queues)
-        self.queues[queue_to_use].enqueue(simulation_task)
-        self.full_queue.append(simulation_task)
-        self.index += 1
-        self.queue.append(simulation_task)
-
-    def sub_queue_progress(self, progress: int, total: int, task: tuple[SimulationTask, str | None], sender: LocalExecutionQueue):
-        self.full_completed_count += 1
-        self.dispatch_message(ExecutionQueue.PROGRESS, progress=self.full_completed_count, total=self.full_count, task=task)
+        self.store = TaskStore()
+        self.runner: LocalExecutionQueue = LocalExecutionQueue(remote)
+        self.completed: list[SimulationTask] = []
 
     def run(self) -> list[SimulationTask]:
-        self.full_count = len(self.full_queue)
-        self.full_completed_count = 0
-        for queue in self.queues:
-            queue.listen(ExecutionQueue.PROGRESS, self.sub_queue_progress)
-        with ThreadPool(len(self.queues)) as p:
-            results = p.map(_run_queue, self.queues)
-        return [task for queue_result in results for task in queue_result]
+        if self.largest_first:
+            self.store.sort_pending(key=estimate_atoms, reverse=True)
+        self.completed = []
+        total: int = self.store.pending_count
+        # Guards the completed tasks and the retry policy, the workers share them
+        lock = threading.Lock()
+        workers = [threading.Thread(target=self._work, args=(total, lock), name=f"local-worker-{i}") for i in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return self.completed
+
+    def _work(self, total: int, lock: threading.Lock) -> None:
+        while (task := self.store.pop()) is not None:
+            result: tuple[SimulationTask, str | None] = (task, None)
+            error: Exception | None = None
+            try:
+                result = self.runner._simulate(task)
+            except Exception as e:
+                error = e
+                logging.error(f"Error in {type(self)}: {e}")
+                logging.debug(f"Error in {type(self)}: {e}", exc_info=e, stack_info=True)
+            with lock:
+                delay = self._retry_delay(task, result[1], error)
+            if delay is not None:
+                # This worker waits out the backoff, the others keep taking tasks
+                time.sleep(delay)
+                self.store.retry(task)
+                continue
+            self.store.finish(task, result[1] is not None and task.ok)
+            ExecutionQueue.run_callback(result[0], result[1])
+            with lock:
+                self.completed.append(result[0])
+                self.dispatch_message(ExecutionQueue.PROGRESS, progress=len(self.completed), total=total, task=result)
 
     def __str__(self):
-        return f"{type(self).__name__}({len(self.queues)} queues, {[len(q.queue) for q in self.queues]} items [{sum([len(q.queue) for q in self.queues])} total])"
+        return f"{type(self).__name__}({self.threads} workers, {self.store.pending_count} items)"
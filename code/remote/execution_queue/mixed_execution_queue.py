@@ -1,54 +1,160 @@
+import asyncio
 import logging
-from multiprocessing.pool import Pool
+import threading
 
 from lammps.simulation_task import SimulationTask
 from remote.execution_queue.execution_queue import ExecutionQueue
-from remote.execution_queue.slurm_execution_queue import estimate_minutes, minutes_to_slurm
-from service.scheduler_service import SchedulerService
-
-
-def _run_queue(queue: ExecutionQueue) -> list[SimulationTask]:
-    return queue.run()
+from remote.execution_queue.task_store import TaskStore
+from remote.execution_queue.slurm_execution_queue import minutes_to_slurm
+from service.journal import ExecutionJournal
+from service.runtime_model import get_runtime_model
+from service.scheduler_service import SchedulerService, SchedulePlan
+from service.transfer_model import get_transfer_model
 
 
 class MixedExecutionQueue(ExecutionQueue):
-    queue: list[SimulationTask]
+    """
+    Runs the queues of several machines at the same time, on a single event loop of this process: the local runs are
+    LAMMPS subprocesses and the remote batches are SSH commands, so no queue needs a process of its own (queues without
+    an event loop run in a worker thread, see ExecutionQueue.run_async). Callbacks run on the enqueued tasks and
+    their nanoparticles, and the PROGRESS events of every queue are forwarded with the progress of the whole run.
+    """
     queues: list[ExecutionQueue]
 
     def __init__(self, queues: list[ExecutionQueue]):
         super().__init__()
-        self.queue = []
+        self.store = TaskStore()
         self.queues = queues
+        self.parallelism_count = sum(queue.parallelism_count for queue in queues)
+        self.progress: int = 0  # Tasks finished by any queue
+        self.total: int = 0  # Tasks handed to the queues, a task that fails over counts once per queue
+        self.lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return ",".join(queue.name for queue in self.queues)
+
+    def set_journal(self, journal: ExecutionJournal | None) -> None:
+        super().set_journal(journal)
+        for queue in self.queues:
+            queue.set_journal(journal)
+
+    def reset(self) -> None:
+        super().reset()
+        for queue in self.queues:
+            queue.reset()
 
     def enqueue(self, simulation_task: SimulationTask):
-        self.queue.append(simulation_task)
+        self.store.add(simulation_task)
 
     def schedule(self, is_test: bool = False):
-        result: tuple[list[list[SimulationTask]], float] = SchedulerService.schedule_queue(self.queues, self.queue, is_test)
-        for execution_queue, queue in zip(self.queues, result[0]):
-            queue: list[SimulationTask]
-            for item in queue:
-                self.queues[self.queues.index(execution_queue)].enqueue(item)
+        # The tasks are handed to the queues of every machine, which track them from now on
+        plan: SchedulePlan = SchedulerService.plan_queues(self.queues, self.store.pop_all(), is_test, model=get_runtime_model(),
+                                                          transfer_model=get_transfer_model())
+        for execution_queue, tasks in zip(self.queues, plan.assignments):
+            for task in tasks:
+                execution_queue.enqueue(task)
 
     def run(self) -> list[SimulationTask]:
+        return asyncio.run(self.run_async())
+
+    async def run_async(self) -> list[SimulationTask]:
         is_test_run: bool = False
-        if len(self.queue) > 0:
-            is_test_run = self.queue[0].is_test_run
+        if (first := self.store.peek()) is not None:
+            is_test_run = first.is_test_run
         self.schedule(is_test_run)
         render_queue_plan(self, is_test_run)
-        with Pool(len(self.queues)) as p:
-            results = p.map(_run_queue, self.queues)
-        return [item for sublist in results for item in sublist]
+        self.progress = 0
+        self.total = sum(queue.store.pending_count for queue in self.queues)
+        for queue in self.queues:
+            queue.listen(ExecutionQueue.PROGRESS, self._forward_progress)
+        try:
+            return await self._run_rounds()
+        finally:
+            for queue in self.queues:
+                queue.unlisten(ExecutionQueue.PROGRESS, self._forward_progress)
 
+    async def _run_rounds(self) -> list[SimulationTask]:
+        completed: list[SimulationTask] = []
+        queues: list[ExecutionQueue] = self.queues
+        while len(queues) > 0:
+            # Every queue counts its own failures, threaded queues would race on a shared policy
+            policies = [None if self.retry_policy is None else self.retry_policy.fresh() for _ in queues]
+            for queue, retry_policy in zip(queues, policies):
+                queue.set_retry_policy(retry_policy)
+            results = await asyncio.gather(*[queue.run_async() for queue in queues])
+            failed: list[tuple[ExecutionQueue, SimulationTask]] = []
+            for queue, tasks, retry_policy in zip(queues, results, policies):
+                if retry_policy is not None:
+                    self.retry_policy.merge(retry_policy)
+                for task in tasks:
+                    if self.retry_policy is not None and self.retry_policy.can_fail_over(task):
+                        failed.append((queue, task))
+                    else:
+                        completed.append(task)
+            queues = self._fail_over(failed, completed)
+        return completed
 
-def render_queue_plan(queue: ExecutionQueue, is_test: bool = False, tolerance: float = 1.5) -> list[float]:
+    def _forward_progress(self, progress: int, total: int, task: tuple[SimulationTask, str | None], sender: ExecutionQueue):
+        # Threaded queues report from their workers
+        with self.lock:
+            self.progress += 1
+            self.dispatch_message(ExecutionQueue.PROGRESS, progress=self.progress, total=self.total, task=task)
+
+    def _fail_over(self, failed: list[tuple[ExecutionQueue, SimulationTask]],
+                   completed: list[SimulationTask]) -> list[ExecutionQueue]:
+        """
+        Enqueue the tasks a machine gave up on in the least loaded machine that has not failed them yet
+        :param failed: The tasks, and the queue that gave up on each
+        :param completed: Finished tasks, the tasks that no machine can run are added to them
+        :return: The queues that have tasks to run
+        """
+        for queue in self.queues:
+            queue.reset()
+        for queue, task in failed:
+            task.failed_on.append(queue.name)
+            candidates = [q for q in self.queues if q.name not in task.failed_on]
+            if len(candidates) == 0:
+                completed.append(task)
+                continue
+            target = min(candidates, key=lambda q: q.store.pending_count / q.parallelism_count)
+            logging.warning(f"Task {task.local_cwd} failed on {queue.name} ({task.failure}), running it on {target.name}")
+            self.retry_policy.failovers += 1
+            self.total += 1
+            task.attempts = 0
+            task.ok = True
+            target.enqueue(task)
+        return [queue for queue in self.queues if queue.store.pending_count > 0]
+
+
+def leaf_queues(queue: ExecutionQueue) -> list[ExecutionQueue]:
     if isinstance(queue, MixedExecutionQueue):
-        return [qmin for q in queue.queues for qmin in render_queue_plan(q, is_test, tolerance)]
-    else:
-        qlen = len(queue.queue)
-        qcores = queue.parallelism_count
-        qperf = queue.remote.single_core_completion_time
-        qmin = estimate_minutes(qlen, qcores, qperf, queue.remote.launch_time, is_test)
-        qtime = minutes_to_slurm(qmin, tolerance)
-        logging.warning(f"{queue.remote.name:12} ({queue.parallelism_count:3} cores): {len(queue.queue):5} tasks = {qtime}")
-        return [qmin]
+        return [leaf for q in queue.queues for leaf in leaf_queues(q)]
+    return [queue]
+
+
+def render_queue_plan(queue: ExecutionQueue, is_test: bool = False, tolerance: float = 1.5) -> list[float]:
+    """
+    Log the predicted finish time of every machine, the predicted makespan and a lower bound to compare it with
+    :return: Predicted minutes of every machine
+    """
+    queues: list[ExecutionQueue] = leaf_queues(queue)
+    queue_tasks: list[list[SimulationTask]] = [q.store.pending_tasks() for q in queues]
+    tasks: list[SimulationTask] = [task for q_tasks in queue_tasks for task in q_tasks]
+    # Costs are relative to the average task of the whole plan, so the machines are comparable
+    costs: dict[str, float] = dict(zip([task.task_id for task in tasks], SchedulerService.task_costs(tasks)))
+    model = get_runtime_model()
+    transfer_model = get_transfer_model()
+    minutes: list[float] = []
+    for q, q_tasks in zip(queues, queue_tasks):
+        plan = SchedulerService.plan_queues([q], q_tasks, is_test, [costs[task.task_id] for task in q_tasks], model, transfer_model)
+        qmin = plan.makespan
+        copies = f" (copies {minutes_to_slurm(plan.transfer_minutes[0], 1.0)})" if plan.transfer_minutes[0] > 0 else ""
+        logging.warning(f"{q.remote.name:12} ({q.parallelism_count:3} cores): {len(q_tasks):5} tasks = {minutes_to_slurm(qmin, tolerance)}{copies}")
+        minutes.append(qmin)
+    makespan = max(minutes, default=0.0)
+    slots = [(q.remote, q.parallelism_count) for q in queues]
+    bound = SchedulerService.lower_bound(slots, tasks, SchedulerService.durations(slots, tasks, is_test, list(costs.values()), model))
+    ratio = f" ({makespan / bound:.2f}x)" if bound > 0 else ""
+    logging.warning(f"Predicted makespan: {minutes_to_slurm(makespan, 1.0)}, lower bound: {minutes_to_slurm(bound, 1.0)}{ratio}")
+    return minutes
@@ -0,0 +1,181 @@
+import json
+import logging
+import os
+import re
+import signal
+import subprocess
+import time
+from pathlib import Path
+
+import asyncssh
+
+import utils
+from config.config import (LOG_LAMMPS, QUARANTINE_PATH, RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY,
+                           RETRY_FAILOVER)
+from lammps.simulation_task import SimulationTask
+
+# Failure classes
+CONNECTION: str = "connection"  # The SSH channel or connection was lost
+OUT_OF_MEMORY: str = "out_of_memory"  # Killed by the OOM killer, or an allocation failed
+NODE_FAILURE: str = "node_failure"  # The node died, or the run was preempted or terminated
+TIME_LIMIT: str = "time_limit"  # SLURM cancelled the job at its time limit
+INPUT_ERROR: str = "input_error"  # LAMMPS rejected the input, it fails the same way every time
+CRASH: str = "crash"  # Anything else (non-zero exit, no log), assumed deterministic
+
+TRANSIENT: frozenset[str] = frozenset({CONNECTION, OUT_OF_MEMORY, NODE_FAILURE, TIME_LIMIT})
+
+# Checked in order against the end of the logs, the first match wins
+LOG_PATTERNS: list[tuple[re.Pattern, str]] = [
+    (re.compile(r"Failed to allocate|Out of memory|Cannot allocate memory|oom[-_ ]kill|bad_alloc", re.IGNORECASE), OUT_OF_MEMORY),
+    (re.compile(r"DUE TO NODE FAILURE|NODE_FAIL|DUE TO PREEMPTION|Bus error"), NODE_FAILURE),
+    (re.compile(r"DUE TO TIME LIMIT"), TIME_LIMIT),
+    (re.compile(r"Connection reset|Connection closed|Broken pipe"), CONNECTION),
+    (re.compile(r"^ERROR( on proc \d+)?:", re.MULTILINE), INPUT_ERROR),
+]
+
+# Signals that killed the process (the OOM killer sends SIGKILL)
+SIGNAL_FAILURES: dict[str, str] = {
+    "SIGKILL": OUT_OF_MEMORY,
+    "SIGTERM": NODE_FAILURE,
+    "SIGBUS": NODE_FAILURE,
+    "SIGHUP": CONNECTION,
+    "SIGPIPE": CONNECTION,
+}
+
+
+def exit_signal(exit_code: int | None) -> str | None:
+    """
+    Name of the signal that killed a process: negative exit codes come from subprocess, 128 + n from shells and mpirun
+    """
+    if exit_code is None or 0 <= exit_code <= 128:
+        return None
+    try:
+        return signal.Signals(-exit_code if exit_code < 0 else exit_code - 128).name
+    except ValueError:
+        return None
+
+
+def classify(exit_code: int | None = None, log_tail: str = "", exception: BaseException | None = None) -> str:
+    """
+    Class of a failed run
+    :param exit_code: Exit code of the process, if known
+    :param log_tail: End of the LAMMPS log and of any other output of the run
+    :param exception: Exception raised while running it, if any
+    :return: One of the failure classes, those in TRANSIENT are worth retrying
+    """
+    if isinstance(exception, (ConnectionError, TimeoutError, asyncssh.Error)):
+        return CONNECTION
+    if isinstance(exception, MemoryError):
+        return OUT_OF_MEMORY
+    for pattern, failure in LOG_PATTERNS:
+        if pattern.search(log_tail):
+            return failure
+    return SIGNAL_FAILURES.get(exit_signal(exit_code), CRASH)
+
+
+class RetryPolicy:
+    """
+    Decides what happens to a failed run.
+    Transient failures are retried up to max_attempts times, waiting base_delay * 2^(attempt - 1) seconds
+    (at most max_delay) before every attempt. Deterministic failures are quarantined: they are not retried, and
+    are recorded in the quarantine file with the end of their log.
+    With failover, a mixed queue runs the tasks a machine gave up on (transiently) on another machine.
+    Failures, retries and quarantined tasks are counted for the final summary.
+    """
+    max_attempts: int
+    base_delay: float
+    max_delay: float
+    failover: bool
+    quarantine_path: Path
+    failures: dict[str, int]
+    retries: int
+    failovers: int
+    quarantined: int
+
+    def __init__(self, max_attempts: int = RETRY_MAX_ATTEMPTS, base_delay: float = RETRY_BASE_DELAY,
+                 max_delay: float = RETRY_MAX_DELAY, failover: bool = RETRY_FAILOVER,
+                 quarantine_path: Path | None = None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failover = failover
+        self.quarantine_path = QUARANTINE_PATH if quarantine_path is None else quarantine_path
+        self.failures = {}
+        self.retries = 0
+        self.failovers = 0
+        self.quarantined = 0
+
+    def delay(self, attempt: int) -> float:
+        return min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+
+    @staticmethod
+    def classify_task(simulation_task: SimulationTask, exception: BaseException | None = None, output: str = "") -> str:
+        exit_code = None if simulation_task.metadata is None else simulation_task.metadata.exit_code
+        if isinstance(exception, subprocess.CalledProcessError):
+            exit_code = exception.returncode
+        log_tail = utils.read_local_tail(Path(simulation_task.local_cwd) / LOG_LAMMPS)
+        if simulation_task.metadata is not None and simulation_task.metadata.stdout_path is not None:
+            log_tail += "\n" + utils.read_local_tail(simulation_task.metadata.stdout_path)
+        return classify(exit_code, log_tail + "\n" + output, exception)
+
+    def on_failure(self, simulation_task: SimulationTask, exception: BaseException | None = None,
+                   output: str = "") -> float | None:
+        """
+        Classify a failed run and count it
+        :param simulation_task: The task that failed
+        :param exception: Exception raised while running it, if any
+        :param output: Extra output of the run that may explain the failure (e.g. the output of its SLURM job)
+        :return: Seconds to wait before running it again, or None if it is given up
+        """
+        failure = RetryPolicy.classify_task(simulation_task, exception, output)
+        simulation_task.failure = failure
+        simulation_task.attempts += 1
+        self.failures[failure] = self.failures.get(failure, 0) + 1
+        if failure in TRANSIENT and simulation_task.attempts < self.max_attempts:
+            self.retries += 1
+            simulation_task.ok = True
+            return self.delay(simulation_task.attempts)
+        simulation_task.ok = False
+        if failure not in TRANSIENT:
+            self.quarantine(simulation_task, failure)
+        return None
+
+    def quarantine(self, simulation_task: SimulationTask, failure: str) -> None:
+        self.quarantined += 1
+        logging.error(f"Quarantined {simulation_task.local_cwd} ({failure}), it is not retried")
+        exit_code = None if simulation_task.metadata is None else simulation_task.metadata.exit_code
+        os.makedirs(self.quarantine_path.parent, exist_ok=True)
+        line = json.dumps({
+            "key": simulation_task.input_hash, "folder": str(simulation_task.local_cwd), "failure": failure,
+            "exit_code": exit_code, "tail": utils.read_local_tail(Path(simulation_task.local_cwd) / LOG_LAMMPS, 1024),
+            "time": time.time()
+        })
+        with open(self.quarantine_path, "a") as f:
+            f.write(line + "\n")
+
+    def fresh(self) -> 'RetryPolicy':
+        """
+        A policy with the same settings and no counters
+        """
+        return RetryPolicy(self.max_attempts, self.base_delay, self.max_delay, self.failover, self.quarantine_path)
+
+    def can_fail_over(self, simulation_task: SimulationTask) -> bool:
+        return self.failover and not simulation_task.ok and simulation_task.failure in TRANSIENT
+
+    def merge(self, other: 'RetryPolicy') -> None:
+        """
+        Add the counters of another policy (e.g. the one a queue of a MixedExecutionQueue used)
+        """
+        for failure, count in other.failures.items():
+            self.failures[failure] = self.failures.get(failure, 0) + count
+        self.retries += other.retries
+        self.failovers += other.failovers
+        self.quarantined += other.quarantined
+
+    def summary(self) -> dict[str, int]:
+        return {**self.failures, "retries": self.retries, "failovers": self.failovers, "quarantined": self.quarantined}
+
+    def __str__(self):
+        failures = ", ".join(f"{failure}: {count}" for failure, count in sorted(self.failures.items()))
+        return (f"{sum(self.failures.values())} failures ({failures or 'none'}), {self.retries} retries, "
+                f"{self.failovers} failovers, {self.quarantined} quarantined")
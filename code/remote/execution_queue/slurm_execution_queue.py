@@ -8,9 +8,12 @@ from asyncssh import SSHCompletedProcess
 import utils
 from config import config
 from config.config import BATCH_INFO
+from lammps.simulation_task import SimulationTask
 from remote.machine.local_machine import LocalMachine
 from remote.machine.slurm_machine import SLURMMachine
 from remote.machine.ssh_machine import SSHBatchedExecutionQueue
+from service.journal import JournalBatch
+from service.runtime_model import get_runtime_model
 from template import TemplateUtils
 from utils import write_local_file
 
@@ -19,16 +22,18 @@ SINGLE_TEST_TIME_MINUTES: float = 2.0 / SECONDS_IN_MINUTE
 SINGLE_SIMULATION_TIME_MINUTES: float = 1.0
 
 
-def estimate_slurm_time(count: int, tasks: int = 1, machine_power: float = 1.0, machine_start_time_seconds: float = 0.0, tolerance: float = 1.5) -> str:
+def estimate_slurm_time(count: int, tasks: int = 1, machine_power: float = 1.0, machine_start_time_seconds: float = 0.0, tolerance: float = 1.5,
+                        predicted_minutes: float | None = None) -> str:
     """
     :param tolerance:
     :param machine_start_time_seconds:
     :param count: Simulation count
     :param tasks: Thread count
     :param machine_power: Machine power multiplier
+    :param predicted_minutes: Minutes predicted by the runtime model, used instead of the machine power when given
     :return:
     """
-    minutes: float = estimate_minutes(count, tasks, machine_power, machine_start_time_seconds)
+    minutes: float = estimate_minutes(count, tasks, machine_power, machine_start_time_seconds) if predicted_minutes is None else predicted_minutes
     return minutes_to_slurm(minutes, tolerance)
 
 
@@ -77,22 +82,31 @@ class SlurmBatchedExecutionQueue(SSHBatchedExecutionQueue):
     def __init__(self, remote: SLURMMachine, local: LocalMachine, batch_size: int = 10):
         super().__init__(remote, local, batch_size)
 
-    def _generate_local_run_file(self, batch_name: str, n_threads: int, simulation_count: int):
+    def _predict_minutes(self, n_threads: int, simulations: list[SimulationTask] | None) -> float | None:
+        """
+        Minutes the batch takes according to the runtime model, None if the model does not know this machine
+        """
+        model = get_runtime_model()
+        if simulations is None or len(simulations) == 0 or model is None or self.remote.name not in model.machines:
+            return None
+        from service.scheduler_service import SchedulerService
+        return SchedulerService.plan([(self.remote, n_threads)], simulations, simulations[0].is_test_run, model=model).makespan
+
+    def _generate_local_run_file(self, batch_name: str, n_threads: int, simulation_count: int,
+                                 simulations: list[SimulationTask] | None = None):
         remote_batch_path: PurePosixPath = utils.set_type(PurePosixPath, self.remote.execution_path) / batch_name
         local_run_script_path: Path = self._get_local_exec_child(batch_name) / config.RUN_SH
-        script_code: str = TemplateUtils.replace_templates(
-            TemplateUtils.get_slurm_multi_template(), {
-                "tasks": str(n_threads),
-                "time": estimate_slurm_time(simulation_count, n_threads, self.remote.single_core_completion_time, self.remote.launch_time),
-                "cmd_args": str(BATCH_INFO),
-                "cwd": str(remote_batch_path),
-                "partition": self.remote.partition_to_use,
-                "output": str(remote_batch_path / "batch_run.out"),
-                "file_tag": str(remote_batch_path / config.RUN_SH),
-                "job_name": f"'{simulation_count} np {id(self)}'",
-            }
-        )
-        assert "{{" not in script_code, f"Not all templates were replaced in {script_code} for {self}"
+        script_code: str = TemplateUtils.get_compiled_slurm_multi_template().render({
+            "tasks": str(n_threads),
+            "time": estimate_slurm_time(simulation_count, n_threads, self.remote.single_core_completion_time, self.remote.launch_time,
+                                        predicted_minutes=self._predict_minutes(n_threads, simulations)),
+            "cmd_args": str(BATCH_INFO),
+            "cwd": str(remote_batch_path),
+            "partition": self.remote.partition_to_use,
+            "output": str(remote_batch_path / "batch_run.out"),
+            "file_tag": str(remote_batch_path / config.RUN_SH),
+            "job_name": f"'{simulation_count} np {id(self)}'",
+        })
         write_local_file(local_run_script_path, script_code)
         # Change permission u+x
         self.local.make_executable(local_run_script_path)
@@ -101,4 +115,11 @@ class SlurmBatchedExecutionQueue(SSHBatchedExecutionQueue):
         logging.info("Queueing job in toko...")
         sbatch: SSHCompletedProcess = await self.remote.run_cmd(f"sh -c 'cd {self.remote.execution_path / batch_name}; {self.remote.sbatch_path} {config.RUN_SH}'")
         jobid: int = re.match(r"Submitted batch job (\d+)", sbatch.stdout).group(1)
+        if self.store.journal is not None:
+            self.store.journal.set_batch_job(batch_name, str(jobid))
         await self.remote.wait_for_slurm_execution(jobid)
+
+    async def _wait_for_batch(self, batch: JournalBatch) -> None:
+        if batch.job is not None:
+            logging.info(f"Waiting for SLURM job {batch.job}...")
+            await self.remote.wait_for_slurm_execution(batch.job)
@@ -0,0 +1,120 @@
+import time
+from collections import deque
+from typing import Callable, Iterator
+
+from lammps.simulation_task import SimulationTask
+from service.journal import ExecutionJournal
+
+PENDING: str = "pending"  # Enqueued, not started
+RUNNING: str = "running"  # Taken by a worker
+DONE: str = "done"  # Finished successfully
+FAILED: str = "failed"  # Finished with an error
+
+
+class TaskStore:
+    """
+    Tasks of an execution queue, keyed by SimulationTask.task_id.
+    Pending tasks are kept in a deque, so enqueueing, membership checks and taking the next task are O(1).
+    Every task has a state, and the time of each state change is recorded.
+    Taking and finishing tasks only touch the entries of that task, so workers of a queue can share the store.
+    With a journal, every state change is also written to it.
+    """
+    tasks: dict[str, SimulationTask]
+    states: dict[str, str]
+    history: dict[str, list[tuple[str, float]]]
+    pending: deque[str]
+    journal: ExecutionJournal | None
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self.journal = None
+        self.tasks = {}
+        self.states = {}
+        self.history = {}
+        self.pending = deque()
+        self.clock = clock
+
+    def add(self, simulation_task: SimulationTask) -> None:
+        task_id = simulation_task.task_id
+        assert task_id not in self.tasks, f"Task {task_id} ({simulation_task.local_input_file}) is already enqueued"
+        self.tasks[task_id] = simulation_task
+        self.history[task_id] = []
+        self._set_state(task_id, PENDING)
+        self.pending.append(task_id)
+
+    def pop(self, accept: Callable[[SimulationTask], bool] | None = None) -> SimulationTask | None:
+        """
+        Take the next pending task and mark it as running
+        :param accept: Take the first pending task accepted by this function instead (O(n) when it is not the first)
+        :return: The task, or None if there is none
+        """
+        if accept is None:
+            try:
+                task_id = self.pending.popleft()
+            except IndexError:
+                return None
+        else:
+            for i, task_id in enumerate(self.pending):
+                if accept(self.tasks[task_id]):
+                    del self.pending[i]
+                    break
+            else:
+                return None
+        self._set_state(task_id, RUNNING)
+        return self.tasks[task_id]
+
+    def peek(self) -> SimulationTask | None:
+        return self.tasks[self.pending[0]] if len(self.pending) > 0 else None
+
+    def pop_all(self) -> list[SimulationTask]:
+        """
+        Take every pending task (e.g. to run them in a single batch)
+        """
+        tasks = []
+        while (task := self.pop()) is not None:
+            tasks.append(task)
+        return tasks
+
+    def retry(self, simulation_task: SimulationTask) -> None:
+        """
+        Put a running task back at the end of the pending tasks (to run it again after a failure)
+        """
+        assert self.states[simulation_task.task_id] == RUNNING, f"Task {simulation_task.task_id} is not running"
+        self._set_state(simulation_task.task_id, PENDING)
+        self.pending.append(simulation_task.task_id)
+
+    def finish(self, simulation_task: SimulationTask, ok: bool) -> None:
+        self._set_state(simulation_task.task_id, DONE if ok else FAILED)
+
+    def sort_pending(self, key: Callable[[SimulationTask], float], reverse: bool = False) -> None:
+        self.pending = deque(sorted(self.pending, key=lambda task_id: key(self.tasks[task_id]), reverse=reverse))
+
+    def _set_state(self, task_id: str, state: str) -> None:
+        self.states[task_id] = state
+        self.history[task_id].append((state, self.clock()))
+        if self.journal is not None:
+            self.journal.record(self.tasks[task_id], state)
+
+    def state(self, simulation_task: SimulationTask) -> str | None:
+        return self.states.get(simulation_task.task_id)
+
+    def pending_tasks(self) -> list[SimulationTask]:
+        return [self.tasks[task_id] for task_id in self.pending]
+
+    def tasks_in(self, state: str) -> list[SimulationTask]:
+        return [self.tasks[task_id] for task_id, task_state in self.states.items() if task_state == state]
+
+    @property
+    def pending_count(self) -> int:
+        return len(self.pending)
+
+    def count(self, state: str) -> int:
+        return sum(1 for task_state in self.states.values() if task_state == state)
+
+    def __contains__(self, simulation_task: SimulationTask) -> bool:
+        return simulation_task.task_id in self.tasks
+
+    def __iter__(self) -> Iterator[SimulationTask]:
+        return iter(self.tasks.values())
+
+    def __len__(self) -> int:
+        return len(self.tasks)
@@ -0,0 +1,111 @@
+import logging
+import os
+from pathlib import Path
+
+NODE_PATH = Path("/sys/devices/system/node")
+
+
+def parse_cpu_list(cpu_list: str) -> list[int]:
+    """
+    Parse a kernel cpu list such as "0-3,8-11"
+    """
+    cpus = []
+    for part in cpu_list.strip().split(","):
+        if part == "":
+            continue
+        if "-" in part:
+            start, end = part.split("-")
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def read_numa_nodes(allowed: set[int]) -> list[list[int]]:
+    """
+    CPUs of every NUMA node that this process may use, a single node with every allowed CPU if the topology is unknown
+    """
+    nodes = []
+    for node in sorted(NODE_PATH.glob("node[0-9]*"), key=lambda p: int(p.name[4:])):
+        try:
+            cpus = [cpu for cpu in parse_cpu_list((node / "cpulist").read_text()) if cpu in allowed]
+        except (OSError, ValueError):
+            continue
+        if len(cpus) > 0:
+            nodes.append(cpus)
+    if sum(len(cpus) for cpus in nodes) != len(allowed):
+        return [sorted(allowed)]
+    return nodes
+
+
+class AffinityManager:
+    """
+    Hands every running task a disjoint set of CPUs, within a single NUMA node when one has enough free CPUs.
+    The node with the fewest free CPUs that still fits the task is used, so large tasks still find a whole node later.
+    """
+    nodes: list[list[int]]
+    free: list[set[int]]
+
+    def __init__(self, nodes: list[list[int]]):
+        self.nodes = nodes
+        self.free = [set(cpus) for cpus in nodes]
+
+    @staticmethod
+    def from_system() -> 'AffinityManager | None':
+        """
+        Affinity manager over the CPUs this process may use, None where affinity is not supported (e.g. Windows)
+        """
+        if not hasattr(os, "sched_setaffinity"):
+            logging.debug("CPU affinity is not supported on this platform")
+            return None
+        return AffinityManager(read_numa_nodes(os.sched_getaffinity(0)))
+
+    @property
+    def cpu_count(self) -> int:
+        return sum(len(cpus) for cpus in self.nodes)
+
+    def acquire(self, count: int) -> list[int] | None:
+        """
+        Reserve CPUs for a task
+        :param count: CPUs needed
+        :return: The reserved CPUs, or None if there are not enough free CPUs
+        """
+        fitting = [node for node in range(len(self.free)) if len(self.free[node]) >= count]
+        if len(fitting) > 0:
+            node = min(fitting, key=lambda n: len(self.free[n]))
+            cpus = sorted(self.free[node])[:count]
+        else:
+            if sum(len(free) for free in self.free) < count:
+                return None
+            # Spread over the nodes with the most free CPUs
+            cpus = []
+            for node in sorted(range(len(self.free)), key=lambda n: -len(self.free[n])):
+                cpus.extend(sorted(self.free[node])[:count - len(cpus)])
+                if len(cpus) == count:
+                    break
+        for free in self.free:
+            free.difference_update(cpus)
+        return cpus
+
+    def release(self, cpus: list[int]) -> None:
+        for node, node_cpus in enumerate(self.nodes):
+            self.free[node].update(cpu for cpu in cpus if cpu in node_cpus)
+
+    @staticmethod
+    def environment(cpus: list[int], omp_threads: int) -> dict[str, str]:
+        """
+        Environment of a pinned LAMMPS process, with the OpenMP threads placed on its CPUs
+        """
+        return {
+            **os.environ,
+            "OMP_NUM_THREADS": str(omp_threads),
+            "OMP_PLACES": ",".join(f"{{{cpu}}}" for cpu in cpus),
+            "OMP_PROC_BIND": "close",
+        }
+
+    @staticmethod
+    def pin(cpus: list[int]):
+        """
+        Function to run in the child process before LAMMPS starts
+        """
+        return lambda: os.sched_setaffinity(0, cpus)
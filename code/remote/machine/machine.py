@@ -1,7 +1,7 @@
 from abc import ABCMeta, abstractmethod
 from dataclasses import dataclass, field
 from pathlib import PurePath
-from typing import AsyncGenerator
+from typing import AsyncGenerator, ClassVar
 
 from model.live_execution import LiveExecution
 
@@ -15,6 +15,7 @@ class Machine(metaclass=ABCMeta):
     cores: int
     single_core_completion_time: float = field(init=False, default=60 * 17)  # Lower is better
     launch_time: float = field(init=False, default=0.0)  # Time to launch a task
+    transfers_files: ClassVar[bool] = False  # Tasks are copied to the machine and back, see TransferModel
 
     lammps_executable: PurePath
     execution_path: PurePath
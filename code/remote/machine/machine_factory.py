@@ -30,6 +30,7 @@ class MachineFactory:
             lammps_executable=PurePosixPath("/scratch/fwilliamson/lammps_compile/lammps/build2/lmp"),
             user=user,
             node_id=node_id,
+            # Defaults, replaced by the measured values of `sched calibrate` and the runtime model (`sched runtime`)
             launch_time=0.0,  # TODO: revise
             single_core_completion_time=(4 * 3155.91) / (3.14 if partition == "mini" else 1)  # TODO: revise
         )
@@ -1,11 +1,15 @@
 import asyncio
+import gzip
+import io
 import logging
 import random
+import shlex
+import tarfile
 import time
 from asyncio import Task
 from dataclasses import dataclass, field
 from pathlib import Path, PurePath, PurePosixPath
-from typing import Any, AsyncGenerator, Coroutine, Iterable, Callable
+from typing import Any, AsyncGenerator, Awaitable, BinaryIO, ClassVar, Coroutine, Iterable, Callable
 
 import asyncssh
 from asyncssh import SSHCompletedProcess, DISC_BY_APPLICATION, SFTPFailure, SFTPNoSuchFile
@@ -13,16 +17,78 @@ from asyncssh import SSHCompletedProcess, DISC_BY_APPLICATION, SFTPFailure, SFTP
 import utils
 from config import config
 from config.config import BATCH_INFO
+from lammps.lammpsdump import LammpsLog
 from lammps.simulation_task import SimulationTask
+from model.execution_metadata import ExecutionMetadata
 from model.live_execution import LiveExecution
 from remote.execution_queue.execution_queue import ExecutionQueue
+from remote.execution_queue import task_store
+from remote.execution_queue.task_store import TaskStore
 from remote.machine.local_machine import LocalMachine
 from remote.machine.machine import Machine
+from service import journal
+from service.journal import JournalBatch
+from service.core_budget import CoreBudget
+from service.transfer_model import TransferModel, TransferSample, UPLOAD, DOWNLOAD
 from template import TemplateUtils
 from utils import set_type
 from utils import write_local_file
 
 
+TAR_CHUNK = 2 ** 16  # Bytes of the tar stream handed to the SSH channel at a time
+
+
+def tar_batch(entries: list[tuple[Path, PurePosixPath]], manifest: PurePosixPath, fileobj: BinaryIO,
+              compression: int = config.SSH_TAR_COMPRESSION) -> None:
+    """
+    Pack local files and folders in a tar stream written to fileobj as it is built, with the checksums of every file
+    in it, so the archive is never held in memory
+    :param entries: Every local file or folder, and its path in the archive
+    :param manifest: Path of the checksums in the archive, in the format of `sha256sum -c` run from its root
+    :param fileobj: Where the stream goes, only written to
+    :param compression: Gzip level, 0 for a plain tar
+    """
+    checksums: list[str] = []
+    # tarfile only takes a gzip level when it can seek, the stream is compressed by a GzipFile instead
+    output = gzip.GzipFile(fileobj=fileobj, mode="wb", compresslevel=compression) if compression > 0 else fileobj
+    try:
+        with tarfile.open(fileobj=output, mode="w|", bufsize=TAR_CHUNK) as tar:
+            for local_path, name in entries:
+                tar.add(local_path, arcname=str(name))
+                files = [local_path] if local_path.is_file() else sorted(path for path in local_path.rglob("*") if path.is_file())
+                for file in files:
+                    checksums.append(f"{utils.hash_file(file)}  {name / file.relative_to(local_path).as_posix()}")
+            data = ("\n".join(checksums) + "\n").encode()
+            info = tarfile.TarInfo(str(manifest))
+            info.size = len(data)
+            info.mtime = int(time.time())
+            tar.addfile(info, io.BytesIO(data))
+    finally:
+        if output is not fileobj:
+            output.close()
+
+
+class ChannelWriter:
+    """
+    Write-only file object handing what a worker thread writes (see tar_batch) to an SSH channel of the event loop,
+    each write waits until the channel has drained
+    """
+
+    def __init__(self, stdin: asyncssh.SSHWriter, loop: asyncio.AbstractEventLoop):
+        self.stdin = stdin
+        self.loop = loop
+        self.size: int = 0
+
+    def write(self, data: bytes) -> int:
+        asyncio.run_coroutine_threadsafe(self._write(bytes(data)), self.loop).result()
+        self.size += len(data)
+        return len(data)
+
+    async def _write(self, data: bytes) -> None:
+        self.stdin.write(data)
+        await self.stdin.drain()
+
+
 @dataclass
 class SSHMachine(Machine):
     """
@@ -36,7 +102,9 @@ class SSHMachine(Machine):
     connection: asyncssh.SSHClientConnection | None = field(init=False, default=None)
     sftp: asyncssh.SFTPClient | None = field(init=False, default=None)
 
-    semaphore = asyncio.Semaphore(10)
+    # Limits the SFTP copies in flight, one per connection so the machines sharing an event loop do not share it
+    semaphore: asyncio.Semaphore = field(init=False, repr=False)
+    transfers_files: ClassVar[bool] = True
 
     def __init__(
         self,
@@ -56,6 +124,8 @@ class SSHMachine(Machine):
         self.remote_url = remote_url
         self.port = port
         self.password = password
+        self.in_flight = 0  # SFTP copies running, see _timed
+        self.semaphore = asyncio.Semaphore(config.SFTP_CONCURRENCY)
 
     async def connect(self, start_sftp: bool = True):
         logging.info(f"Connecting to {self}...")
@@ -67,6 +137,7 @@ class SSHMachine(Machine):
             client_host="foo",  # Otherwise getnameinfo might fail on our own address
         )
         self.connection.set_keepalive(interval=2)
+        self.semaphore = asyncio.Semaphore(config.SFTP_CONCURRENCY)
         if start_sftp:
             self.sftp = await self.connection.start_sftp_client()
 
@@ -94,7 +165,7 @@ class SSHMachine(Machine):
         async def do_thing():
             async with self.semaphore:
                 try:
-                    return await self.sftp.put([str(local_path.resolve())], str(remote_path), recurse=True, error_handler=error_handler)
+                    return await self._timed(UPLOAD, self.sftp.put, [str(local_path.resolve())], str(remote_path), recurse=True, error_handler=error_handler)
                 except SFTPNoSuchFile as e:
                     if not ignore_errors:
                         raise e
@@ -108,7 +179,7 @@ class SSHMachine(Machine):
         async def do_thing():
             async with self.semaphore:
                 try:
-                    return await self.sftp.get([str(remote_path)], str(local_path.resolve()), recurse=True, error_handler=error_handler)
+                    return await self._timed(DOWNLOAD, self.sftp.get, [str(remote_path)], str(local_path.resolve()), recurse=True, error_handler=error_handler)
                 except SFTPNoSuchFile as e:
                     if not ignore_errors:
                         raise e
@@ -120,7 +191,7 @@ class SSHMachine(Machine):
 
         async def do_thing():
             async with self.semaphore:
-                return await self.sftp.put([str(local_path.resolve()) for local_path in local_paths], str(remote_path), recurse=True)
+                return await self._timed(UPLOAD, self.sftp.put, [str(local_path.resolve()) for local_path in local_paths], str(remote_path), recurse=True)
 
         return do_thing()
 
@@ -129,10 +200,69 @@ class SSHMachine(Machine):
 
         async def do_thing():
             async with self.semaphore:
-                return await self.sftp.get([str(remote_path) for remote_path in remote_paths], str(local_path.resolve()), recurse=True)
+                return await self._timed(DOWNLOAD, self.sftp.get, [str(remote_path) for remote_path in remote_paths], str(local_path.resolve()), recurse=True)
 
         return do_thing()
 
+    async def put_tar(self, entries: list[tuple[Path, PurePosixPath]], root: PurePosixPath, manifest: PurePosixPath,
+                      compression: int = config.SSH_TAR_COMPRESSION) -> None:
+        """
+        Copy local files and folders as a single tar stream through one SSH channel, extracted under root and checked
+        against their checksums: one round trip instead of the mkdir and files of an SFTP copy per folder
+        :param entries: Every local file or folder, and its path relative to root
+        :param root: Remote folder the archive is extracted in
+        :param manifest: Path of the checksums relative to root, see tar_batch
+        :param compression: Gzip level, 0 to send the archive uncompressed
+        """
+        logging.debug(f"Streaming {len(entries)} paths to {root}...")
+        extract = "-xzf" if compression > 0 else "-xf"
+        root_arg = shlex.quote(str(root))
+        cmd = f"mkdir -p {root_arg} && tar {extract} - -C {root_arg} && cd {root_arg} && sha256sum --quiet -c {shlex.quote(str(manifest))}"
+        error: Exception | None = None
+        async with self.semaphore:
+            self.in_flight += 1
+            parallel = self.in_flight
+            start = time.perf_counter()
+            try:
+                process: asyncssh.SSHClientProcess = await self.connection.create_process(cmd, encoding=None)
+                writer = ChannelWriter(process.stdin, asyncio.get_running_loop())
+                try:
+                    # The archive is built in a thread while the channel sends it, a chunk at a time
+                    await asyncio.to_thread(tar_batch, entries, manifest, writer, compression)
+                except (OSError, asyncssh.Error) as e:
+                    # A local file could not be read, or the remote stopped reading (its exit status tells why)
+                    error = e
+                try:
+                    # Without its manifest a truncated archive fails the check, the remote ends either way
+                    process.stdin.write_eof()
+                except (OSError, asyncssh.Error):
+                    process.close()
+                result: SSHCompletedProcess = await process.wait()
+            finally:
+                self.in_flight -= 1
+        if error is not None or result.exit_status != 0:
+            raise Exception(f"Tar upload to {self} failed with code {result.exit_status}: "
+                            f"{(result.stderr or b'').decode(errors='replace').strip()}") from error
+        TransferModel.record(TransferSample(self.name, UPLOAD, writer.size, time.perf_counter() - start, parallel, time.time()))
+
+    async def _timed(self, direction: str, copy: Callable[..., Awaitable[None]], *args, **kwargs) -> None:
+        """
+        Run an SFTP copy and record its size and duration, the link to the machine is fitted on them (see TransferModel)
+        """
+        copied: dict[bytes, int] = {}
+
+        def progress(source: bytes, destination: bytes, done: int, total: int) -> None:
+            copied[source] = done
+
+        self.in_flight += 1
+        parallel = self.in_flight
+        start = time.perf_counter()
+        try:
+            await copy(*args, progress_handler=progress, **kwargs)
+        finally:
+            self.in_flight -= 1
+        TransferModel.record(TransferSample(self.name, direction, sum(copied.values()), time.perf_counter() - start, parallel, time.time()))
+
     async def disconnect(self):
         logging.info(f"Disconnecting from {self}...")
         # We no longer do it like this because we could wait forever:
@@ -142,21 +272,37 @@ class SSHMachine(Machine):
         self.connection.disconnect(DISC_BY_APPLICATION, "Done Nya!")
 
 
+BATCH_CHECKSUMS = "checksums.sha256"  # Checksums of the files of a batch streamed with tar, in its folder
+
+
 class SSHBatchedExecutionQueue(ExecutionQueue):
-    queue: list[SimulationTask]
     completed: list[SimulationTask]
     remote: SSHMachine
     local: LocalMachine
 
     def run(self) -> list[SimulationTask]:
-        result: list[SimulationTask] = asyncio.run(self.main())
+        return asyncio.run(self.run_async())
+
+    async def run_async(self) -> list[SimulationTask]:
+        result: list[SimulationTask] = await self.main()
         logging.info(f"Completed {len(result)} tasks in {self}")
         return result
 
     async def main(self) -> list[SimulationTask]:
         try:
             await self.remote.connect()
-            await self._simulate()
+            # Every round runs the pending tasks in one batch, failed runs worth retrying are pending again
+            while self.store.pending_count > 0:
+                self.backoff = 0.0
+                try:
+                    await self._simulate()
+                except Exception as e:
+                    if not self._retry_running(e):
+                        raise
+                    await asyncio.sleep(self.backoff)
+                    await self.remote.connect()
+                    continue
+                await asyncio.sleep(self.backoff)
         except Exception as e:
             logging.error(f"Error in {type(self)}: {e}", stack_info=True, exc_info=e)
         finally:
@@ -169,39 +315,104 @@ class SSHBatchedExecutionQueue(ExecutionQueue):
         self.remote = remote
         self.parallelism_count = batch_size
         self.local = local
-        self.queue = []
+        self.store = TaskStore()
+        self.completed = []
+        self.backoff: float = 0.0  # Seconds to wait before the next batch, the longest delay of its retried tasks
+
+    def reset(self) -> None:
+        super().reset()
         self.completed = []
 
+    def _retry_running(self, error: Exception) -> bool:
+        """
+        Handle a batch that failed as a whole (e.g. the connection dropped): its running tasks are retried or given up
+        :return: True if some of them will be retried
+        """
+        if self.retry_policy is None:
+            return False
+        retried = False
+        for simulation in self.store.tasks_in(task_store.RUNNING):
+            if (delay := self._retry_delay(simulation, None, error)) is not None:
+                self.backoff = max(self.backoff, delay)
+                self.store.retry(simulation)
+                retried = True
+            else:
+                self._finish(simulation, None, len(self.store))
+        return retried
+
+    def _finish(self, simulation: SimulationTask, result: str | None, total: int) -> None:
+        self.store.finish(simulation, result is not None and simulation.ok)
+        self.run_callback(simulation, result)
+        self.completed.append(simulation)
+        self.dispatch_message(ExecutionQueue.PROGRESS, progress=len(self.completed), total=total, task=(simulation, result))
+
     async def submit_remote_batch(self, batch_name: str):
         logging.info(f"Queueing job in {self}...")
         remote_batch_path: PurePosixPath = self._get_remote_exec_child(batch_name)
         return await self.remote.run_cmd(f"cd {remote_batch_path}; sh {config.RUN_SH}")
 
-    def _generate_local_run_file(self, batch_name: str, n_threads: int, simulation_count: int):
+    def _generate_local_run_file(self, batch_name: str, n_threads: int, simulation_count: int,
+                                 simulations: list[SimulationTask] | None = None):
         remote_batch_path: PurePosixPath = utils.set_type(PurePosixPath, self.remote.execution_path) / batch_name
         local_run_script_path: Path = self._get_local_exec_child(batch_name) / config.RUN_SH
-        script_code: str = TemplateUtils.replace_templates(
-            TemplateUtils.get_ssh_multi_template(), {
-                "tasks": str(n_threads),
-                "cmd_args": str(BATCH_INFO),
-                "cwd": str(remote_batch_path),
-                "output": str(remote_batch_path / "batch_run.out"),
-                "file_tag": str(remote_batch_path / config.RUN_SH),
-            }
-        )
-        assert "{{" not in script_code, f"Not all templates were replaced in {script_code} for {self}"
+        script_code: str = TemplateUtils.get_compiled_ssh_multi_template().render({
+            "tasks": str(n_threads),
+            "cmd_args": str(BATCH_INFO),
+            "cwd": str(remote_batch_path),
+            "output": str(remote_batch_path / "batch_run.out"),
+            "file_tag": str(remote_batch_path / config.RUN_SH),
+        })
         write_local_file(local_run_script_path, script_code)
         # Change permission u+x
         self.local.make_executable(local_run_script_path)
 
     async def _simulate(self):
-        logging.info(f"Simulating {len(self.queue)} tasks in {self}...")
+        simulations: list[SimulationTask] = self.store.pop_all()
+        if self.store.journal is not None:
+            simulations = await self._reattach(simulations)
+        if len(simulations) == 0:
+            return
+        logging.info(f"Simulating {len(simulations)} tasks in {self}...")
         batch_name: str = f"batch_{int(time.time())}_{random.randint(0, 1000)}"
-        self._setup_local_simulation_files(batch_name, self.queue, self.batch_size)
-        await self._copy_scripts_to_remote(self.queue, batch_name)
+        # Every rank of the batch runs one task at a time, so wide (MPI/OMP) tasks need fewer ranks
+        ranks: int = CoreBudget.max_parallel(self.remote.cores, simulations, self.batch_size)
+        self._setup_local_simulation_files(batch_name, simulations, ranks)
+        await self._copy_scripts_to_remote(simulations, batch_name)
+        if self.store.journal is not None:
+            self.store.journal.record_batch(self.remote.name, batch_name, None, simulations)
         await self.submit_remote_batch(batch_name)
-        await self._copy_scripts_from_remote(self.queue, batch_name)
-        self.process_output(self.queue)
+        await self._copy_scripts_from_remote(simulations, batch_name)
+        self.process_output(simulations, batch_name)
+        if self.store.journal is not None:
+            self.store.journal.finish_batch(batch_name)
+
+    async def _wait_for_batch(self, batch: JournalBatch) -> None:
+        """
+        Wait until a batch submitted by a previous invocation finishes.
+        A plain SSH batch does not outlive the connection that started it, so there is nothing to wait for.
+        """
+        pass
+
+    async def _reattach(self, simulations: list[SimulationTask]) -> list[SimulationTask]:
+        """
+        Collect the results of the batches of a previous invocation that were running these tasks
+        :param simulations: Tasks to run
+        :return: The tasks that still have to run
+        """
+        remaining: dict[str, SimulationTask] = {str(simulation.local_cwd): simulation for simulation in simulations}
+        for batch_name, batch in self.store.journal.open_batches(self.remote.name).items():
+            attached = [remaining.pop(folder) for folder in batch.folders if folder in remaining]
+            if len(attached) == 0:
+                continue
+            logging.info(f"Re-attaching to batch {batch_name} of {self.remote.name} ({len(attached)} tasks)")
+            await self._wait_for_batch(batch)
+            await self._copy_scripts_from_remote(attached, batch_name)
+            self.process_output([simulation for simulation in attached if journal.is_completed(simulation.local_cwd)], batch_name)
+            remaining.update({
+                str(simulation.local_cwd): simulation for simulation in attached if not journal.is_completed(simulation.local_cwd)
+            })
+            self.store.journal.finish_batch(batch_name)
+        return list(remaining.values())
 
     def _get_remote_exec_child(self, child: str | PurePath) -> PurePosixPath:
         return set_type(PurePosixPath, self.remote.execution_path) / child
@@ -218,6 +429,13 @@ class SSHBatchedExecutionQueue(ExecutionQueue):
         """
         remote_batch_path: PurePosixPath = self._get_remote_exec_child(batch_name)
         local_batch_path: Path = self._get_local_exec_child(batch_name)
+        if config.SSH_UPLOAD_MODE == "tar":
+            try:
+                await self._tar_scripts_to_remote(simulations, batch_name)
+                return local_batch_path, remote_batch_path
+            except Exception as e:
+                # E.g. no tar or sha256sum on the remote, the folders are copied one by one instead
+                logging.warning(f"Could not stream {batch_name} to {self.remote.name}, copying every folder: {e}")
         folder_cps: list[Coroutine[Any, Any, None]] = [
             # Batch folder
             self._cp_put(local_batch_path, remote_batch_path),
@@ -245,6 +463,20 @@ class SSHBatchedExecutionQueue(ExecutionQueue):
             raise Exception(f"Error copying files") from e
         return local_batch_path, remote_batch_path
 
+    async def _tar_scripts_to_remote(self, simulations: list[SimulationTask], batch_name: str) -> None:
+        """
+        Copy the same files as _copy_scripts_to_remote in a single tar stream, see SSHMachine.put_tar
+        """
+        remote_execution_path: PurePosixPath = set_type(PurePosixPath, self.remote.execution_path)
+        execution_folder = PurePosixPath(remote_execution_path.name)
+        entries: list[tuple[Path, PurePosixPath]] = [
+            (self._get_local_exec_child(batch_name), execution_folder / batch_name),
+            (set_type(Path, self.local.execution_path).parent / "FeCuNi.eam.alloy", PurePosixPath("FeCuNi.eam.alloy")),
+            *[(simulation.local_cwd, execution_folder / simulation.local_cwd.name) for simulation in simulations],
+        ]
+        await self.remote.put_tar(entries, remote_execution_path.parent, execution_folder / batch_name / BATCH_CHECKSUMS,
+                                  config.SSH_TAR_COMPRESSION)
+
     async def _copy_scripts_from_remote(self, simulations: list[SimulationTask], batch_name: str) -> tuple[Path, PurePath]:
         """
         Copy the local batch folder, simulation folders and scripts to the remote machine
@@ -292,7 +524,7 @@ class SSHBatchedExecutionQueue(ExecutionQueue):
         self.local.mkdir(local_batch_path)
         self.local.cp_to(config.LOCAL_MULTI_PY, local_batch_path / config.LOCAL_MULTI_PY.name, False)
         self._generate_local_tasks_file(batch_name, simulations)
-        self._generate_local_run_file(batch_name, n_threads, len(simulations))
+        self._generate_local_run_file(batch_name, n_threads, len(simulations), simulations)
 
     def _generate_local_tasks_file(self, batch_name: str, simulations: list[SimulationTask]):
         tasks: list[str] = []
@@ -309,13 +541,34 @@ class SSHBatchedExecutionQueue(ExecutionQueue):
             for i, (simulation, shell) in enumerate(zip(simulations, tasks))
         ]) + "\n")
 
-    def process_output(self, simulations: list[SimulationTask]):
+    def _save_metadata(self, simulation: SimulationTask, folder: Path) -> None:
+        """
+        Record where a remote run happened (for the runtime model), its log is all that comes back
+        """
+        if not folder.is_dir():
+            return
+        completed: bool = journal.is_completed(folder)
+        wall_time: float | None = LammpsLog(folder / config.LOG_LAMMPS).total_wall_time if completed else None
+        simulation.metadata = ExecutionMetadata(0 if completed else None, wall_time or 0.0, None, None, self.remote.name)
+        simulation.metadata.save(folder)
+
+    def process_output(self, simulations: list[SimulationTask], batch_name: str | None = None):
         logging.info("Copying output files from remote to local machine...")
         callback_info: list[tuple[Any, Path]] = []
         for i, simulation in enumerate(simulations):
             local_sim_folder: Path = Path(simulation.local_input_file).parent.resolve()
             local_lammps_log: Path = local_sim_folder / "log.lammps"
             callback_info.append((simulation, local_lammps_log))
+        # The output of the batch (e.g. the reason SLURM killed it) helps classifying the failed runs
+        batch_output: str = "" if batch_name is None else utils.read_local_tail(self._get_local_exec_child(batch_name) / "batch_run.out")
         for simulation, lammps_log in callback_info:
-            self.run_callback(simulation, utils.read_local_file(lammps_log))
-            self.completed.append(simulation)
+            self._save_metadata(simulation, lammps_log.parent)
+            result: str | None = utils.read_local_file(lammps_log)
+            if self.retry_policy is not None and result is not None and not journal.is_completed(lammps_log.parent):
+                # LAMMPS did not get to the end of the run
+                result = None
+            if (delay := self._retry_delay(simulation, result, output=batch_output)) is not None:
+                self.backoff = max(self.backoff, delay)
+                self.store.retry(simulation)
+                continue
+            self._finish(simulation, result, len(simulations))
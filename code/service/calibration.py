@@ -0,0 +1,163 @@
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, asdict
+from math import ceil
+from pathlib import Path
+
+import numpy as np
+
+import utils
+from config.config import (CALIBRATION_PATH, CALIBRATION_EXECUTION_PATH, CALIBRATION_STEPS, DESIRED_ATOM_COUNT,
+                           DESIRED_NI_RATIO, FULL_RUN_DURATION, LOG_LAMMPS)
+from lammps import shapes
+from lammps.lammpsdump import LammpsLog
+from lammps.nanoparticle import Nanoparticle
+from lammps.nanoparticlebuilder import NanoparticleBuilder
+from lammps.simulation_task import SimulationTask
+from remote.execution_queue.execution_queue import ExecutionQueue
+from remote.machine.machine import Machine
+
+BENCHMARK_RADII: list[float] = [8.0, 11.0, 14.0, 17.0, 20.0]  # Spheres of about 170, 460, 940, 1800 and 2740 atoms
+BENCHMARK_SEED = 250
+
+
+def benchmark_nanoparticles(steps: int = CALIBRATION_STEPS) -> list[Nanoparticle]:
+    """
+    The fixed set of calibration nanoparticles: Fe spheres of growing size with DESIRED_NI_RATIO Ni atoms
+    :param steps: Steps each one runs for
+    """
+    nanoparticles = []
+    for radius in BENCHMARK_RADII:
+        builder = NanoparticleBuilder(f"Calibration sphere {radius}")
+        builder.configure_lattice("bcc", "2.8665", [])
+        builder.add_named_shape(shapes.Sphere(radius, (0, 0, 0)), "sphere", [])
+        builder.add_create_atoms("1", "sphere")
+        builder.add_group_type("1", "Fe")
+        builder.use_random_ratio(("group", "Fe"), "2", str(DESIRED_NI_RATIO), str(BENCHMARK_SEED))
+        nano = builder.build(run_steps=str(steps))
+        nano.local_path = CALIBRATION_EXECUTION_PATH / nano.id
+        nanoparticles.append(nano)
+    return nanoparticles
+
+
+@dataclass
+class CalibrationSample:
+    atoms: int
+    steps: int
+    seconds: float  # Wall time of the LAMMPS process
+
+    @staticmethod
+    def of_task(simulation_task: SimulationTask) -> 'CalibrationSample | None':
+        """
+        :return: The sample, or None if the run failed or its log cannot be read
+        """
+        if not simulation_task.ok:
+            return None
+        try:
+            log = LammpsLog(Path(simulation_task.local_cwd) / LOG_LAMMPS)
+            seconds = simulation_task.metadata.wall_time if simulation_task.metadata is not None else 0.0
+            if seconds <= 0:
+                seconds = log.total_wall_time or log.exec_time
+            return CalibrationSample(log.exec_atoms, log.exec_steps, seconds)
+        except Exception as e:
+            logging.warning(f"Could not read the calibration run {simulation_task.local_cwd}: {e}")
+            return None
+
+
+@dataclass
+class Calibration:
+    """
+    Measured speed of a machine: a run takes overhead + cost * atoms * steps seconds on a single core,
+    and the queue adds queue_overhead seconds to every task (submission, SLURM wait, transfers)
+    """
+    machine: str
+    samples: int
+    cost: float  # Seconds per atom step on a single core
+    overhead: float  # Seconds before the run loop starts (reading the input, building the nanoparticle)
+    queue_overhead: float  # Seconds the queue adds to every task, on top of the LAMMPS process
+    created: float
+
+    @property
+    def launch_time(self) -> float:
+        return self.overhead + self.queue_overhead
+
+    @property
+    def single_core_completion_time(self) -> float:
+        """
+        Seconds a full run of an average nanoparticle takes on a single core, without the launch time
+        """
+        return self.cost * DESIRED_ATOM_COUNT * FULL_RUN_DURATION
+
+    @staticmethod
+    def fit(machine: str, samples: list[CalibrationSample], elapsed: float = 0.0, parallelism: int = 1) -> 'Calibration':
+        """
+        Least squares of the wall times against atoms * steps
+        :param machine: Name of the machine
+        :param samples: The completed benchmark runs
+        :param elapsed: Seconds the queue took to run them all, 0 if unknown
+        :param parallelism: Tasks the queue runs at the same time
+        """
+        assert len(samples) > 0, f"No calibration runs completed on {machine}"
+        work = np.array([sample.atoms * sample.steps for sample in samples], dtype=float)
+        seconds = np.array([sample.seconds for sample in samples])
+        if len(samples) >= 2 and np.ptp(work) > 0:
+            cost, overhead = np.linalg.lstsq(np.stack([work, np.ones(len(samples))], axis=1), seconds, rcond=None)[0]
+        else:
+            cost, overhead = 0.0, 0.0
+        if overhead < 0 or cost <= 0:
+            # Too noisy to tell the overhead apart, all the time is charged to the atom steps
+            overhead = 0.0
+            cost = float(np.sum(seconds) / max(1.0, np.sum(work)))
+        # Whatever the runs do not explain is spent by the queue, spread over its rounds of tasks
+        busy = max(float(np.max(seconds)), float(np.sum(seconds)) / max(1, parallelism))
+        rounds = ceil(len(samples) / max(1, parallelism))
+        queue_overhead = max(0.0, elapsed - busy) / rounds
+        return Calibration(machine, len(samples), float(cost), float(overhead), queue_overhead, time.time())
+
+
+def calibrate(queue: ExecutionQueue, steps: int = CALIBRATION_STEPS) -> Calibration:
+    """
+    Run the benchmark nanoparticles on a queue, single threaded, and fit its machine's speed.
+    The results store is not used, so the runs are timed on this machine.
+    """
+    for nano in benchmark_nanoparticles(steps):
+        queue.enqueue(nano.get_simulation_task(test_run=True))
+    start = time.perf_counter()
+    tasks = queue.run()
+    elapsed = time.perf_counter() - start
+    samples = [sample for sample in map(CalibrationSample.of_task, tasks) if sample is not None]
+    if len(samples) < len(tasks):
+        logging.warning(f"{len(tasks) - len(samples)} of {len(tasks)} calibration runs failed on {queue.remote.name}")
+    return Calibration.fit(queue.remote.name, samples, elapsed, queue.parallelism_count)
+
+
+def load_calibrations(path: Path = CALIBRATION_PATH) -> dict[str, Calibration]:
+    if not os.path.isfile(path):
+        return {}
+    try:
+        return {machine: Calibration(**calibration) for machine, calibration in json.loads(utils.read_local_file(path)).items()}
+    except (json.JSONDecodeError, TypeError):
+        logging.warning(f"Ignoring corrupted calibration file {path}")
+        return {}
+
+
+def save_calibration(calibration: Calibration, path: Path = CALIBRATION_PATH) -> None:
+    calibrations = load_calibrations(path)
+    calibrations[calibration.machine] = calibration
+    os.makedirs(path.parent, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    utils.write_local_file(tmp_path, json.dumps({machine: asdict(c) for machine, c in calibrations.items()}, indent=2))
+    os.replace(tmp_path, path)
+
+
+def apply_calibrations(machines: dict[str, Machine], path: Path = CALIBRATION_PATH) -> dict[str, Machine]:
+    """
+    Replace the launch and single core completion times of the calibrated machines with the measured ones
+    """
+    for name, calibration in load_calibrations(path).items():
+        if name in machines:
+            machines[name].launch_time = calibration.launch_time
+            machines[name].single_core_completion_time = calibration.single_core_completion_time
+    return machines
@@ -0,0 +1,120 @@
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Callable
+
+from config.config import LOCAL_MIN_CORES, LOCAL_MAX_CORES, LOCAL_MAX_LOAD, LOCAL_MIN_FREE_MEMORY, \
+    LOCAL_TPAS_DEGRADATION, LOCAL_CONTROL_INTERVAL
+from utils import available_cpus
+
+LOADAVG_PATH = Path("/proc/loadavg")
+MEMINFO_PATH = Path("/proc/meminfo")
+TPAS_WINDOW = 5  # Runs averaged to detect a degradation
+
+
+def read_load() -> float | None:
+    """
+    One minute load average, None if it is unknown
+    """
+    try:
+        return float(LOADAVG_PATH.read_text().split()[0])
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.getloadavg()[0]
+    except (OSError, AttributeError):
+        return None
+
+
+def read_available_memory() -> int | None:
+    """
+    Memory available for new processes in bytes (MemAvailable), None if it is unknown
+    """
+    try:
+        for line in MEMINFO_PATH.read_text().split("\n"):
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class ConcurrencyController:
+    """
+    Adjusts the cores used by a local queue, one core at a time and at most once per interval, starting from the
+    cores the load leaves spare (min_cores when the load is unknown):
+    - Down when memory is low, when the machine is loaded beyond max_load per CPU,
+      or when the recent runs are slower (tpas) than the best ones by more than tpas_degradation.
+    - Up when there is spare load and memory.
+    Every change is logged with its reason.
+    """
+    min_cores: int
+    max_cores: int
+
+    def __init__(self, min_cores: int = LOCAL_MIN_CORES, max_cores: int | None = LOCAL_MAX_CORES,
+                 max_load: float = LOCAL_MAX_LOAD, min_free_memory: int = LOCAL_MIN_FREE_MEMORY,
+                 tpas_degradation: float = LOCAL_TPAS_DEGRADATION, interval: float = LOCAL_CONTROL_INTERVAL,
+                 load: Callable[[], float | None] = read_load,
+                 memory: Callable[[], int | None] = read_available_memory,
+                 clock: Callable[[], float] = time.monotonic):
+        self.cpus: int = available_cpus()
+        self.min_cores = max(1, min_cores)
+        self.max_cores = max(self.min_cores, max_cores if max_cores is not None else self.cpus)
+        self.max_load: float = max_load
+        self.min_free_memory: int = min_free_memory
+        self.tpas_degradation: float = tpas_degradation
+        self.interval: float = interval
+        self.load = load
+        self.memory = memory
+        self.clock = clock
+        self.last_change: float | None = None
+        self.best_tpas: float | None = None
+        self.recent_tpas: list[float] = []
+
+    @property
+    def initial_cores(self) -> int:
+        load = self.load()
+        if load is None:
+            return self.min_cores
+        return min(self.max_cores, max(self.min_cores, int(self.cpus * self.max_load - load)))
+
+    def observe(self, tpas: float) -> None:
+        """
+        Record the tpas of a completed run
+        """
+        self.best_tpas = tpas if self.best_tpas is None else max(self.best_tpas, tpas)
+        self.recent_tpas = (self.recent_tpas + [tpas])[-TPAS_WINDOW:]
+
+    def is_degraded(self) -> bool:
+        if self.best_tpas is None or len(self.recent_tpas) < TPAS_WINDOW:
+            return False
+        return sum(self.recent_tpas) / len(self.recent_tpas) < self.best_tpas * (1 - self.tpas_degradation)
+
+    def update(self, cores: int) -> int:
+        """
+        Decide the cores to use from now on
+        :param cores: Cores currently used
+        :return: The new number of cores, within the bounds
+        """
+        now = self.clock()
+        if self.last_change is not None and now - self.last_change < self.interval:
+            return cores
+        load, memory = self.load(), self.memory()
+        target, reason = cores, None
+        if memory is not None and memory < self.min_free_memory:
+            target, reason = cores - 1, f"{memory / 2 ** 30:.1f} GiB available"
+        elif load is not None and load > self.cpus * self.max_load:
+            target, reason = cores - 1, f"load {load:.1f} on {self.cpus} CPUs"
+        elif self.is_degraded():
+            target, reason = cores - 1, f"tpas dropped to {sum(self.recent_tpas) / len(self.recent_tpas):.3g} (best {self.best_tpas:.3g})"
+            # Start measuring again at the new concurrency
+            self.best_tpas, self.recent_tpas = None, []
+        elif load is not None and load + 1 <= self.cpus * self.max_load:
+            target, reason = cores + 1, f"load {load:.1f} on {self.cpus} CPUs"
+        target = min(self.max_cores, max(self.min_cores, target))
+        if target != cores:
+            logging.info(f"[bold blue]ConcurrencyController[/bold blue] {cores} -> {target} cores ({reason})",
+                         extra={"markup": True, "highlighter": None})
+            self.last_change = now
+        return target
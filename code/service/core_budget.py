@@ -0,0 +1,88 @@
+import logging
+import time
+from typing import Callable
+
+from lammps.simulation_task import SimulationTask
+
+
+class CoreBudget:
+    """
+    Cores of a machine, shared by tasks that need several of them (MPI ranks x OMP threads).
+    A task is admitted only when enough cores are free, and busy core-seconds are accumulated to measure utilization.
+    A task that needs more cores than the machine has is admitted alone.
+    """
+    cores: int
+    busy: int
+    peak: int
+    busy_core_seconds: float
+    capacity_core_seconds: float
+
+    def __init__(self, cores: int, clock: Callable[[], float] = time.monotonic):
+        assert cores > 0, f"A core budget needs at least one core, got {cores}"
+        self.cores = cores
+        self.busy = 0
+        self.peak = 0
+        self.busy_core_seconds = 0.0
+        self.capacity_core_seconds = 0.0
+        self.clock = clock
+        self.start = clock()
+        self.last = self.start
+
+    def demand(self, simulation_task: SimulationTask) -> int:
+        return min(simulation_task.get_n_threads(), self.cores)
+
+    def fits(self, demand: int) -> bool:
+        return self.busy + demand <= self.cores
+
+    def acquire(self, demand: int) -> None:
+        assert self.fits(demand), f"{demand} cores requested, {self.cores - self.busy} free"
+        self._advance()
+        self.busy += demand
+        self.peak = max(self.peak, self.busy)
+
+    def release(self, demand: int) -> None:
+        assert demand <= self.busy, f"{demand} cores released, {self.busy} busy"
+        self._advance()
+        self.busy -= demand
+
+    def resize(self, cores: int) -> None:
+        """
+        Change the cores of the budget, running tasks keep theirs until they finish
+        """
+        assert cores > 0, f"A core budget needs at least one core, got {cores}"
+        self._advance()
+        self.cores = cores
+
+    def _advance(self) -> None:
+        now = self.clock()
+        self.busy_core_seconds += self.busy * (now - self.last)
+        self.capacity_core_seconds += self.cores * (now - self.last)
+        self.last = now
+
+    def utilization(self) -> dict[str, float]:
+        """
+        Busy core-seconds against the capacity (cores x elapsed time) since the budget was created
+        """
+        self._advance()
+        capacity = self.capacity_core_seconds
+        return {
+            "cores": self.cores,
+            "peak_cores": self.peak,
+            "busy_core_seconds": self.busy_core_seconds,
+            "capacity_core_seconds": capacity,
+            "utilization": self.busy_core_seconds / capacity if capacity > 0 else 0.0,
+        }
+
+    @staticmethod
+    def max_parallel(cores: int, tasks: list[SimulationTask], limit: int) -> int:
+        """
+        Number of tasks that can run side by side when every one of them may be the widest
+        :param cores: Cores of the machine
+        :param tasks: The tasks to run
+        :param limit: Requested parallelism
+        """
+        widest = max([task.get_n_threads() for task in tasks], default=1)
+        parallel = max(1, min(limit, cores // widest))
+        if parallel < limit:
+            logging.warning(f"Running {parallel} tasks at once instead of {limit}: tasks use up to {widest} of {cores} cores")
+        return parallel
@@ -0,0 +1,59 @@
+import json
+import logging
+import os
+from pathlib import Path
+
+import utils
+
+ESTIMATE: str = "estimate"  # Geometric estimate on the lattice
+LAMMPS: str = "lammps"  # Confirmed with a LAMMPS test run
+
+
+class EvaluationCache:
+    """
+    Persistent cache of fuzzer evaluations.
+    Entries are keyed by the hash of the shape file and the parameter vector, and hold one result per fidelity.
+    """
+    path: Path
+    entries: dict[str, dict]
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.entries = {}
+        if os.path.isfile(path):
+            try:
+                self.entries = json.loads(utils.read_local_file(path))
+            except json.JSONDecodeError:
+                logging.warning(f"Ignoring corrupted evaluation cache {path}")
+
+    @staticmethod
+    def key(file_hash: str, params: dict[str, float]) -> str:
+        vector = [[name, round(float(value), 6)] for name, value in sorted(params.items())]
+        return f"{file_hash}:{json.dumps(vector)}"
+
+    def get(self, file_hash: str, params: dict[str, float], fidelity: str) -> dict | None:
+        entry = self.entries.get(EvaluationCache.key(file_hash, params))
+        return None if entry is None else entry.get(fidelity)
+
+    def put(self, file_hash: str, params: dict[str, float], fidelity: str, result: dict) -> None:
+        entry = self.entries.setdefault(EvaluationCache.key(file_hash, params), {"params": params})
+        entry[fidelity] = result
+
+    def of_file(self, file_hash: str, fidelity: str) -> list[tuple[dict[str, float], dict]]:
+        """
+        All the cached results of a given fidelity for a shape file
+        """
+        return [
+            (entry["params"], entry[fidelity])
+            for key, entry in self.entries.items()
+            if key.startswith(file_hash + ":") and fidelity in entry
+        ]
+
+    def save(self) -> None:
+        os.makedirs(self.path.parent, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        utils.write_local_file(tmp_path, json.dumps(self.entries))
+        os.replace(tmp_path, self.path)
+
+    def __len__(self):
+        return len(self.entries)
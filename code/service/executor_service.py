@@ -2,27 +2,45 @@
 import logging
 import random
 from pathlib import Path
-from typing import cast
+from typing import cast, Callable
 
 from rich.progress import Progress, SpinnerColumn, MofNCompleteColumn, TimeElapsedColumn, TaskID
 
-from remote.execution_queue import local_execution_queue, execution_queue, slurm_execution_queue, mixed_execution_queue
+from remote.execution_queue import local_execution_queue, async_local_execution_queue, execution_queue, slurm_execution_queue, mixed_execution_queue
 from lammps import nanoparticle, poorly_coded_parser as parser, nanoparticlebuilder
-from config.config import MACHINES
+from config.config import MACHINES, JOURNAL_ENABLED
 from lammps.nanoparticle import Nanoparticle
 from remote.execution_queue.execution_queue import ExecutionQueue
+from remote.execution_queue.retry_policy import RetryPolicy
 from remote.machine.local_machine import LocalMachine
 from remote.machine.machine import Machine
 from remote.machine.slurm_machine import SLURMMachine
 from remote.machine.ssh_machine import SSHMachine, SSHBatchedExecutionQueue
+from service.concurrency_controller import ConcurrencyController
+from service.journal import ExecutionJournal
 from lammps.simulation_task import SimulationTask
 
 
-def get_execution_queue(machine: Machine, n_threads: int, local_machine: LocalMachine):
+def get_execution_queue(machine: Machine, n_threads: int | str | None, local_machine: LocalMachine, cores: int | None = None,
+                        shared: int | None = None):
     if isinstance(machine, LocalMachine):
+        if n_threads == "auto":
+            controller = ConcurrencyController()
+            return async_local_execution_queue.AsyncLocalExecutionQueue(machine, controller.initial_cores, controller=controller)
+        if cores is not None:
+            return async_local_execution_queue.AsyncLocalExecutionQueue(machine, cores)
+        if shared is not None:
+            return local_execution_queue.SharedLocalExecutionQueue(machine, shared)
         if n_threads is None:
             return local_execution_queue.LocalExecutionQueue(machine)
-        return local_execution_queue.ThreadedLocalExecutionQueue(machine, n_threads)
+        # N runs at once, packed on at least as many cores so single threaded runs are never held back
+        return async_local_execution_queue.AsyncLocalExecutionQueue(machine, max(n_threads, machine.cores), runs=n_threads)
+    if n_threads == "auto":
+        raise ValueError(f"Only local queues adapt their concurrency (local:auto), not {machine.name}")
+    if cores is not None:
+        raise ValueError(f"Only local queues are sized in cores (local:cores=N), not {machine.name}")
+    if shared is not None:
+        raise ValueError(f"Only local queues have worker threads (local:shared=N), not {machine.name}")
     elif isinstance(machine, SLURMMachine):
         if n_threads is None:
             # return slurm_execution_queue.SlurmExecutionQueue(machine)
@@ -50,11 +68,20 @@ def get_executor(at: str) -> execution_queue.ExecutionQueue:
         queues = [get_executor(a) for a in ats]
         return mixed_execution_queue.MixedExecutionQueue(queues)
     machine_name, *threads = at.split(":")
-    n_threads: int | None = int(threads[0]) if len(threads) > 0 else None
+    n_threads: int | str | None = None
+    cores: int | None = None
+    shared: int | None = None
+    if len(threads) > 0:
+        if threads[0].startswith("cores="):
+            cores = int(threads[0].removeprefix("cores="))
+        elif threads[0].startswith("shared="):
+            shared = int(threads[0].removeprefix("shared="))
+        else:
+            n_threads = threads[0] if threads[0] == "auto" else int(threads[0])
     machines = MACHINES()
     for name, machine in machines.items():
         if machine_name == name:
-            return get_execution_queue(machine, n_threads, machines["local"])
+            return get_execution_queue(machine, n_threads, machines["local"], cores, shared)
     raise ValueError(f"Unknown queue {at} (known queues: {list(machines.keys())})")
 
 
@@ -68,7 +95,9 @@ def _handle_update(prog: Progress, task_id: TaskID):
 def execute_nanoparticles(
     nanoparticles: list[tuple[str, Nanoparticle]],
     at: str = "local",
-    test: bool = False
+    test: bool = False,
+    listeners: list[Callable] | None = None,
+    resume: bool = False
 ) -> list[tuple[str, Nanoparticle]]:
     """
     Executes a list of nanoparticles using the specified execution queue.
@@ -76,11 +105,25 @@ def execute_nanoparticles(
     :param nanoparticles: A list of tuples, each containing a string and a Nanoparticle object.
     :param at: A string that determines the type of ExecutionQueue to use.
     :param test: A boolean that determines whether to use test mode or not.
+    :param listeners: Extra callbacks subscribed to the queue's PROGRESS events.
+    :param resume: Skip the executions that an interrupted invocation completed, and finish the ones it left running.
     :return: A list of tuples, each containing a string and a Nanoparticle object.
     """
     queue: execution_queue.ExecutionQueue = get_executor(at)
-    for path, np in nanoparticles:
-        np.schedule_execution(execution_queue=queue, test_run=test)
+    queue.set_retry_policy(RetryPolicy())
+    execution_journal: ExecutionJournal | None = ExecutionJournal() if JOURNAL_ENABLED else None
+    if resume and execution_journal is None:
+        logging.warning("The journal is disabled (JOURNAL_ENABLED), nothing to resume")
+    if execution_journal is not None:
+        execution_journal.compact()
+    reused: list[Nanoparticle] = Nanoparticle.schedule_executions(
+        [np for _, np in nanoparticles], execution_queue=queue, test_run=test,
+        execution_journal=execution_journal, resume=resume
+    )
+    if len(reused) > 0:
+        logging.info(f"Reusing {len(reused)} completed executions")
+    for listener in listeners or []:
+        queue.listen(ExecutionQueue.PROGRESS, listener)
     with Progress(
         SpinnerColumn(),
         *Progress.get_default_columns(),
@@ -89,11 +132,16 @@ def execute_nanoparticles(
         expand=True,
         refresh_per_second=20
     ) as prog:
-        task_id = prog.add_task("Executing", total=len(nanoparticles))
+        task_id = prog.add_task("Executing", total=len(nanoparticles) - len(reused))
         queue.listen(ExecutionQueue.PROGRESS, _handle_update(prog, task_id))
         tasks: list[SimulationTask] = queue.run()
         prog.remove_task(task_id)
-    out_nanos: list[tuple[str, Nanoparticle]] = [(task.nanoparticle.local_path, task.nanoparticle) for task in tasks]
+    for listener in listeners or []:
+        queue.unlisten(ExecutionQueue.PROGRESS, listener)
+    if sum(queue.retry_policy.failures.values()) > 0:
+        logging.warning(f"Failures: {queue.retry_policy}")
+    out_nanos: list[tuple[str, Nanoparticle]] = [(nano.local_path, nano) for nano in reused]
+    out_nanos += [(task.nanoparticle.local_path, task.nanoparticle) for task in tasks]
     return out_nanos
 
 
@@ -136,14 +184,13 @@ def add_extra_nanoparticles(
         if not nano.is_random():
             nanoparticles.append((key, nano.build()))
             continue
-        for i in range(seed_count):
-            seeds = [random.randint(0, 100000) for _ in range(len(nano.seed_values))]
-            nanoparticles.append((key, nano.build(seeds)))
+        seed_lists = [[random.randint(0, 100000) for _ in range(len(nano.seed_values))] for _ in range(seed_count)]
+        nanoparticles.extend([(key, variant) for variant in nano.build_variants(seed_lists)])
     return nanoparticles
 
 
-def build_nanoparticles_to_execute(ignore: list[str], path: Path, seed: int, seed_count: int) -> list[
-    tuple[str, nanoparticle.Nanoparticle]]:
+def build_nanoparticles_to_execute(ignore: list[str], path: Path, seed: int, seed_count: int,
+                                   processes: int | None = None) -> list[tuple[str, nanoparticle.Nanoparticle]]:
     """
     Builds a list of nanoparticles to execute.
 
@@ -151,7 +198,11 @@ def build_nanoparticles_to_execute(ignore: list[str], path: Path, seed: int, see
     :param path: A Path object that specifies the location of the shapes.
     :param seed: An integer used to seed the random number generator.
     :param seed_count: An integer that determines the number of extra nanoparticles to add.
+    :param processes: Number of processes used to parse the shapes, defaults to the number of cores.
     :return: A list of tuples, each containing a string and a Nanoparticle object.
     """
-    nano_builders = parser.PoorlyCodedParser.load_shapes(path, ignore)
-    return add_extra_nanoparticles(list(nano_builders), seed, seed_count)
+    nano_builders, errors = parser.PoorlyCodedParser.load_shapes_parallel(path, ignore, processes)
+    if len(errors) > 0:
+        logging.error(f"[red]Could not parse {len(errors)} shapes, they will be skipped:[/red]\n" +
+                      "\n".join([f"  {shape}: {error}" for shape, error in errors]), extra={"markup": True})
+    return add_extra_nanoparticles(nano_builders, seed, seed_count)
@@ -0,0 +1,149 @@
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+import utils
+from config.config import JOURNAL_PATH, LOG_LAMMPS
+from lammps.simulation_task import SimulationTask
+from service.result_store import ResultStore
+
+TASK: str = "task"  # State change of a task
+BATCH: str = "batch"  # A remote batch was submitted
+BATCH_JOB: str = "batch_job"  # The SLURM job running a remote batch
+BATCH_DONE: str = "batch_done"  # The results of a remote batch were copied back
+
+
+def is_completed(folder: Path) -> bool:
+    """
+    Whether LAMMPS finished in an execution folder
+    """
+    # The summary is at the end of the log
+    return "Total wall time" in utils.read_local_tail(Path(folder) / LOG_LAMMPS)
+
+
+def task_key(simulation_task: SimulationTask) -> str:
+    """
+    Key of a task in the journal, the same for every execution of the same input (see ResultStore.key)
+    """
+    if simulation_task.input_hash is None:
+        simulation_task.input_hash = ResultStore.key(utils.read_local_file(simulation_task.local_input_file))
+    return simulation_task.input_hash
+
+
+@dataclass
+class JournalEntry:
+    state: str
+    folder: Path
+    time: float
+
+
+@dataclass
+class JournalBatch:
+    machine: str
+    job: str | None  # SLURM job id, None for plain SSH batches
+    folders: set[str]
+
+
+class ExecutionJournal:
+    """
+    Append-only log of the state changes of executed tasks and of the remote batches they run in.
+    Tasks are keyed by their input hash, so a later invocation building the same simulations can resume:
+    see Nanoparticle.schedule_executions and SSHBatchedExecutionQueue.
+    Every record is a single line appended at once, so a crash loses at most the record being written.
+    It is compacted before every invocation runs anything, see compact.
+    """
+    path: Path
+
+    def __init__(self, path: Path | None = None):
+        self.path = JOURNAL_PATH if path is None else path
+
+    def _append(self, record: dict) -> None:
+        os.makedirs(self.path.parent, exist_ok=True)
+        with open(self.path, "a") as f:
+            f.write(json.dumps({**record, "time": time.time()}) + "\n")
+
+    def record(self, simulation_task: SimulationTask, state: str) -> None:
+        self._append({"type": TASK, "key": task_key(simulation_task), "task": simulation_task.task_id, "state": state,
+                      "folder": str(simulation_task.local_cwd)})
+
+    def record_batch(self, machine: str, batch: str, job: str | None, simulations: list[SimulationTask]) -> None:
+        self._append({"type": BATCH, "machine": machine, "batch": batch, "job": job,
+                      "folders": [str(simulation.local_cwd) for simulation in simulations]})
+
+    def set_batch_job(self, batch: str, job: str) -> None:
+        self._append({"type": BATCH_JOB, "batch": batch, "job": job})
+
+    def finish_batch(self, batch: str) -> None:
+        self._append({"type": BATCH_DONE, "batch": batch})
+
+    def records(self) -> list[dict]:
+        if not os.path.isfile(self.path):
+            return []
+        records = []
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # The last line of a crashed process may be partial
+                    logging.debug(f"Ignoring partial journal line in {self.path}")
+        return records
+
+    def compact(self) -> None:
+        """
+        Rewrite the journal with what a resume needs: the last state of every task whose folder still exists, and the
+        batches whose results were never copied back. Records appended during the rewrite would be lost, so it is
+        done before the tasks are scheduled.
+        """
+        latest: dict[str, dict] = {}
+        batches: dict[str, list[dict]] = {}
+        records = self.records()
+        for record in records:
+            if record["type"] == TASK:
+                latest[record["key"]] = record
+            elif record["type"] in (BATCH, BATCH_JOB):
+                batches.setdefault(record["batch"], []).append(record)
+            elif record["type"] == BATCH_DONE:
+                batches.pop(record["batch"], None)
+        kept = [record for record in latest.values() if os.path.isdir(record["folder"])]
+        kept += [record for batch in batches.values() for record in batch]
+        if len(kept) == len(records):
+            return
+        kept.sort(key=lambda record: record["time"])
+        tmp_path = self.path.with_suffix(".tmp")
+        utils.write_local_file(tmp_path, "".join(json.dumps(record) + "\n" for record in kept))
+        os.replace(tmp_path, self.path)
+        logging.debug(f"Compacted the journal {self.path} from {len(records)} to {len(kept)} records")
+
+    def latest(self) -> dict[str, JournalEntry]:
+        """
+        Last known state of every input hash
+        """
+        entries = {}
+        for record in self.records():
+            if record["type"] == TASK:
+                entries[record["key"]] = JournalEntry(record["state"], Path(record["folder"]), record["time"])
+        return entries
+
+    def machines(self) -> dict[str, str]:
+        """
+        Machine that ran every folder sent in a remote batch
+        """
+        return {folder: record["machine"] for record in self.records() if record["type"] == BATCH for folder in record["folders"]}
+
+    def open_batches(self, machine: str) -> dict[str, JournalBatch]:
+        """
+        Batches submitted to a machine whose results were never copied back
+        """
+        batches = {}
+        for record in self.records():
+            if record["type"] == BATCH and record["machine"] == machine:
+                batches[record["batch"]] = JournalBatch(record["machine"], record["job"], set(record["folders"]))
+            elif record["type"] == BATCH_JOB and record["batch"] in batches:
+                batches[record["batch"]].job = record["job"]
+            elif record["type"] == BATCH_DONE:
+                batches.pop(record["batch"], None)
+        return batches
@@ -0,0 +1,148 @@
+import json
+import logging
+import os
+import time
+from functools import cache
+from pathlib import Path
+
+import utils
+from config.config import RESULT_STORE_PATH, RESULT_STORE_ENABLED, POTENTIAL_PATH, LAMMPS_EXECUTABLE, LAMMPS_IDENTITY
+
+HIT: str = "hit"  # A completed execution was reused
+MISS: str = "miss"  # No completed execution, the simulation is run
+STORE: str = "store"  # A completed execution was added to the store
+EVENTS_FILE: str = "events.jsonl"
+
+
+@cache
+def potential_hash(path: Path = POTENTIAL_PATH) -> str:
+    if not os.path.isfile(path):
+        logging.warning(f"Potential file {path} not found, results are keyed without it")
+        return "missing"
+    return utils.hash_file(path)
+
+
+@cache
+def lammps_identity(executable: Path = LAMMPS_EXECUTABLE) -> str:
+    """
+    Identity of the LAMMPS binary used to run the simulations.
+    LAMMPS_IDENTITY can pin it (e.g. to the LAMMPS version when several machines share a build),
+    otherwise the path, size and modification time of the local executable are used.
+    """
+    if LAMMPS_IDENTITY is not None:
+        return LAMMPS_IDENTITY
+    if os.path.isfile(executable):
+        stat = os.stat(executable)
+        return f"{executable}:{stat.st_size}:{stat.st_mtime_ns}"
+    return str(executable)
+
+
+def strip_header(code: str) -> str:
+    """
+    Remove the leading comment lines (title and json description), which change between identical simulations
+    """
+    lines = code.split("\n")
+    start = 0
+    while start < len(lines) and lines[start].startswith("#"):
+        start += 1
+    return "\n".join(lines[start:])
+
+
+def folder_size(path: Path) -> int:
+    size = 0
+    for entry in os.scandir(path):
+        if entry.is_file(follow_symlinks=False):
+            size += entry.stat().st_size
+    return size
+
+
+class ResultStore:
+    """
+    Content-addressed index of completed executions.
+    The key is the hash of the rendered LAMMPS input (without its header comments), the potential file and the LAMMPS
+    binary. Every entry is a small JSON file, so processes running simulations in parallel can add entries safely.
+    """
+    path: Path
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    @staticmethod
+    def key(code: str) -> str:
+        return utils.hash_content(f"{potential_hash()}\n{lammps_identity()}\n{strip_header(code)}")
+
+    def entry_path(self, key: str) -> Path:
+        return self.path / key[:2] / f"{key}.json"
+
+    def lookup(self, key: str, expected_files: list[str]) -> Path | None:
+        """
+        Find a completed execution with the same key
+        :param key: Key of the execution, see ResultStore.key
+        :param expected_files: Files a completed execution must contain (e.g. its dumps)
+        :return: Folder of the execution, or None if there is none (or it has been removed)
+        """
+        entry = utils.read_local_file(self.entry_path(key)) if os.path.isfile(self.entry_path(key)) else None
+        folder = None
+        if entry is not None:
+            try:
+                folder = Path(json.loads(entry)["path"])
+            except (json.JSONDecodeError, KeyError):
+                logging.warning(f"Ignoring corrupted result store entry {self.entry_path(key)}")
+        if folder is None or not all(os.path.isfile(folder / file) for file in expected_files):
+            self.record(MISS, key)
+            return None
+        self.record(HIT, key, folder_size(folder))
+        return folder
+
+    def put(self, key: str, folder: Path) -> None:
+        entry_path = self.entry_path(key)
+        os.makedirs(entry_path.parent, exist_ok=True)
+        tmp_path = entry_path.with_suffix(f".{os.getpid()}.tmp")
+        utils.write_local_file(tmp_path, json.dumps({"path": str(folder), "time": time.time()}))
+        os.replace(tmp_path, entry_path)
+        self.record(STORE, key, folder_size(folder))
+
+    def record(self, event: str, key: str, size: int = 0) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        line = json.dumps({"event": event, "key": key, "bytes": size, "time": time.time()}) + "\n"
+        # Small appends are atomic, so concurrent writers do not interleave lines
+        with open(self.path / EVENTS_FILE, "a") as f:
+            f.write(line)
+
+    def events(self) -> list[dict]:
+        if not os.path.isfile(self.path / EVENTS_FILE):
+            return []
+        events = []
+        with open(self.path / EVENTS_FILE, "r") as f:
+            for line in f:
+                try:
+                    events.append(json.loads(line))
+                except json.JSONDecodeError:
+                    pass
+        return events
+
+    def stats(self) -> dict[str, float]:
+        events = self.events()
+        hits = [e for e in events if e["event"] == HIT]
+        misses = [e for e in events if e["event"] == MISS]
+        lookups = len(hits) + len(misses)
+        return {
+            "entries": len(list(self.path.glob("*/*.json"))),
+            "hits": len(hits),
+            "misses": len(misses),
+            "hit_rate": len(hits) / lookups if lookups > 0 else 0.0,
+            "reclaimed_bytes": sum(e["bytes"] for e in hits),
+        }
+
+    def clear(self) -> int:
+        removed = 0
+        for entry in self.path.glob("*/*.json"):
+            entry.unlink()
+            removed += 1
+        if os.path.isfile(self.path / EVENTS_FILE):
+            os.remove(self.path / EVENTS_FILE)
+        return removed
+
+
+def get_result_store() -> ResultStore | None:
+    return ResultStore(RESULT_STORE_PATH) if RESULT_STORE_ENABLED else None
@@ -0,0 +1,182 @@
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, asdict
+from functools import cache
+from pathlib import Path
+
+import numpy as np
+
+import utils
+from config.config import RUNTIME_MODEL_PATH, LOG_LAMMPS, FULL_RUN_DURATION, EXEC_LS_POOL_TYPE
+from lammps.lammpsdump import LammpsLog
+from lammps.simulation_task import SimulationTask
+from model.execution_metadata import ExecutionMetadata
+from remote.execution_queue.local_execution_queue import estimate_atoms
+from service import journal
+
+RUNTIME_MODEL_VERSION = 1
+MIN_SAMPLES = 5  # Runs of a machine needed to fit its exponents, with fewer only the scale is fitted
+
+
+@dataclass
+class RuntimeSample:
+    """
+    A completed execution, as seen by the runtime model
+    """
+    machine: str
+    atoms: int
+    threads: int  # MPI ranks x OMP threads
+    steps: int
+    loop_seconds: float  # Time of the run loop (LammpsLog.exec_time)
+    total_seconds: float | None  # Time from the start of LAMMPS, None if the log does not say
+
+    @staticmethod
+    def of_execution(folder: Path, machines: dict[str, str]) -> 'RuntimeSample | None':
+        """
+        :param folder: Execution folder
+        :param machines: Machine of the folders without one in their metadata (see ExecutionJournal.machines)
+        :return: The sample, or None if the run did not complete or its machine is unknown
+        """
+        metadata = ExecutionMetadata.load(folder)
+        machine = metadata.machine if metadata is not None and metadata.machine is not None else machines.get(str(folder))
+        if machine is None or not journal.is_completed(folder):
+            return None
+        try:
+            log = LammpsLog(folder / LOG_LAMMPS)
+            return RuntimeSample(machine, log.exec_atoms, log.exec_procs * log.omp_threads, log.exec_steps,
+                                 log.exec_time, log.total_wall_time)
+        except Exception as e:
+            logging.debug(f"Could not read the run times of {folder}: {e}")
+            return None
+
+
+@dataclass
+class MachineRuntime:
+    """
+    Wall time of a run on a machine: overhead + scale * steps * atoms^atom_exponent / threads^thread_exponent
+    """
+    samples: int
+    scale: float | None  # Seconds per step of a single atom on a single thread, None without runs that have steps
+    atom_exponent: float
+    thread_exponent: float
+    overhead: float  # Seconds before the run loop starts (reading the input, building the nanoparticle)
+
+    def predict(self, atoms: int, threads: int, steps: int) -> float | None:
+        if steps == 0:
+            return self.overhead
+        if self.scale is None:
+            return None
+        return self.overhead + self.scale * steps * atoms ** self.atom_exponent / max(1, threads) ** self.thread_exponent
+
+    @staticmethod
+    def fit(samples: list[RuntimeSample]) -> 'MachineRuntime':
+        """
+        Least squares on the logarithm of the time per step. With few runs, or when every run has the same size or
+        threads, the exponents stay at 1 (linear in atoms, perfect scaling) and only the scale is fitted.
+        """
+        overheads = [sample.total_seconds - sample.loop_seconds for sample in samples if sample.total_seconds is not None]
+        overhead = max(0.0, float(np.median(overheads))) if len(overheads) > 0 else 0.0
+        runs = [sample for sample in samples if sample.steps > 0 and sample.loop_seconds > 0 and sample.atoms > 0]
+        if len(runs) == 0:
+            return MachineRuntime(len(samples), None, 1.0, 1.0, overhead)
+        y = np.log([sample.loop_seconds / sample.steps for sample in runs])
+        log_atoms = np.log([sample.atoms for sample in runs])
+        log_threads = np.log([max(1, sample.threads) for sample in runs])
+        atom_exponent, thread_exponent = 1.0, 1.0
+        columns = [np.ones(len(runs))]
+        fit_atoms = len(runs) >= MIN_SAMPLES and np.ptp(log_atoms) > 0
+        fit_threads = len(runs) >= MIN_SAMPLES and np.ptp(log_threads) > 0
+        if fit_atoms:
+            columns.append(log_atoms)
+        else:
+            y = y - log_atoms
+        if fit_threads:
+            columns.append(-log_threads)
+        else:
+            y = y + log_threads
+        coefficients = np.linalg.lstsq(np.stack(columns, axis=1), y, rcond=None)[0]
+        if fit_atoms:
+            atom_exponent = float(np.clip(coefficients[1], 0.5, 2.0))
+        if fit_threads:
+            thread_exponent = float(np.clip(coefficients[-1], 0.0, 1.0))
+        # The scale is refitted with the clipped exponents
+        residual = np.log([sample.loop_seconds / sample.steps for sample in runs]) - atom_exponent * log_atoms + thread_exponent * log_threads
+        return MachineRuntime(len(samples), float(np.exp(np.mean(residual))), atom_exponent, thread_exponent, overhead)
+
+
+class RuntimeModel:
+    """
+    Predicts the wall time of a task on each machine from its atom count and threads, fitted on completed executions.
+    It is stored in RUNTIME_MODEL_PATH and refreshed with `sched runtime`, SchedulerService and the SLURM time limits
+    use it for the machines it knows, and single_core_completion_time for the others.
+    """
+    machines: dict[str, MachineRuntime]
+    created: float
+
+    def __init__(self, machines: dict[str, MachineRuntime], created: float | None = None):
+        self.machines = machines
+        self.created = time.time() if created is None else created
+
+    @staticmethod
+    def collect(path: Path, machines: dict[str, str] | None = None) -> list[RuntimeSample]:
+        """
+        Samples of every completed execution in a folder
+        :param path: Folder with the executions (e.g. LOCAL_EXECUTION_PATH)
+        :param machines: Machine of the folders without one in their metadata (see ExecutionJournal.machines)
+        """
+        if not os.path.isdir(path):
+            return []
+        folders = [Path(entry.path) for entry in os.scandir(path) if entry.is_dir()]
+        with EXEC_LS_POOL_TYPE() as pool:
+            samples = pool.starmap(RuntimeSample.of_execution, [(folder, machines or {}) for folder in folders])
+        return [sample for sample in samples if sample is not None]
+
+    @staticmethod
+    def fit(samples: list[RuntimeSample]) -> 'RuntimeModel':
+        by_machine: dict[str, list[RuntimeSample]] = {}
+        for sample in samples:
+            by_machine.setdefault(sample.machine, []).append(sample)
+        return RuntimeModel({machine: MachineRuntime.fit(runs) for machine, runs in sorted(by_machine.items())})
+
+    def predict(self, machine: str, atoms: int, threads: int, steps: int) -> float | None:
+        """
+        Seconds a run takes on a machine, None if the model cannot tell
+        """
+        runtime = self.machines.get(machine)
+        return None if runtime is None or atoms <= 0 else runtime.predict(atoms, threads, steps)
+
+    def predict_task(self, machine: str, simulation_task: SimulationTask) -> float | None:
+        steps = 0 if simulation_task.is_test_run else FULL_RUN_DURATION
+        return self.predict(machine, estimate_atoms(simulation_task), simulation_task.get_n_threads(), steps)
+
+    def save(self, path: Path = RUNTIME_MODEL_PATH) -> None:
+        os.makedirs(path.parent, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        utils.write_local_file(tmp_path, json.dumps({
+            "version": RUNTIME_MODEL_VERSION,
+            "created": self.created,
+            "machines": {machine: asdict(runtime) for machine, runtime in self.machines.items()},
+        }, indent=2))
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path: Path = RUNTIME_MODEL_PATH) -> 'RuntimeModel | None':
+        if not os.path.isfile(path):
+            return None
+        try:
+            data = json.loads(utils.read_local_file(path))
+            if data.get("version") != RUNTIME_MODEL_VERSION:
+                logging.warning(f"Ignoring runtime model {path} of an older version, refresh it with `sched runtime`")
+                return None
+            return RuntimeModel({machine: MachineRuntime(**runtime) for machine, runtime in data["machines"].items()},
+                                data["created"])
+        except (json.JSONDecodeError, KeyError, TypeError):
+            logging.warning(f"Ignoring corrupted runtime model {path}")
+            return None
+
+
+@cache
+def get_runtime_model() -> RuntimeModel | None:
+    return RuntimeModel.load(RUNTIME_MODEL_PATH)
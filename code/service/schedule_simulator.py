@@ -0,0 +1,294 @@
+import heapq
+import random
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable
+
+import numpy as np
+
+from lammps.simulation_task import SimulationTask
+from opt import MPIOpt
+from remote.execution_queue.slurm_execution_queue import SECONDS_IN_MINUTE
+from remote.machine.machine import Machine
+from service.runtime_model import RuntimeModel, RuntimeSample
+from service.scheduler_service import SchedulerService
+from service.transfer_model import (MachineTransfer, UPLOAD_BYTES_PER_BATCH, OPERATIONS_PER_TASK, upload_bytes,
+                                    download_bytes)
+
+Slots = list[tuple[Machine, int]]
+
+
+@dataclass
+class Predictions:
+    """
+    What a policy knows about the tasks and the machines, see SchedulerService.plan
+    """
+    durations: list[list[float]]  # Minutes of every task on every machine
+    transfers: list[list[float]]  # Minutes every task keeps the link to every machine busy
+    ready: list[float]  # Minutes before every machine starts its first task (batch upload and queue wait)
+
+
+Policy = Callable[[Slots, list[SimulationTask], Predictions], list[list[SimulationTask]]]
+
+
+@dataclass
+class SimulatedMachine:
+    """
+    A machine and the way its queue runs tasks.
+    Local queues start the next task whenever enough slots are idle. Batched queues (SSH, SLURM) upload every task
+    at once, wait queue_wait seconds, split the tasks between their ranks like multi.py (rank r runs tasks r, r + ranks,
+    ... one after the other) and copy the results back when the last rank finishes.
+    """
+    machine: Machine
+    parallelism: int  # Tasks run at the same time, the parallelism_count of its queue
+    batched: bool = False
+    queue_wait: float = 0.0  # Seconds a batch waits before it starts (e.g. pending in SLURM)
+    link: MachineTransfer | None = None  # Link the tasks are copied through, None if copies are free
+
+    @property
+    def name(self) -> str:
+        return self.machine.name
+
+    def transfer_minutes(self, size: float, operations: int = 1) -> float:
+        return 0.0 if self.link is None else self.link.seconds(size, operations) / SECONDS_IN_MINUTE
+
+    def ranks(self, tasks: list[SimulationTask]) -> int:
+        widest = max([task.get_n_threads() for task in tasks], default=1)
+        return max(1, min(self.parallelism, self.machine.cores // widest))
+
+
+@dataclass
+class TaskTimes:
+    """
+    The tasks to replay, with the minutes every one of them takes on every machine (launch time included)
+    """
+    tasks: list[SimulationTask]
+    predicted: list[list[float]]  # What the policies are told, see SchedulerService.durations
+    actual: list[list[float]]  # What the simulated runs take
+
+    @staticmethod
+    def of_model(machines: list[SimulatedMachine], tasks: list[SimulationTask], model: RuntimeModel | None = None,
+                 is_test: bool = False, noise: float = 0.0, seed: int = 0) -> 'TaskTimes':
+        """
+        Runs take the predicted time, off by a log-normal factor
+        :param noise: Standard deviation of the logarithm of that factor, 0 for exact predictions
+        """
+        predicted = SchedulerService.durations([(m.machine, m.parallelism) for m in machines], tasks, is_test, model=model)
+        rng = random.Random(seed)
+        actual = [[minutes * rng.lognormvariate(0.0, noise) if noise > 0 else minutes for minutes in row] for row in predicted]
+        return TaskTimes(tasks, predicted, actual)
+
+    @staticmethod
+    def of_samples(machines: list[SimulatedMachine], samples: list[RuntimeSample],
+                   model: RuntimeModel | None = None) -> 'TaskTimes':
+        """
+        Replay completed executions (see RuntimeModel.collect): on the machine that ran them they take the time they
+        took, on the others the prediction scaled by how far off it was on that machine
+        """
+        tasks = [SimulationTask(f"sample_{i}.in", mpi=MPIOpt(use=sample.threads > 1, n_threads=max(1, sample.threads)),
+                                is_test_run=sample.steps == 0, estimated_atoms=sample.atoms)
+                 for i, sample in enumerate(samples)]
+        predicted = SchedulerService.durations([(m.machine, m.parallelism) for m in machines], tasks, model=model)
+        names = [m.name for m in machines]
+        actual = []
+        for sample, row in zip(samples, predicted):
+            seconds = sample.total_seconds if sample.total_seconds is not None else sample.loop_seconds
+            if sample.machine in names and row[names.index(sample.machine)] > 0:
+                index = names.index(sample.machine)
+                measured = machines[index].machine.launch_time / SECONDS_IN_MINUTE + seconds / SECONDS_IN_MINUTE
+                actual.append([minutes * measured / row[index] for minutes in row])
+            else:
+                actual.append(list(row))
+        return TaskTimes(tasks, predicted, actual)
+
+
+def lpt_policy(slots: Slots, tasks: list[SimulationTask], predictions: Predictions) -> list[list[SimulationTask]]:
+    """
+    SchedulerService.plan: longest first, each task to the machine where it finishes first, copies included
+    """
+    return SchedulerService.plan(slots, tasks, durations=predictions.durations, transfers=predictions.transfers,
+                                 ready=predictions.ready).assignments
+
+
+def lpt_no_transfers_policy(slots: Slots, tasks: list[SimulationTask], predictions: Predictions) -> list[list[SimulationTask]]:
+    """
+    SchedulerService.plan ignoring the copies and the queue waits
+    """
+    return SchedulerService.plan(slots, tasks, durations=predictions.durations).assignments
+
+
+def greedy_policy(slots: Slots, tasks: list[SimulationTask], predictions: Predictions) -> list[list[SimulationTask]]:
+    """
+    Each task, in the given order, to the machine where it finishes first
+    """
+    heaps: list[list[float]] = [[0.0] * max(1, parallelism) for _, parallelism in slots]
+    assignments: list[list[SimulationTask]] = [[] for _ in slots]
+    for row, task in zip(predictions.durations, tasks):
+        best = min(range(len(slots)), key=lambda index: heaps[index][0] + row[index])
+        heapq.heapreplace(heaps[best], heaps[best][0] + row[best])
+        assignments[best].append(task)
+    return assignments
+
+
+def proportional_policy(slots: Slots, tasks: list[SimulationTask], predictions: Predictions) -> list[list[SimulationTask]]:
+    """
+    Task counts proportional to the parallelism of every machine, whatever their speed or the size of the tasks
+    """
+    assignments: list[list[SimulationTask]] = [[] for _ in slots]
+    for task in tasks:
+        best = min(range(len(slots)), key=lambda index: len(assignments[index]) / max(1, slots[index][1]))
+        assignments[best].append(task)
+    return assignments
+
+
+POLICIES: dict[str, Policy] = {
+    "lpt": lpt_policy,
+    "lpt_no_transfers": lpt_no_transfers_policy,
+    "greedy": greedy_policy,
+    "proportional": proportional_policy,
+}
+
+
+@dataclass
+class SimulationReport:
+    policy: str
+    makespan: float  # Minutes until the last task is back
+    lower_bound: float  # Minutes no schedule can beat with the predicted times, see SchedulerService.lower_bound
+    utilization: float  # Busy fraction of the slots of every machine until the makespan
+    p50: float  # Minutes until a task is back, for the median task
+    p95: float
+    p99: float
+    finish: list[float]  # Minutes until the last task of every machine is back
+
+
+class ScheduleSimulator:
+    """
+    Discrete event simulation of the machines running the tasks a policy assigned them.
+    Events are (minute, sequence, action) in a heap, an action may schedule further events.
+    """
+    machines: list[SimulatedMachine]
+    times: TaskTimes
+
+    def __init__(self, machines: list[SimulatedMachine], times: TaskTimes):
+        self.machines = machines
+        self.times = times
+        self.index = {id(task): i for i, task in enumerate(times.tasks)}
+        self.events: list[tuple[float, int, Callable[[float], None]]] = []
+        self.sequence = 0
+        self.completion: list[float] = [0.0] * len(times.tasks)
+        self.busy: list[float] = [0.0] * len(machines)  # Slot minutes spent running tasks
+        self.capacity: list[int] = [m.parallelism for m in machines]  # Slots of every machine
+
+    def at(self, minute: float, action: Callable[[float], None]) -> None:
+        heapq.heappush(self.events, (minute, self.sequence, action))
+        self.sequence += 1
+
+    def run(self, assignments: list[list[SimulationTask]]) -> list[float]:
+        """
+        :param assignments: Tasks of every machine, in the order they run
+        :return: Minutes until the last task of every machine is back
+        """
+        finish = [0.0] * len(self.machines)
+        for index, (machine, tasks) in enumerate(zip(self.machines, assignments)):
+            if len(tasks) == 0:
+                continue
+            if machine.batched:
+                self._submit_batch(index, tasks, finish)
+            else:
+                self._pull(index, deque(tasks), machine.parallelism, finish)
+        while len(self.events) > 0:
+            minute, _, action = heapq.heappop(self.events)
+            action(minute)
+        return finish
+
+    def _duration(self, index: int, task: SimulationTask) -> float:
+        return self.times.actual[self.index[id(task)]][index]
+
+    def _pull(self, index: int, pending: deque[SimulationTask], parallelism: int, finish: list[float]) -> None:
+        free = [parallelism]
+
+        def start(minute: float) -> None:
+            # The next task waits until enough slots are idle, like the cores of the async local queue
+            while len(pending) > 0 and min(pending[0].get_n_threads(), parallelism) <= free[0]:
+                task = pending.popleft()
+                threads = min(task.get_n_threads(), parallelism)
+                free[0] -= threads
+                duration = self._duration(index, task)
+                self.busy[index] += duration * threads
+                self.at(minute + duration, done(task, threads))
+
+        def done(task: SimulationTask, threads: int) -> Callable[[float], None]:
+            def inner(minute: float) -> None:
+                free[0] += threads
+                self.completion[self.index[id(task)]] = minute
+                finish[index] = max(finish[index], minute)
+                start(minute)
+
+            return inner
+
+        self.at(0.0, start)
+
+    def _submit_batch(self, index: int, tasks: list[SimulationTask], finish: list[float]) -> None:
+        machine = self.machines[index]
+        ranks = machine.ranks(tasks)
+        widest = max(task.get_n_threads() for task in tasks)
+        self.capacity[index] = min(machine.machine.cores, ranks * widest)
+        running = [ranks]
+        upload = machine.transfer_minutes(UPLOAD_BYTES_PER_BATCH + sum(upload_bytes(task) for task in tasks), len(tasks) + 2)
+        download = machine.transfer_minutes(sum(download_bytes(task) for task in tasks), len(tasks) + 1)
+
+        def run_rank(rank_tasks: list[SimulationTask]) -> Callable[[float], None]:
+            def inner(minute: float) -> None:
+                if len(rank_tasks) == 0:
+                    running[0] -= 1
+                    if running[0] == 0:
+                        self.at(minute + download, copied)
+                    return
+                task = rank_tasks.pop(0)
+                duration = self._duration(index, task)
+                self.busy[index] += duration * task.get_n_threads()
+                self.at(minute + duration, inner)
+
+            return inner
+
+        def copied(minute: float) -> None:
+            for task in tasks:
+                self.completion[self.index[id(task)]] = minute
+            finish[index] = minute
+
+        start = upload + machine.queue_wait / SECONDS_IN_MINUTE
+        for rank in range(ranks):
+            self.at(start, run_rank(tasks[rank::ranks]))
+
+
+def simulate(machines: list[SimulatedMachine], times: TaskTimes, policy: str = "lpt") -> SimulationReport:
+    """
+    Assign the tasks with a policy (see POLICIES) using the predicted times, and run them with the actual ones
+    """
+    slots = [(m.machine, m.parallelism) for m in machines]
+    predictions = Predictions(
+        times.predicted,
+        [[m.transfer_minutes(upload_bytes(task) + download_bytes(task), OPERATIONS_PER_TASK) for m in machines]
+         for task in times.tasks],
+        [m.transfer_minutes(UPLOAD_BYTES_PER_BATCH, 2) + m.queue_wait / SECONDS_IN_MINUTE for m in machines],
+    )
+    assignments = POLICIES[policy](slots, times.tasks, predictions)
+    simulator = ScheduleSimulator(machines, times)
+    finish = simulator.run(assignments)
+    makespan = max(finish, default=0.0)
+    capacity = sum(simulator.capacity) * makespan
+    latencies = np.array(simulator.completion) if len(times.tasks) > 0 else np.zeros(1)
+    return SimulationReport(
+        policy,
+        makespan,
+        SchedulerService.lower_bound(slots, times.tasks, times.predicted),
+        sum(simulator.busy) / capacity if capacity > 0 else 0.0,
+        float(np.percentile(latencies, 50)),
+        float(np.percentile(latencies, 95)),
+        float(np.percentile(latencies, 99)),
+        finish,
+    )
+
+
+def compare(machines: list[SimulatedMachine], times: TaskTimes, policies: list[str] | None = None) -> list[SimulationReport]:
+    return [simulate(machines, times, policy) for policy in (policies or list(POLICIES))]
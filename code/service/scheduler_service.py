@@ -1,10 +1,15 @@
+import heapq
 import logging
+from dataclasses import dataclass, field
 from math import ceil
 
 from remote.execution_queue.execution_queue import ExecutionQueue
-from remote.execution_queue.slurm_execution_queue import estimate_minutes
+from remote.execution_queue.local_execution_queue import estimate_atoms
+from remote.execution_queue.slurm_execution_queue import estimate_minutes, SECONDS_IN_MINUTE, SINGLE_TEST_TIME_MINUTES
 from remote.machine.machine import Machine
 from lammps.simulation_task import SimulationTask
+from service.runtime_model import RuntimeModel
+from service.transfer_model import TransferModel
 
 
 class SchedulerService:
@@ -16,7 +21,14 @@ class SchedulerService:
         task_count = len(tasks)
         if task_count == 0:
             return 0
-        return estimate_minutes(task_count, machine.cores, machine.single_core_completion_time, machine.launch_time, is_test)
+        return estimate_minutes(SchedulerService.core_demand(tasks), machine.cores, machine.single_core_completion_time, machine.launch_time, is_test)
+
+    @staticmethod
+    def core_demand(tasks: list[SimulationTask]) -> int:
+        """
+        Cores needed to run every task once, a task using MPI or OMP counts as one task per thread
+        """
+        return sum(task.get_n_threads() for task in tasks)
 
     @staticmethod
     def estimate_queue_time(queue: ExecutionQueue, tasks: list[SimulationTask], is_test: bool = False) -> float:
@@ -26,31 +38,162 @@ class SchedulerService:
         task_count = len(tasks)
         if task_count == 0:
             return 0
-        return estimate_minutes(task_count, queue.parallelism_count, queue.remote.single_core_completion_time, queue.remote.launch_time, is_test)
+        return estimate_minutes(SchedulerService.core_demand(tasks), queue.parallelism_count, queue.remote.single_core_completion_time, queue.remote.launch_time, is_test)
+
+    @staticmethod
+    def task_costs(tasks: list[SimulationTask]) -> list[float]:
+        """
+        Predicted cost of every task, relative to an average task (so a machine's single_core_completion_time applies).
+        The cost grows with the estimated atom count, tasks of unknown size cost as much as an average one.
+        """
+        atoms = [estimate_atoms(task) for task in tasks]
+        known = [count for count in atoms if count > 0]
+        if len(known) == 0:
+            return [1.0 for _ in tasks]
+        reference = sum(known) / len(known)
+        return [count / reference if count > 0 else 1.0 for count in atoms]
+
+    @staticmethod
+    def durations(slots: list[tuple[Machine, int]], tasks: list[SimulationTask], is_test: bool = False,
+                  costs: list[float] | None = None, model: RuntimeModel | None = None) -> list[list[float]]:
+        """
+        Predicted minutes of every task on every machine, launch time included.
+        The runtime model predicts the machines it knows, the others take single_core_completion_time for an average task.
+        :param costs: Cost of every task relative to an average task, see task_costs
+        """
+        if costs is None:
+            costs = SchedulerService.task_costs(tasks)
+        speeds = [SINGLE_TEST_TIME_MINUTES if is_test else machine.single_core_completion_time / SECONDS_IN_MINUTE
+                  for machine, _ in slots]
+        launches = [machine.launch_time / SECONDS_IN_MINUTE for machine, _ in slots]
+        durations = []
+        for cost, task in zip(costs, tasks):
+            row = []
+            for (machine, _), speed, launch in zip(slots, speeds, launches):
+                seconds = None if model is None else model.predict_task(machine.name, task)
+                if seconds is not None:
+                    row.append(launch + seconds / SECONDS_IN_MINUTE)
+                else:
+                    row.append(launch + (speed if is_test else cost * speed))
+            durations.append(row)
+        return durations
+
+    @staticmethod
+    def transfers(slots: list[tuple[Machine, int]], tasks: list[SimulationTask],
+                  transfer_model: TransferModel) -> list[list[float]]:
+        """
+        Minutes every task keeps the link to every machine busy, 0 for the machines that run tasks in place
+        """
+        links = [transfer_model.link(machine) is not None for machine, _ in slots]
+        return [[transfer_model.minutes(machine, task) if link else 0.0 for (machine, _), link in zip(slots, links)]
+                for task in tasks]
+
+    @staticmethod
+    def plan(slots: list[tuple[Machine, int]], tasks: list[SimulationTask], is_test: bool = False,
+             costs: list[float] | None = None, model: RuntimeModel | None = None,
+             durations: list[list[float]] | None = None, transfers: list[list[float]] | None = None,
+             ready: list[float] | None = None) -> 'SchedulePlan':
+        """
+        Longest processing time first: the tasks are sorted by decreasing duration (on their best machine), and each
+        one goes to the machine where it would finish first. Every machine keeps a min-heap with the projected finish
+        time of each of its slots, so a single thread task costs O(machines + log(slots)) instead of re-estimating
+        every queue. A task using several threads takes that many slots of its machine.
+        Copies to and from a remote machine go through a single link, before and after its batch, so its finish time
+        also grows by the transfer time of every task it gets, and its slots are only ready once the batch is uploaded:
+        short runs stay on the machines that copy nothing.
+        :param slots: Every machine, and the number of tasks it runs in parallel
+        :param tasks: Tasks to assign
+        :param is_test: Test runs take SINGLE_TEST_TIME_MINUTES whatever their size (without a runtime model)
+        :param costs: Cost of every task relative to an average task, see task_costs
+        :param model: Runtime model predicting the duration of the tasks, see durations
+        :param durations: Minutes of every task on every machine, computed with durations when not given
+        :param transfers: Minutes every task keeps the link to every machine busy (see transfers), None to ignore copies
+        :param ready: Minutes before every machine can start its first task (see TransferModel.batch_minutes)
+        :return: The tasks of every machine (longest first), their predicted finish times and a lower bound of the makespan
+        """
+        if durations is None:
+            durations = SchedulerService.durations(slots, tasks, is_test, costs, model)
+        if transfers is None:
+            transfers = [[0.0] * len(slots) for _ in tasks]
+        if ready is None:
+            ready = [0.0] * len(slots)
+        heaps: list[list[float]] = [[minutes] * max(1, parallelism) for (_, parallelism), minutes in zip(slots, ready)]
+        links: list[float] = [0.0] * len(slots)
+        assignments: list[list[SimulationTask]] = [[] for _ in slots]
+
+        def start(index: int, threads: int) -> float:
+            # The task waits for the last of the slots it needs
+            return heaps[index][0] if threads == 1 else max(heapq.nsmallest(threads, heaps[index]))
+
+        for row, link, task in sorted(zip(durations, transfers, tasks), key=lambda row_task: min(row_task[0]), reverse=True):
+            threads = [min(task.get_n_threads(), len(heap)) for heap in heaps]
+            best = min(range(len(slots)), key=lambda index: start(index, threads[index]) + row[index] + links[index] + link[index])
+            finish = start(best, threads[best]) + row[best]
+            for _ in range(threads[best]):
+                heapq.heappop(heaps[best])
+            for _ in range(threads[best]):
+                heapq.heappush(heaps[best], finish)
+            links[best] += link[best]
+            assignments[best].append(task)
+        finish_minutes = [max(heap) + minutes if len(assignment) > 0 else 0.0
+                          for heap, minutes, assignment in zip(heaps, links, assignments)]
+        return SchedulePlan(assignments, finish_minutes, SchedulerService.lower_bound(slots, tasks, durations), links)
+
+    @staticmethod
+    def lower_bound(slots: list[tuple[Machine, int]], tasks: list[SimulationTask], durations: list[list[float]]) -> float:
+        """
+        Minutes no schedule can beat: the longest task on its best machine, or all the work spread on every slot.
+        Every task takes at least its best duration times the slowness of the machine it runs on (the smallest ratio
+        of any task there to its best duration), so the slots of every machine get through the work at that rate.
+        :param durations: Minutes of every task on every machine, see durations
+        """
+        if len(tasks) == 0:
+            return 0.0
+        best = [min(row) for row in durations]
+        work = sum(minutes * task.get_n_threads() for minutes, task in zip(best, tasks))
+        rate = 0.0
+        for index, (_, parallelism) in enumerate(slots):
+            slowness = min((row[index] / minutes for row, minutes in zip(durations, best) if minutes > 0), default=1.0)
+            rate += max(1, parallelism) / slowness
+        return max(max(best), work / rate if rate > 0 else 0.0)
 
     @staticmethod
     def schedule(machines: list[Machine], tasks: list[SimulationTask], is_test: bool = False) -> tuple[list[list[SimulationTask]], float]:
         """
         Given N machines, with [a, b, ..., z] cores, and M tasks.
-        Assign tasks to cores in such a way that the total execution time is minimized.
+        Assign tasks to cores in such a way that the total execution time is minimized, see plan.
         """
-        queues: list[list[SimulationTask]] = [[] for _ in machines]
-        for task in tasks:
-            # best_queue: Machine = min(queues, key=lambda queue: SchedulerService.estimate_queue_time(machines[queue], queues[queue]))
-            best_queue: tuple[Machine, list[SimulationTask]] = min(zip(machines, queues), key=lambda m_q: SchedulerService.estimate_machine_time(m_q[0], m_q[1], is_test))
-            best_queue[1].append(task)
-
-        return queues, max([SchedulerService.estimate_machine_time(machine, queue, is_test) for machine, queue in zip(machines, queues)])
+        plan = SchedulerService.plan([(machine, machine.cores) for machine in machines], tasks, is_test)
+        return plan.assignments, plan.makespan
 
     @staticmethod
     def schedule_queue(execution_queues: list[ExecutionQueue], tasks: list[SimulationTask], is_test: bool = False) -> tuple[list[list[SimulationTask]], float]:
         """
         Given N machines, with [a, b, ..., z] cores, and M tasks.
-        Assign tasks to cores in such a way that the total execution time is minimized.
+        Assign tasks to cores in such a way that the total execution time is minimized, see plan.
         """
-        queues: list[list[SimulationTask]] = [[] for _ in execution_queues]
-        for task in tasks:
-            best_queue: tuple[Machine, list[SimulationTask]] = min(zip(execution_queues, queues), key=lambda m_q: SchedulerService.estimate_queue_time(m_q[0], m_q[1], is_test))
-            best_queue[1].append(task)
+        plan = SchedulerService.plan_queues(execution_queues, tasks, is_test)
+        return plan.assignments, plan.makespan
+
+    @staticmethod
+    def plan_queues(execution_queues: list[ExecutionQueue], tasks: list[SimulationTask], is_test: bool = False,
+                    costs: list[float] | None = None, model: RuntimeModel | None = None,
+                    transfer_model: TransferModel | None = None) -> 'SchedulePlan':
+        slots = [(queue.remote, queue.parallelism_count) for queue in execution_queues]
+        if transfer_model is None:
+            return SchedulerService.plan(slots, tasks, is_test, costs, model)
+        return SchedulerService.plan(slots, tasks, is_test, costs, model,
+                                     transfers=SchedulerService.transfers(slots, tasks, transfer_model),
+                                     ready=[transfer_model.batch_minutes(machine) for machine, _ in slots])
+
+
+@dataclass
+class SchedulePlan:
+    assignments: list[list[SimulationTask]]  # Tasks of every machine, in the order they should run
+    finish_minutes: list[float]  # Predicted finish time of every machine
+    lower_bound: float  # Minutes no schedule can beat
+    transfer_minutes: list[float] = field(default_factory=list)  # Predicted copies to and from every machine, included in finish_minutes
 
-        return queues, max([SchedulerService.estimate_queue_time(execution_queue, queue, is_test) for execution_queue, queue in zip(execution_queues, queues)])
+    @property
+    def makespan(self) -> float:
+        return max(self.finish_minutes, default=0.0)
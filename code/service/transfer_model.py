@@ -0,0 +1,181 @@
+import json
+import logging
+import os
+from dataclasses import dataclass, asdict
+from functools import cache
+from pathlib import Path
+
+import numpy as np
+
+import utils
+from config.config import (TRANSFER_LOG_PATH, TRANSFER_LOG_MAX_BYTES, TRANSFER_RECENT, TRANSFER_DEFAULT_BANDWIDTH,
+                           TRANSFER_DEFAULT_LATENCY, SFTP_CONCURRENCY, FULL_RUN_DURATION, LAMMPS_DUMP_INTERVAL)
+from lammps.simulation_task import SimulationTask
+from remote.execution_queue.local_execution_queue import estimate_atoms
+from remote.machine.machine import Machine
+
+# Directions
+UPLOAD: str = "upload"
+DOWNLOAD: str = "download"
+
+# Bytes moved for a remote task (see SSHBatchedExecutionQueue)
+UPLOAD_BYTES_PER_BATCH = 1_215_318  # The potential file
+UPLOAD_BYTES_PER_TASK = 8 * 1024  # Input file and scripts
+DUMP_BYTES_PER_ATOM = 130  # A line of a dump
+LOG_BYTES_PER_RUN = 150 * 1024  # Thermo output of a full run
+OPERATIONS_PER_TASK = 2  # Its folder is copied up, and back
+
+
+def upload_bytes(simulation_task: SimulationTask) -> int:
+    return UPLOAD_BYTES_PER_TASK
+
+
+def download_bytes(simulation_task: SimulationTask) -> int:
+    # The whole folder comes back, input included
+    dumps = 1 if simulation_task.is_test_run else FULL_RUN_DURATION // LAMMPS_DUMP_INTERVAL + 1
+    log = 0 if simulation_task.is_test_run else LOG_BYTES_PER_RUN
+    return UPLOAD_BYTES_PER_TASK + dumps * DUMP_BYTES_PER_ATOM * estimate_atoms(simulation_task) + log
+
+
+@dataclass
+class TransferSample:
+    """
+    An SFTP copy to or from a machine
+    """
+    machine: str
+    direction: str
+    bytes: int
+    seconds: float
+    parallel: int  # Copies to the machine in flight when it started, they share the link
+    time: float
+
+
+@dataclass
+class MachineTransfer:
+    """
+    Link to a machine: an operation takes latency seconds, and the bytes of the copies in flight share the bandwidth
+    """
+    samples: int
+    bandwidth: float  # Bytes per second
+    latency: float  # Seconds per operation
+
+    def seconds(self, size: float, operations: int = 1) -> float:
+        """
+        Seconds the link is busy moving a number of bytes, in operations that overlap SFTP_CONCURRENCY at a time
+        """
+        return operations * self.latency / SFTP_CONCURRENCY + size / self.bandwidth
+
+    @staticmethod
+    def fit(samples: list[TransferSample]) -> 'MachineTransfer':
+        """
+        Least squares of seconds = latency + bytes * parallel / bandwidth
+        """
+        shared = np.array([sample.bytes * max(1, sample.parallel) for sample in samples], dtype=float)
+        seconds = np.array([sample.seconds for sample in samples])
+        if len(samples) >= 2 and np.ptp(shared) > 0:
+            slope, latency = np.linalg.lstsq(np.stack([shared, np.ones(len(samples))], axis=1), seconds, rcond=None)[0]
+        else:
+            slope, latency = 0.0, 0.0
+        if slope <= 0 or latency < 0:
+            # Too noisy to tell the latency apart, all the time is charged to the bytes
+            latency = 0.0
+            slope = float(np.sum(seconds) / max(1.0, np.sum(shared)))
+        bandwidth = 1 / slope if slope > 0 else TRANSFER_DEFAULT_BANDWIDTH
+        return MachineTransfer(len(samples), float(bandwidth), float(latency))
+
+
+class TransferModel:
+    """
+    Bandwidth and latency of the SSH machines, fitted on their recent SFTP copies (recorded in TRANSFER_LOG_PATH,
+    which is cut down to the recent copies once it outgrows TRANSFER_LOG_MAX_BYTES).
+    Machines without copies get TRANSFER_DEFAULT_BANDWIDTH and TRANSFER_DEFAULT_LATENCY, local machines copy nothing.
+    """
+    machines: dict[str, MachineTransfer]
+
+    def __init__(self, machines: dict[str, MachineTransfer]):
+        self.machines = machines
+
+    @staticmethod
+    def record(sample: TransferSample, path: Path | None = None) -> None:
+        path = TRANSFER_LOG_PATH if path is None else path
+        os.makedirs(path.parent, exist_ok=True)
+        # Small appends are atomic, so concurrent writers do not interleave lines
+        with open(path, "a") as f:
+            f.write(json.dumps(asdict(sample)) + "\n")
+            size = f.tell()
+        if size > TRANSFER_LOG_MAX_BYTES:
+            TransferModel.compact(path)
+
+    @staticmethod
+    def collect(path: Path | None = None, recent: int = TRANSFER_RECENT) -> list[TransferSample]:
+        """
+        The last copies of every machine
+        :param recent: Copies kept per machine
+        """
+        path = TRANSFER_LOG_PATH if path is None else path
+        if not os.path.isfile(path):
+            return []
+        by_machine: dict[str, list[TransferSample]] = {}
+        with open(path, "r") as f:
+            for line in f:
+                try:
+                    sample = TransferSample(**json.loads(line))
+                except (json.JSONDecodeError, TypeError):
+                    continue
+                by_machine.setdefault(sample.machine, []).append(sample)
+        return [sample for samples in by_machine.values() for sample in samples[-recent:]]
+
+    @staticmethod
+    def compact(path: Path | None = None, recent: int | None = None) -> None:
+        """
+        Keep only the copies collect reads, in the order they were recorded.
+        A copy another process records while the file is replaced can be lost, the fit does not miss it.
+        """
+        path = TRANSFER_LOG_PATH if path is None else path
+        recent = TRANSFER_RECENT if recent is None else recent
+        samples = sorted(TransferModel.collect(path, recent), key=lambda sample: sample.time)
+        tmp_path = path.with_suffix(".tmp")
+        utils.write_local_file(tmp_path, "".join(json.dumps(asdict(sample)) + "\n" for sample in samples))
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def fit(samples: list[TransferSample]) -> 'TransferModel':
+        by_machine: dict[str, list[TransferSample]] = {}
+        for sample in samples:
+            if sample.seconds > 0:
+                by_machine.setdefault(sample.machine, []).append(sample)
+        return TransferModel({machine: MachineTransfer.fit(runs) for machine, runs in sorted(by_machine.items())})
+
+    def link(self, machine: Machine) -> MachineTransfer | None:
+        """
+        :return: The link to a machine, None if it runs the tasks in place
+        """
+        if not machine.transfers_files:
+            return None
+        default = MachineTransfer(0, TRANSFER_DEFAULT_BANDWIDTH, TRANSFER_DEFAULT_LATENCY)
+        return self.machines.get(machine.name, default)
+
+    def batch_minutes(self, machine: Machine) -> float:
+        """
+        Minutes before a batch can start on a machine: its folder and the potential file are uploaded first
+        """
+        link = self.link(machine)
+        return 0.0 if link is None else link.seconds(UPLOAD_BYTES_PER_BATCH, 2) / 60
+
+    def minutes(self, machine: Machine, simulation_task: SimulationTask) -> float:
+        """
+        Minutes a task keeps the link to a machine busy, uploading its folder and downloading its dumps and log
+        """
+        link = self.link(machine)
+        if link is None:
+            return 0.0
+        size = upload_bytes(simulation_task) + download_bytes(simulation_task)
+        return link.seconds(size, OPERATIONS_PER_TASK) / 60
+
+
+@cache
+def get_transfer_model() -> TransferModel:
+    model = TransferModel.fit(TransferModel.collect())
+    for machine, link in model.machines.items():
+        logging.debug(f"Link to {machine}: {link.bandwidth / 1e6:.1f} MB/s, {link.latency:.2f}s latency ({link.samples} copies)")
+    return model
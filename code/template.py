@@ -1,10 +1,50 @@
 import json
+import re
+from dataclasses import dataclass
+from pathlib import Path
 
 from config.config import LAMMPS_TEMPLATE_PATH, SLURM_TEMPLATE_PATH, SLURM_MULTI_TEMPLATE_PATH, SSH_MULTI_TEMPLATE_PATH
 from utils import read_local_file
 
+PLACEHOLDER_RE = re.compile(r"{{(.*?)}}")
+
+
+@dataclass(frozen=True)
+class CompiledTemplate:
+	"""
+	A template split into literal text and {{placeholder}} segments, so rendering is a single join.
+	literals always has one more element than keys: literals[0] keys[0] literals[1] ... keys[n-1] literals[n]
+	"""
+	name: str
+	literals: tuple[str, ...]
+	keys: tuple[str, ...]
+
+	@staticmethod
+	def compile(source: str, name: str = "template") -> 'CompiledTemplate':
+		parts = PLACEHOLDER_RE.split(source)
+		return CompiledTemplate(name, tuple(parts[0::2]), tuple(parts[1::2]))
+
+	def render(self, replacements: dict[str, str]) -> str:
+		"""
+		Render the template
+		:param replacements: Value of every placeholder, extra keys are ignored
+		:return: The rendered text
+		:raises KeyError: If a placeholder has no value
+		"""
+		try:
+			values = [str(replacements[key]) for key in self.keys]
+		except KeyError:
+			missing = sorted(set(self.keys) - replacements.keys())
+			raise KeyError(f"Missing values for {missing} in {self.name}")
+		out = [""] * (len(self.literals) + len(values))
+		out[0::2] = self.literals
+		out[1::2] = values
+		return "".join(out)
+
 
 class TemplateUtils:
+	compiled: dict[Path, CompiledTemplate] = {}
+
 	@staticmethod
 	def replace_template(base: str, name: str, value: str) -> str:
 		return base.replace(f"{{{{{name}}}}}", value)
@@ -20,6 +60,22 @@ class TemplateUtils:
 	def replace_with_doc(base: str, replacements: dict[str, str], key: str):
 		return TemplateUtils.replace_templates(base, {**replacements, key: json.dumps(replacements)})
 
+	@staticmethod
+	def render_with_doc(compiled: CompiledTemplate, replacements: dict[str, str], key: str) -> str:
+		return compiled.render({**replacements, key: json.dumps(replacements)})
+
+	@staticmethod
+	def get_compiled(path: Path) -> CompiledTemplate:
+		"""
+		Load and compile a template, only the first time it is requested in this process
+		"""
+		if path not in TemplateUtils.compiled:
+			source = read_local_file(path)
+			if source is None:
+				raise FileNotFoundError(f"Template not found: {path}")
+			TemplateUtils.compiled[path] = CompiledTemplate.compile(source, path.name)
+		return TemplateUtils.compiled[path]
+
 	@staticmethod
 	def get_lammps_template():
 		return read_local_file(LAMMPS_TEMPLATE_PATH)
@@ -35,3 +91,19 @@ class TemplateUtils:
 	@staticmethod
 	def get_ssh_multi_template():
 		return read_local_file(SSH_MULTI_TEMPLATE_PATH)
+
+	@staticmethod
+	def get_compiled_lammps_template() -> CompiledTemplate:
+		return TemplateUtils.get_compiled(LAMMPS_TEMPLATE_PATH)
+
+	@staticmethod
+	def get_compiled_slurm_template() -> CompiledTemplate:
+		return TemplateUtils.get_compiled(SLURM_TEMPLATE_PATH)
+
+	@staticmethod
+	def get_compiled_slurm_multi_template() -> CompiledTemplate:
+		return TemplateUtils.get_compiled(SLURM_MULTI_TEMPLATE_PATH)
+
+	@staticmethod
+	def get_compiled_ssh_multi_template() -> CompiledTemplate:
+		return TemplateUtils.get_compiled(SSH_MULTI_TEMPLATE_PATH)
@@ -0,0 +1,18 @@
+import pytest
+
+from lammps import poorly_coded_parser, nanoparticle_locator
+from remote.execution_queue import retry_policy
+from service import journal, result_store, transfer_model
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache(tmp_path, monkeypatch):
+    """
+    Point the persistent caches of CACHE_PATH at a folder of the test, so the suite neither grows nor reads them
+    """
+    monkeypatch.setattr(poorly_coded_parser, "PARSE_CACHE_PATH", tmp_path / "parse")
+    monkeypatch.setattr(nanoparticle_locator, "SHAPE_INDEX_PATH", tmp_path / "shapes")
+    monkeypatch.setattr(journal, "JOURNAL_PATH", tmp_path / "journal.jsonl")
+    monkeypatch.setattr(retry_policy, "QUARANTINE_PATH", tmp_path / "quarantine.jsonl")
+    monkeypatch.setattr(result_store, "RESULT_STORE_PATH", tmp_path / "results")
+    monkeypatch.setattr(transfer_model, "TRANSFER_LOG_PATH", tmp_path / "transfers.jsonl")
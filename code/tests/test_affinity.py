@@ -0,0 +1,31 @@
+import os
+from unittest import TestCase, skipUnless
+
+from remote.machine.affinity import AffinityManager, parse_cpu_list
+
+
+class TestAffinity(TestCase):
+    def test_parse_cpu_list(self):
+        self.assertListEqual([0, 1, 2, 3, 8, 10, 11], parse_cpu_list("0-3,8,10-11\n"))
+
+    def test_numa_local(self):
+        affinity = AffinityManager([[0, 1, 2, 3], [4, 5, 6, 7]])
+        first = affinity.acquire(3)
+        self.assertListEqual([0, 1, 2], first)
+        # Best fit: the single free CPU of node 0 is used before splitting node 1
+        self.assertListEqual([3], affinity.acquire(1))
+        self.assertListEqual([4, 5], affinity.acquire(2))
+        self.assertIsNone(affinity.acquire(3))
+        affinity.release(first)
+        # Neither node has 4 free CPUs, the task is spread over both
+        self.assertListEqual([0, 1, 2, 6], sorted(affinity.acquire(4)))
+
+    def test_environment(self):
+        env = AffinityManager.environment([2, 3], 2)
+        self.assertEqual("2", env["OMP_NUM_THREADS"])
+        self.assertEqual("{2},{3}", env["OMP_PLACES"])
+
+    @skipUnless(hasattr(os, "sched_setaffinity"), "CPU affinity is not supported")
+    def test_from_system(self):
+        affinity = AffinityManager.from_system()
+        self.assertEqual(len(os.sched_getaffinity(0)), affinity.cpu_count)
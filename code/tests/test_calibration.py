@@ -0,0 +1,45 @@
+import re
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from config.config import DESIRED_ATOM_COUNT, FULL_RUN_DURATION, POTENTIAL_PATH
+from lammps.lattice_estimator import LatticeEstimator
+from remote.machine.local_machine import LocalMachine
+from service.calibration import (Calibration, CalibrationSample, benchmark_nanoparticles, save_calibration,
+                                 apply_calibrations, load_calibrations)
+
+
+class TestCalibration(TestCase):
+    def test_benchmark(self):
+        nanoparticles = benchmark_nanoparticles(1000)
+        atoms = [LatticeEstimator.estimate_nanoparticle(nano).atom_count for nano in nanoparticles]
+        self.assertListEqual(sorted(atoms), atoms)
+        self.assertGreater(atoms[-1], DESIRED_ATOM_COUNT)
+        self.assertIn("run          1000", nanoparticles[0]._build_lammps_code(True))
+
+    def test_potential(self):
+        # The potential is loaded relative to the run folder, as in LOCAL_EXECUTION_PATH
+        nano = benchmark_nanoparticles(1000)[0]
+        potential = re.search(r"pair_coeff\s+\* \* eam/alloy (\S+)", nano._build_lammps_code(True)).group(1)
+        self.assertEqual(POTENTIAL_PATH.resolve(), (nano.local_path / potential).resolve())
+
+    def test_fit(self):
+        samples = [CalibrationSample(atoms, 2000, 3.0 + 1e-6 * atoms * 2000) for atoms in [200, 500, 1000, 2000]]
+        calibration = Calibration.fit("local", samples, elapsed=3.0 + 4.0 + 10.0, parallelism=4)
+        self.assertAlmostEqual(1e-6, calibration.cost)
+        self.assertAlmostEqual(3.0, calibration.overhead)
+        self.assertAlmostEqual(10.0, calibration.queue_overhead)
+        self.assertAlmostEqual(13.0, calibration.launch_time)
+        self.assertAlmostEqual(1e-6 * DESIRED_ATOM_COUNT * FULL_RUN_DURATION, calibration.single_core_completion_time)
+
+    def test_apply(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "calibration.json"
+            save_calibration(Calibration("local", 5, 1e-6, 2.0, 1.0, 0.0), path)
+            save_calibration(Calibration("toko/mini", 5, 1e-5, 2.0, 60.0, 0.0), path)
+            self.assertListEqual(["local", "toko/mini"], list(load_calibrations(path)))
+            local = LocalMachine(Path("/tmp"), Path("/tmp/lmp"))
+            apply_calibrations({"local": local}, path)
+            self.assertAlmostEqual(3.0, local.launch_time)
+            self.assertAlmostEqual(1e-6 * DESIRED_ATOM_COUNT * FULL_RUN_DURATION, local.single_core_completion_time)
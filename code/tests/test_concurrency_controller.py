@@ -0,0 +1,56 @@
+from unittest import TestCase
+
+from service.concurrency_controller import ConcurrencyController, TPAS_WINDOW
+
+GIB = 2 ** 30
+
+
+class TestConcurrencyController(TestCase):
+    def controller(self, load: list[float], memory: list[int], now: list[float]) -> ConcurrencyController:
+        controller = ConcurrencyController(min_cores=1, max_cores=4, max_load=1.0, min_free_memory=GIB,
+                                           tpas_degradation=0.2, interval=10, load=lambda: load[0],
+                                           memory=lambda: memory[0], clock=lambda: now[0])
+        controller.cpus = 4
+        return controller
+
+    def test_load_and_memory(self):
+        load, memory, now = [1.0], [8 * GIB], [0.0]
+        controller = self.controller(load, memory, now)
+        self.assertEqual(3, controller.update(2))
+        # At most one change per interval
+        self.assertEqual(3, controller.update(3))
+        now[0] = 20.0
+        load[0] = 6.0
+        self.assertEqual(2, controller.update(3))
+        now[0] = 40.0
+        load[0], memory[0] = 0.5, GIB // 2
+        self.assertEqual(1, controller.update(2))
+        now[0] = 60.0
+        self.assertEqual(1, controller.update(1))
+        memory[0] = 8 * GIB
+        self.assertEqual(2, controller.update(1))
+
+    def test_bounds(self):
+        controller = self.controller([0.0], [8 * GIB], [0.0])
+        self.assertEqual(4, controller.initial_cores)
+        self.assertEqual(4, controller.update(4))
+
+    def test_initial_cores(self):
+        load = [1.5]
+        controller = self.controller(load, [8 * GIB], [0.0])
+        self.assertEqual(2, controller.initial_cores)
+        load[0] = 7.0
+        self.assertEqual(1, controller.initial_cores)
+        load[0] = None
+        self.assertEqual(1, controller.initial_cores)
+
+    def test_tpas_degradation(self):
+        controller = self.controller([3.5], [8 * GIB], [0.0])
+        for _ in range(TPAS_WINDOW):
+            controller.observe(1.0)
+        self.assertEqual(3, controller.update(3))
+        for _ in range(TPAS_WINDOW):
+            controller.observe(0.5)
+        self.assertTrue(controller.is_degraded())
+        self.assertEqual(2, controller.update(3))
+        self.assertFalse(controller.is_degraded())
@@ -0,0 +1,58 @@
+from unittest import TestCase
+
+from lammps.simulation_task import SimulationTask
+from opt import GPUOpt, MPIOpt, OMPOpt
+from remote.execution_queue.task_store import TaskStore
+from service.core_budget import CoreBudget
+from service.scheduler_service import SchedulerService
+
+
+def task(threads: int) -> SimulationTask:
+    return SimulationTask("a.in", GPUOpt(), MPIOpt(), OMPOpt(use=threads > 1, n_threads=threads), "")
+
+
+class TestCoreBudget(TestCase):
+    def test_packing(self):
+        budget = CoreBudget(4, clock=lambda: 0.0)
+        store = TaskStore()
+        wide, medium, small = task(3), task(2), task(1)
+        for simulation_task in [wide, medium, small]:
+            store.add(simulation_task)
+        fits = lambda simulation_task: budget.fits(budget.demand(simulation_task))
+        self.assertIs(wide, store.pop(fits))
+        budget.acquire(3)
+        # The 2 core task does not fit next to the 3 core one, the single core task does
+        self.assertIs(small, store.pop(fits))
+        budget.acquire(1)
+        self.assertIsNone(store.pop(fits))
+        self.assertEqual(4, budget.demand(task(8)))
+
+    def test_utilization(self):
+        now = [0.0]
+        budget = CoreBudget(4, clock=lambda: now[0])
+        budget.acquire(2)
+        now[0] = 10.0
+        budget.release(2)
+        now[0] = 20.0
+        utilization = budget.utilization()
+        self.assertAlmostEqual(20.0, utilization["busy_core_seconds"])
+        self.assertAlmostEqual(80.0, utilization["capacity_core_seconds"])
+        self.assertAlmostEqual(0.25, utilization["utilization"])
+        self.assertEqual(2, utilization["peak_cores"])
+
+    def test_max_parallel(self):
+        self.assertEqual(8, CoreBudget.max_parallel(16, [task(1), task(1)], 8))
+        with self.assertLogs(level="WARNING"):
+            self.assertEqual(4, CoreBudget.max_parallel(16, [task(1), task(4)], 8))
+        self.assertEqual(7, SchedulerService.core_demand([task(1), task(4), task(2)]))
+
+    def test_resize(self):
+        now = [0.0]
+        budget = CoreBudget(2, clock=lambda: now[0])
+        budget.acquire(2)
+        now[0] = 10.0
+        budget.resize(4)
+        now[0] = 20.0
+        utilization = budget.utilization()
+        self.assertAlmostEqual(60.0, utilization["capacity_core_seconds"])
+        self.assertTrue(budget.fits(2))
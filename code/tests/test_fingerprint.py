@@ -0,0 +1,45 @@
+from unittest import TestCase
+
+from lammps.fingerprint import Fingerprint, FingerprintIndex
+from lammps.lattice_estimator import LatticeEstimator
+
+LATTICE = "lattice bcc 2.8665"
+
+
+def fingerprint(*commands: str) -> Fingerprint:
+    return Fingerprint.of_estimate(LatticeEstimator.estimate([LATTICE, *commands]))
+
+
+def half_sphere(axis_normal: str, ratio: str = "0.3") -> Fingerprint:
+    return fingerprint(
+        "region reg0 sphere 0 0 0 10 units box",
+        "create_atoms 1 region reg0",
+        f"region reg1 plane 0 0 0 {axis_normal} units box",
+        "set region reg1 type 2",
+        f"set region reg0 type/ratio 2 {ratio} 123",
+    )
+
+
+class TestFingerprint(TestCase):
+    def test_symmetric_copies_share_digest(self):
+        self.assertEqual(half_sphere("1 0 0").digest, half_sphere("0 -1 0").digest)
+        self.assertEqual(0, half_sphere("1 0 0").distance(half_sphere("0 0 1")))
+
+    def test_random_selections_change_digest(self):
+        self.assertNotEqual(half_sphere("1 0 0").digest, half_sphere("1 0 0", "0.4").digest)
+
+    def test_near_duplicates(self):
+        index = FingerprintIndex()
+        index.add("sphere", fingerprint("region reg0 sphere 0 0 0 10 units box", "create_atoms 1 region reg0"))
+        index.add("copy", fingerprint("region reg0 sphere 0 0 0 10 units box", "create_atoms 1 region reg0"))
+        index.add("pore", fingerprint(
+            "region reg0 sphere 0 0 0 10 units box",
+            "create_atoms 1 region reg0",
+            "region reg1 sphere 0 8 0 2 units box",
+            "delete_atoms region reg1 compress yes",
+        ))
+        index.add("cube", fingerprint("region reg0 block -8 8 -8 8 -8 8 units box", "create_atoms 1 region reg0"))
+        self.assertEqual([["sphere", "copy"]], index.exact_duplicates())
+        pairs = {frozenset(pair[:2]): pair[2] for pair in index.near_duplicates(0.05)}
+        self.assertEqual({frozenset(("sphere", "pore")), frozenset(("copy", "pore"))}, set(pairs.keys()))
+        self.assertGreater(pairs[frozenset(("sphere", "pore"))], 0)
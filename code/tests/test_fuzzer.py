@@ -0,0 +1,24 @@
+from unittest import TestCase
+
+from cli_parts import fuzzer
+
+PARAM_SPACE = {"radius:5:15": (5.0, 15.0), "height:10:30": (10.0, 30.0)}
+
+
+class TestFuzzer(TestCase):
+    def test_param_space(self):
+        self.assertEqual(PARAM_SPACE, fuzzer.get_param_space(["radius:5:15", "height:10:30"]))
+
+    def test_grid_samples(self):
+        samples = fuzzer.grid_samples(PARAM_SPACE, 3)
+        self.assertEqual(9, len(samples))
+        self.assertIn({"radius:5:15": 5.0, "height:10:30": 30.0}, samples)
+        self.assertEqual([5.0, 10.0, 15.0], sorted({s["radius:5:15"] for s in samples}))
+
+    def test_latin_hypercube_samples(self):
+        samples = fuzzer.latin_hypercube_samples(PARAM_SPACE, 10)
+        self.assertEqual(10, len(samples))
+        for key, (low, high) in PARAM_SPACE.items():
+            strata = sorted(int((s[key] - low) / (high - low) * 10) for s in samples)
+            self.assertEqual(list(range(10)), strata, "Every stratum must be used exactly once")
+        self.assertEqual(samples, fuzzer.latin_hypercube_samples(PARAM_SPACE, 10))
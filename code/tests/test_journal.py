@@ -0,0 +1,83 @@
+import os
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from lammps.nanoparticlebuilder import NanoparticleBuilder
+from lammps.simulation_task import SimulationTask
+from remote.execution_queue import task_store
+from remote.execution_queue.task_store import TaskStore
+from service import journal, result_store
+from service.journal import ExecutionJournal
+
+
+class TestJournal(TestCase):
+    def test_latest(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            execution_journal = ExecutionJournal(Path(tmp) / "journal.jsonl")
+            store = TaskStore()
+            store.journal = execution_journal
+            task = SimulationTask("a.in", local_cwd=tmp, input_hash="abc")
+            store.add(task)
+            store.pop()
+            with open(execution_journal.path, "a") as f:
+                f.write('{"type": "task", "key": "abc"')  # Crashed while writing
+            latest = execution_journal.latest()
+            self.assertEqual(task_store.RUNNING, latest["abc"].state)
+            self.assertEqual(Path(tmp), latest["abc"].folder)
+
+    def test_open_batches(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            execution_journal = ExecutionJournal(Path(tmp) / "journal.jsonl")
+            tasks = [SimulationTask("a.in", local_cwd=f"{tmp}/{i}", input_hash=str(i)) for i in range(2)]
+            execution_journal.record_batch("toko", "batch_1", None, tasks[:1])
+            execution_journal.record_batch("toko", "batch_2", None, tasks[1:])
+            execution_journal.set_batch_job("batch_2", "42")
+            execution_journal.finish_batch("batch_1")
+            batches = execution_journal.open_batches("toko")
+            self.assertListEqual(["batch_2"], list(batches))
+            self.assertEqual("42", batches["batch_2"].job)
+            self.assertSetEqual({f"{tmp}/1"}, batches["batch_2"].folders)
+            self.assertDictEqual({}, execution_journal.open_batches("other"))
+
+    def test_compact(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            execution_journal = ExecutionJournal(Path(tmp) / "journal.jsonl")
+            store = TaskStore()
+            store.journal = execution_journal
+            kept = SimulationTask("a.in", local_cwd=tmp, input_hash="abc")
+            gone = SimulationTask("b.in", local_cwd=f"{tmp}/gone", input_hash="def")
+            for task in [kept, gone]:
+                store.add(task)
+            while (task := store.pop()) is not None:
+                store.finish(task, True)
+            execution_journal.record_batch("toko", "batch_1", None, [kept])
+            execution_journal.record_batch("toko", "batch_2", None, [kept])
+            execution_journal.set_batch_job("batch_2", "42")
+            execution_journal.finish_batch("batch_1")
+            latest, batches = execution_journal.latest(), execution_journal.open_batches("toko")
+            execution_journal.compact()
+            self.assertEqual(3, len(execution_journal.records()))
+            self.assertDictEqual({"abc": latest["abc"]}, execution_journal.latest())
+            self.assertDictEqual(batches, execution_journal.open_batches("toko"))
+
+    def test_resume_completed(self):
+        nano_builder = NanoparticleBuilder("Test")
+        nano_builder.configure_lattice("bcc", "2.8665", [])
+        with tempfile.TemporaryDirectory() as tmp:
+            with patch.object(result_store, "get_result_store", return_value=None):
+                first = nano_builder.build()
+                first.local_path = Path(tmp) / "first"
+                self.assertIsNotNone(first.prepare_execution(test_run=True))
+                self.assertFalse(journal.is_completed(first.local_path))
+                # Pretend LAMMPS ran before the process was killed
+                (first.local_path / "log.lammps").write_text("Loop time\nTotal wall time: 0:00:01\n")
+                self.assertTrue(journal.is_completed(first.local_path))
+                previous = {first.input_hash: journal.JournalEntry(task_store.DONE, first.local_path, 0.0)}
+                second = nano_builder.build()
+                self.assertIsNone(second.prepare_execution(test_run=True, previous=previous))
+                self.assertEqual(first.local_path, second.local_path)
+                os.remove(first.local_path / "log.lammps")
+                third = nano_builder.build()
+                self.assertIsNotNone(third.prepare_execution(test_run=True, previous=previous))
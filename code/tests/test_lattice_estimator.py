@@ -0,0 +1,51 @@
+from pathlib import Path
+from unittest import TestCase
+
+from lammps import shapes
+from lammps.lattice_estimator import LatticeEstimator
+from lammps.poorly_coded_parser import PoorlyCodedParser
+
+LATTICE = "lattice bcc 2.8665"
+
+
+class TestLatticeEstimator(TestCase):
+    def test_sphere_matches_lattice_point_count(self):
+        result = LatticeEstimator.estimate([LATTICE, "region reg0 sphere 0 0 0 10 units box", "create_atoms 1 region reg0"])
+        self.assertEqual(shapes.Sphere(10, (0, 0, 0)).get_lattice_point_count(), result.atom_count)
+
+    def test_delete_and_side_out(self):
+        full = LatticeEstimator.estimate([LATTICE, "region reg0 sphere 0 0 0 10 units box", "create_atoms 1 region reg0"])
+        result = LatticeEstimator.estimate([
+            LATTICE,
+            "region reg0 sphere 0 0 0 10 units box",
+            "create_atoms 1 region reg0",
+            "region reg1 plane 0 0 0 1 0 0 units box side out",
+            "delete_atoms region reg1 compress yes",
+        ])
+        self.assertTrue(all(result.positions[:, 0] >= 0))
+        self.assertLess(result.atom_count, full.atom_count)
+
+    def test_random_selections_are_exact_counts(self):
+        result = LatticeEstimator.estimate([
+            LATTICE,
+            "region reg0 sphere 0 0 0 10 units box",
+            "create_atoms 1 region reg0",
+            "group Fe type 1",
+            "set group Fe type/subset 2 100 300",
+        ])
+        self.assertEqual(100, result.count_atoms_of_type(2))
+        result = LatticeEstimator.estimate([
+            LATTICE,
+            "region reg0 sphere 0 0 0 10 units box",
+            "create_atoms 1 region reg0",
+            "set region reg0 type/ratio 2 0.5 300",
+        ])
+        self.assertEqual(result.atom_count // 2, result.count_atoms_of_type(2))
+
+    def test_matches_lammps_on_test_shape(self):
+        # Same expectations as the LAMMPS run in test_cli.TestExec.test_execute
+        _, builder = PoorlyCodedParser.parse_single_shape(Path("../Shapes/Test/Cone_Multilayer.2.Axis.X_05_Full_0.in"))
+        result = LatticeEstimator.estimate_nanoparticle(builder.build())
+        self.assertEqual(1255, result.atom_count)
+        self.assertEqual(830, result.count_atoms_of_type(1))
+        self.assertEqual(425, result.count_atoms_of_type(2))
@@ -0,0 +1,167 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+from unittest import TestCase, skipUnless
+
+from lammps.simulation_task import SimulationTask
+from model.execution_metadata import ExecutionMetadata
+from opt import GPUOpt, MPIOpt, OMPOpt
+from remote.execution_queue.async_local_execution_queue import AsyncLocalExecutionQueue
+from remote.execution_queue.execution_queue import ExecutionQueue
+from remote.execution_queue.local_execution_queue import SharedLocalExecutionQueue
+from remote.machine.local_machine import LocalMachine
+from service import executor_service
+from service.concurrency_controller import ConcurrencyController
+
+# Stands in for LAMMPS: prints the name of its input file
+FAKE_LAMMPS = f"#!{sys.executable}\nimport sys\nprint(sys.argv[-1])\n"
+
+
+class TestSharedLocalExecutionQueue(TestCase):
+    def run_queue(self, folder: Path, threads: int, atoms: list[int]) -> tuple[list[str], list[dict]]:
+        fake_lammps = folder / "fake_lammps"
+        fake_lammps.write_text(FAKE_LAMMPS)
+        os.chmod(fake_lammps, 0o755)
+        queue = SharedLocalExecutionQueue(LocalMachine(folder, fake_lammps), threads)
+        outputs, events = [], []
+        for i, atom_count in enumerate(atoms):
+            task = SimulationTask(folder / f"{i}.in", GPUOpt(), MPIOpt(), OMPOpt(), folder, estimated_atoms=atom_count)
+            task.add_callback(lambda result: outputs.append(Path(result.strip()).stem))
+            queue.enqueue(task)
+        queue.listen(ExecutionQueue.PROGRESS, lambda **kwargs: events.append(kwargs))
+        self.assertEqual(len(atoms), len(queue.run()))
+        return outputs, events
+
+    def test_largest_first(self):
+        with tempfile.TemporaryDirectory() as folder:
+            outputs, events = self.run_queue(Path(folder), 1, [10, 300, 20, 100])
+            self.assertListEqual(["1", "3", "2", "0"], outputs)
+            self.assertListEqual([1, 2, 3, 4], [event["progress"] for event in events])
+
+    def test_threads(self):
+        with tempfile.TemporaryDirectory() as folder:
+            outputs, events = self.run_queue(Path(folder), 3, list(range(8)))
+            self.assertListEqual([str(i) for i in range(8)], sorted(outputs))
+            self.assertListEqual(list(range(1, 9)), sorted(event["progress"] for event in events))
+            self.assertTrue(all(event["total"] == 8 for event in events))
+
+
+class TestAsyncLocalExecutionQueue(TestCase):
+    def test_run(self):
+        with tempfile.TemporaryDirectory() as folder:
+            folder = Path(folder)
+            fake_lammps = folder / "fake_lammps"
+            fake_lammps.write_text(FAKE_LAMMPS + "sys.exit(int(sys.argv[-1].endswith('fail.in')))\n")
+            os.chmod(fake_lammps, 0o755)
+            queue = AsyncLocalExecutionQueue(LocalMachine(folder, fake_lammps), 2)
+            results: dict[str, str | None] = {}
+            for name in ["a", "b", "fail"]:
+                os.makedirs(folder / name)
+                task = SimulationTask(folder / name / f"{name}.in", GPUOpt(), MPIOpt(), OMPOpt(), folder / name)
+                task.add_callback(lambda result, name=name: results.__setitem__(name, result))
+                queue.enqueue(task)
+            events = []
+            queue.listen(ExecutionQueue.PROGRESS, lambda **kwargs: events.append(kwargs))
+            tasks = {task.local_cwd.name: task for task in queue.run()}
+            self.assertEqual(3, len(events))
+            self.assertEqual(str(folder / "a" / "lammps.out"), results["a"])
+            self.assertEqual(str(folder / "a" / "a.in"), (folder / "a" / "lammps.out").read_text().strip())
+            self.assertTrue(tasks["a"].ok and tasks["a"].metadata.ok)
+            self.assertIsNone(results["fail"])
+            self.assertFalse(tasks["fail"].ok)
+            self.assertEqual(1, tasks["fail"].metadata.exit_code)
+
+    def test_missing_executable(self):
+        with tempfile.TemporaryDirectory() as folder:
+            folder = Path(folder)
+            queue = AsyncLocalExecutionQueue(LocalMachine(folder, folder / "missing"), 1, stdout_file=None)
+            results = []
+            task = SimulationTask(folder / "a.in", GPUOpt(), MPIOpt(), OMPOpt(), folder)
+            task.add_callback(results.append)
+            queue.enqueue(task)
+            with self.assertLogs(level="ERROR"):
+                queue.run()
+            self.assertListEqual([None], results)
+            self.assertIsNone(task.metadata.exit_code)
+
+    @skipUnless(sys.platform != "win32", "Uses a fake LAMMPS script")
+    def test_path_with_spaces(self):
+        with tempfile.TemporaryDirectory() as folder:
+            folder = Path(folder) / "lammps install"
+            os.makedirs(folder / "nano particle")
+            fake_lammps = folder / "fake lammps"
+            fake_lammps.write_text(FAKE_LAMMPS)
+            os.chmod(fake_lammps, 0o755)
+            input_file = folder / "nano particle" / "in.lmp"
+            queue = AsyncLocalExecutionQueue(LocalMachine(folder, fake_lammps), 1, pin_cores=False)
+            queue.enqueue(SimulationTask(input_file, GPUOpt(), MPIOpt(), OMPOpt(), folder / "nano particle"))
+            task = queue.run()[0]
+            self.assertTrue(task.ok)
+            self.assertEqual(str(input_file), (folder / "nano particle" / "lammps.out").read_text().strip())
+
+    def test_core_budget(self):
+        with tempfile.TemporaryDirectory() as folder:
+            folder = Path(folder)
+            fake_lammps = folder / "fake_lammps"
+            fake_lammps.write_text(FAKE_LAMMPS)
+            os.chmod(fake_lammps, 0o755)
+            queue = AsyncLocalExecutionQueue(LocalMachine(folder, fake_lammps), 4, stdout_file=None)
+            for i, threads in enumerate([3, 2, 1, 1, 4]):
+                omp = OMPOpt(use=threads > 1, n_threads=threads)
+                queue.enqueue(SimulationTask(folder / f"{i}.in", GPUOpt(), MPIOpt(), omp, folder))
+            self.assertEqual(5, len(queue.run()))
+            self.assertLessEqual(queue.utilization["peak_cores"], 4)
+            self.assertGreater(queue.utilization["busy_core_seconds"], 0)
+
+    def test_runs(self):
+        with tempfile.TemporaryDirectory() as folder:
+            folder = Path(folder)
+            fake_lammps = folder / "fake_lammps"
+            fake_lammps.write_text(FAKE_LAMMPS)
+            os.chmod(fake_lammps, 0o755)
+            queue = AsyncLocalExecutionQueue(LocalMachine(folder, fake_lammps), 4, stdout_file=None, pin_cores=False, runs=2)
+            for i in range(5):
+                queue.enqueue(SimulationTask(folder / f"{i}.in", GPUOpt(), MPIOpt(), OMPOpt(), folder))
+            self.assertEqual(5, len(queue.run()))
+            self.assertEqual(2, queue.utilization["peak_cores"])
+            self.assertEqual(2, queue.parallelism_count)
+
+    def test_executor(self):
+        queue = executor_service.get_executor("local:3")
+        self.assertEqual(3, queue.runs)
+        self.assertGreaterEqual(queue.cores, 3)
+        queue = executor_service.get_executor("local:cores=5")
+        self.assertEqual(5, queue.cores)
+        self.assertIsNone(queue.runs)
+        queue = executor_service.get_executor("local:shared=2")
+        self.assertIsInstance(queue, SharedLocalExecutionQueue)
+        self.assertEqual(2, queue.threads)
+
+    def test_controller(self):
+        with tempfile.TemporaryDirectory() as folder:
+            folder = Path(folder)
+            fake_lammps = folder / "fake_lammps"
+            fake_lammps.write_text(FAKE_LAMMPS)
+            os.chmod(fake_lammps, 0o755)
+            controller = ConcurrencyController(min_cores=1, max_cores=3, interval=0, load=lambda: 0.0, memory=lambda: None)
+            queue = AsyncLocalExecutionQueue(LocalMachine(folder, fake_lammps), 1, stdout_file=None, controller=controller)
+            for i in range(6):
+                queue.enqueue(SimulationTask(folder / f"{i}.in", GPUOpt(), MPIOpt(), OMPOpt(), folder))
+            self.assertEqual(6, len(queue.run()))
+            self.assertGreater(queue.utilization["peak_cores"], 1)
+            self.assertLessEqual(queue.utilization["peak_cores"], 3)
+
+    @skipUnless(hasattr(os, "sched_setaffinity"), "CPU affinity is not supported")
+    def test_pinning(self):
+        with tempfile.TemporaryDirectory() as folder:
+            folder = Path(folder)
+            fake_lammps = folder / "fake_lammps"
+            fake_lammps.write_text(FAKE_LAMMPS + "import os\nprint(sorted(os.sched_getaffinity(0)), os.environ['OMP_PLACES'])\n")
+            os.chmod(fake_lammps, 0o755)
+            queue = AsyncLocalExecutionQueue(LocalMachine(folder, fake_lammps), 1, pin_cores=True)
+            queue.enqueue(SimulationTask(folder / "a.in", GPUOpt(), MPIOpt(), OMPOpt(), folder))
+            task = queue.run()[0]
+            cpu = task.metadata.cores[0]
+            self.assertEqual(f"[{cpu}] {{{cpu}}}", (folder / "lammps.out").read_text().split("\n")[1])
+            self.assertListEqual([cpu], ExecutionMetadata.load(folder).cores)
@@ -0,0 +1,66 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+from unittest import TestCase, skipUnless
+
+from lammps.simulation_task import SimulationTask
+from opt import GPUOpt, MPIOpt, OMPOpt
+from remote.execution_queue.async_local_execution_queue import AsyncLocalExecutionQueue
+from remote.execution_queue.execution_queue import ExecutionQueue
+from remote.execution_queue.local_execution_queue import SharedLocalExecutionQueue
+from remote.execution_queue.mixed_execution_queue import MixedExecutionQueue
+from remote.execution_queue.retry_policy import RetryPolicy
+from remote.machine.local_machine import LocalMachine
+
+# Stands in for LAMMPS: prints the name of its input file, or is killed like a run out of memory
+FAKE_LAMMPS = f"#!{sys.executable}\nimport sys\nprint(sys.argv[-1])\n"
+KILLED_LAMMPS = f"#!{sys.executable}\nimport os, signal\nos.kill(os.getpid(), signal.SIGKILL)\n"
+
+
+def fake_machine(folder: Path, name: str, script: str, seconds: float) -> LocalMachine:
+    executable = folder / name
+    executable.write_text(script)
+    os.chmod(executable, 0o755)
+    machine = LocalMachine(folder, executable, single_core_completion_time=seconds)
+    machine.name = name
+    return machine
+
+
+@skipUnless(sys.platform.startswith("linux"), "Uses a fake LAMMPS script")
+class TestMixedExecutionQueue(TestCase):
+    def test_fail_over(self):
+        with tempfile.TemporaryDirectory() as folder:
+            folder = Path(folder)
+            # The planner prefers the fast machine, whose runs are all killed, they end up on the spare one
+            fast = AsyncLocalExecutionQueue(fake_machine(folder, "fast", KILLED_LAMMPS, 1.0), 2, pin_cores=False)
+            spare = SharedLocalExecutionQueue(fake_machine(folder, "spare", FAKE_LAMMPS, 100.0), 2)
+            queue = MixedExecutionQueue([fast, spare])
+            queue.set_retry_policy(RetryPolicy(max_attempts=1))
+            results: dict[str, str | None] = {}
+            tasks = []
+            for i in range(6):
+                os.makedirs(folder / str(i))
+                task = SimulationTask(folder / str(i) / f"{i}.in", GPUOpt(), MPIOpt(), OMPOpt(), folder / str(i))
+                task.add_callback(lambda result, name=str(i): results.__setitem__(name, result))
+                queue.enqueue(task)
+                tasks.append(task)
+            events = []
+            queue.listen(ExecutionQueue.PROGRESS, lambda **kwargs: events.append(kwargs))
+            completed = queue.run()
+            # The enqueued tasks themselves come back, and the callbacks ran in this process
+            self.assertSetEqual({id(task) for task in tasks}, {id(task) for task in completed})
+            self.assertTrue(all(task.ok and task.failed_on == ["fast"] for task in completed))
+            self.assertEqual(6, len([result for result in results.values() if result is not None]))
+            failovers = queue.retry_policy.failovers
+            self.assertGreater(failovers, 0)
+            self.assertListEqual(list(range(1, 7 + failovers)), [event["progress"] for event in events])
+            self.assertEqual(6 + failovers, events[-1]["total"])
+
+    def test_name(self):
+        with tempfile.TemporaryDirectory() as folder:
+            folder = Path(folder)
+            queues = [AsyncLocalExecutionQueue(fake_machine(folder, name, FAKE_LAMMPS, 1.0), 1) for name in ["a", "b", "c"]]
+            nested = MixedExecutionQueue([queues[0], MixedExecutionQueue(queues[1:])])
+            self.assertEqual("a,b,c", nested.name)
+            self.assertEqual(3, nested.parallelism_count)
@@ -0,0 +1,31 @@
+from unittest import TestCase
+
+from lammps.nanoparticlebuilder import NanoparticleBuilder, SeedProgram
+
+
+class TestNanoparticleBuilder(TestCase):
+    def test_seed_program(self):
+        program = SeedProgram.compile(["set group Fe type/ratio 2 0.3 zeed:1", "lattice bcc 2.8665"], 2)
+        self.assertEqual(["set group Fe type/ratio 2 0.3 7", "lattice bcc 2.8665"], program.fill([5, 7]))
+        with self.assertRaises(Exception):
+            program.fill([5])
+        with self.assertRaises(Exception):
+            SeedProgram.compile(["set group Fe type/ratio 2 0.3 zeed:2"], 2)
+
+    def test_no_prefix_collision(self):
+        nano_builder = NanoparticleBuilder()
+        for i in range(11):
+            nano_builder.add_set_type_ratio_group("2", "Fe", "0.3", str(i))
+        seeds = [1000 + i for i in range(11)]
+        nano = nano_builder.build(seeds)
+        self.assertEqual("set group Fe type/ratio 2 0.3 1001", nano.atom_manipulation[1])
+        self.assertEqual("set group Fe type/ratio 2 0.3 1010", nano.atom_manipulation[10])
+
+    def test_build_variants(self):
+        nano_builder = NanoparticleBuilder("Test")
+        nano_builder.add_set_type_subset_group("2", "Fe", "10", "123")
+        variants = nano_builder.build_variants([[1], [2], [3]])
+        self.assertEqual([f"set group Fe type/subset 2 10 {i}" for i in (1, 2, 3)],
+                         [nano.atom_manipulation[0] for nano in variants])
+        self.assertEqual(["zeed:0"], [nano_builder.atom_manipulation[0].split(" ")[-1]])
+        self.assertEqual("[2]", variants[1].extra_replacements["seeds"])
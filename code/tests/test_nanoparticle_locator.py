@@ -1,6 +1,10 @@
+import json
+import os
+import tempfile
 from pathlib import Path
 from unittest import TestCase
 
+import utils
 from lammps import nanoparticle_locator
 
 PATH = Path("../Shapes")
@@ -30,3 +34,24 @@ class TestNanoparticleLocator(TestCase):
 		particles = list(nanoparticle_locator.NanoparticleLocator.sorted_search(PATH, extension=".blabla"))
 		if len(particles) != 0:
 			self.fail("Found particles that don't exist")
+
+	def test_shape_index(self):
+		with tempfile.TemporaryDirectory() as folder, tempfile.TemporaryDirectory() as cache:
+			root = Path(folder)
+			os.makedirs(root / "Spheres")
+			for name in ["Sphere_Multilayer.2.Axis.X_Sharp_Pores.1_0.in", "Sphere_Random_Sharp_Void_0.in",
+						 "Cone_Multilayer.3.Axis.Z_Sharp_Void_0.in"]:
+				utils.write_local_file(root / "Spheres" / name, "")
+			os.utime(root / "Spheres", ns=(0, 0))
+			index = nanoparticle_locator.ShapeIndex.build(root)
+			self.assertListEqual(index.paths(), list(nanoparticle_locator.NanoparticleLocator.sorted_search(root)))
+			self.assertEqual(2, len(index.filter(distribution="Multilayer")))
+			self.assertEqual(1, len(index.filter(shape="Sphere", distribution="Multilayer")))
+			self.assertEqual(1, len(index.filter(pores="Pores.1")))
+			self.assertEqual(0, len(index.filter(shape="Sphere", interface="Smooth")))
+			index.save(Path(cache) / "index.json")
+			loaded = nanoparticle_locator.ShapeIndex.from_dict(root, json.loads(utils.read_local_file(Path(cache) / "index.json")))
+			self.assertListEqual(index.paths(), loaded.paths())
+			self.assertTrue(loaded.is_valid())
+			utils.write_local_file(root / "Spheres" / "Sphere_Random_Sharp_Void_1.in", "")
+			self.assertFalse(loaded.is_valid())
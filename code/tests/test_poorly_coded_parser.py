@@ -1,7 +1,12 @@
+import tempfile
+from pathlib import Path
 from unittest import TestCase
+from unittest.mock import patch
 
+from config.config import PARSE_CACHE_PATH
 from lammps import shapes
 from lammps.nanoparticlebuilder import NanoparticleBuilder
+from lammps.parse_cache import ParseCache
 from lammps.poorly_coded_parser import PoorlyCodedParser
 from lammps.shapes import Cylinder, Sphere
 
@@ -126,6 +131,79 @@ class TestPoorlyCodedParser(TestCase):
         PoorlyCodedParser.parse_line("delete_atoms region test compress yes", nano_builder)
         self.assertEqual('delete_atoms region reg0 compress yes', nano_builder.atom_manipulation[-1])
 
+    def test_register(self):
+        nano_builder: NanoparticleBuilder = NanoparticleBuilder()
+        with self.assertRaises(ValueError):
+            PoorlyCodedParser.parse_line("displace_atoms all move 1 0 0", nano_builder)
+        with patch.dict(PoorlyCodedParser.handlers), patch.dict(PoorlyCodedParser.sub_style_locators):
+            PoorlyCodedParser.register_sub_style_locator("displace_atoms", lambda tokens: tokens[2])
+
+            @PoorlyCodedParser.register("displace_atoms", "move")
+            def displace_move(tokens, nano, strict):
+                nano.atom_manipulation.append(" ".join(tokens))
+
+            PoorlyCodedParser.parse_line("displace_atoms \tall move 1 0 0", nano_builder)
+            self.assertEqual(["displace_atoms all move 1 0 0"], nano_builder.atom_manipulation)
+            with self.assertRaises(ValueError):
+                PoorlyCodedParser.parse_line("displace_atoms all rotate 0 0 0 0 0 1 90", nano_builder)
+        self.assertNotIn(("displace_atoms", "move"), PoorlyCodedParser.handlers)
+
+    def test_strict(self):
+        # A region that does not render back to the same line is only caught in strict mode
+        with patch.object(shapes.Sphere, "get_region", lambda self, name: f"region {name} sphere 0 0 0 1 units box"):
+            with self.assertRaises(AssertionError):
+                PoorlyCodedParser.parse_line("region test sphere 0 0 0 10 units box", NanoparticleBuilder(), strict=True)
+            nano_builder: NanoparticleBuilder = NanoparticleBuilder()
+            PoorlyCodedParser.parse_line("region test sphere 0 0 0 10 units box", nano_builder, strict=False)
+            self.assertEqual([Sphere(10, (0, 0, 0))], nano_builder.regions)
+
+    def test_parse_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            shape_path = Path(tmp) / "Sphere.in"
+            shape_path.write_text("lattice bcc 2.8665\nregion test sphere 0 0 0 10 units box\n"
+                                  "create_atoms 1 region test\nset region test type/ratio 2 0.3 123\n")
+            cache = ParseCache(Path(tmp) / "cache", "test")
+            with patch.object(PoorlyCodedParser, "get_parse_cache", return_value=cache):
+                _, parsed = PoorlyCodedParser.parse_single_shape(shape_path, full_file=True)
+                with patch.object(PoorlyCodedParser, "parse_shape", side_effect=AssertionError("Not cached")):
+                    _, cached = PoorlyCodedParser.parse_single_shape(shape_path, full_file=True)
+                self.assertEqual(parsed.to_state(), cached.to_state())
+                self.assertEqual("Sphere.in", cached.title)
+                # Changing the contents invalidates the entry
+                shape_path.write_text("lattice bcc 2.8665\nregion test sphere 0 0 0 8 units box\n")
+                _, changed = PoorlyCodedParser.parse_single_shape(shape_path, full_file=True)
+                self.assertEqual([Sphere(8, (0, 0, 0))], changed.regions)
+                # A lenient parse does not answer a strict one, which still checks the round trip
+                shape_path.write_text("lattice bcc 2.8665\nregion test sphere 0 0 0 6 units box\n")
+                PoorlyCodedParser.parse_single_shape(shape_path, full_file=True, strict=False)
+                with patch.object(shapes.Sphere, "get_region", lambda self, name: f"region {name} sphere 0 0 0 1 units box"):
+                    with self.assertRaises(AssertionError):
+                        PoorlyCodedParser.parse_single_shape(shape_path, full_file=True, strict=True)
+            self.assertEqual(3, cache.clear())
+
+    def test_parse_cache_isolated(self):
+        # The suite parses shapes into a folder of the test (see conftest), not into the cache of the user
+        cache = PoorlyCodedParser.get_parse_cache()
+        if cache is not None:
+            self.assertNotEqual(PARSE_CACHE_PATH.resolve(), cache.path.resolve())
+
+    def test_load_shapes_parallel(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for i in range(6):
+                (Path(tmp) / f"Sphere_{i}.in").write_text(f"lattice bcc 2.8665\nregion s sphere 0 0 0 {i + 5} units box\nmass 1 55.845\n")
+            (Path(tmp) / "Broken.in").write_text("lattice bcc 2.8665\nregion s torus 0 0 0 5 units box\nmass 1 55.845\n")
+            (Path(tmp) / "Sphere_2_broken.in").write_text("lattice bcc 2.8665\nregion s blob 0 0 0 5 units box\nmass 1 55.845\n")
+            paths = sorted(Path(tmp).glob("*.in"))
+            with patch.object(PoorlyCodedParser, "get_parse_cache", return_value=None):
+                # One shape per chunk, so the workers interleave and the results come back out of order
+                for processes in [1, 2]:
+                    shapes_, errors = PoorlyCodedParser.load_shapes_from_paths_parallel(paths, processes=processes, chunk_size=1)
+                    self.assertEqual([f"Sphere_{i}.in" for i in range(6)], [nano.title for _, nano in shapes_])
+                    self.assertEqual([5 + i for i in range(6)], [nano.regions[0].radius for _, nano in shapes_])
+                    self.assertEqual([Path(tmp) / "Broken.in", Path(tmp) / "Sphere_2_broken.in"], [shape for shape, _ in errors])
+                    self.assertIn("torus", errors[0][1])
+                    self.assertIn("blob", errors[1][1])
+
     def confirm_shape(
             self,
             command: str,
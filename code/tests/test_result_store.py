@@ -0,0 +1,48 @@
+import os
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from lammps.nanoparticlebuilder import NanoparticleBuilder
+from service import result_store
+from service.result_store import ResultStore
+
+
+class TestResultStore(TestCase):
+    def test_key_ignores_header(self):
+        code = "# Title\n# {\"title\": \"Title\"}\nclear\nrun 0"
+        self.assertEqual(ResultStore.key(code), ResultStore.key(code.replace("Title", "Other")))
+        self.assertNotEqual(ResultStore.key(code), ResultStore.key(code.replace("run 0", "run 10")))
+
+    def test_lookup(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            store = ResultStore(Path(tmp) / "store")
+            folder = Path(tmp) / "simulation"
+            os.makedirs(folder)
+            (folder / "log.lammps").write_text("log")
+            self.assertIsNone(store.lookup("abc", ["log.lammps"]))
+            store.put("abc", folder)
+            self.assertIsNone(store.lookup("abc", ["log.lammps", "iron.0.dump"]))
+            self.assertEqual(folder, store.lookup("abc", ["log.lammps"]))
+            stats = store.stats()
+            self.assertEqual((1, 1, 2), (stats["entries"], stats["hits"], stats["misses"]))
+            self.assertEqual(3, stats["reclaimed_bytes"])
+
+    def test_reuse_execution(self):
+        nano_builder = NanoparticleBuilder("Test")
+        nano_builder.configure_lattice("bcc", "2.8665", [])
+        with tempfile.TemporaryDirectory() as tmp:
+            store = ResultStore(Path(tmp) / "store")
+            with patch.object(result_store, "get_result_store", return_value=store):
+                first = nano_builder.build()
+                first.local_path = Path(tmp) / "first"
+                self.assertIsNotNone(first.prepare_execution(test_run=True))
+                # Pretend LAMMPS ran
+                (first.local_path / "log.lammps").write_text("log")
+                (first.local_path / "iron.0.dump").write_text("dump")
+                first.on_post_execution("output")
+                second = nano_builder.build()
+                self.assertIsNone(second.prepare_execution(test_run=True))
+                self.assertEqual(first.local_path, second.local_path)
+                self.assertEqual(first.local_path / "iron.0.dump", second.run.expect_dumps[0])
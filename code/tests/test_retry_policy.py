@@ -0,0 +1,97 @@
+import json
+import os
+import signal
+import sys
+import tempfile
+import time
+from pathlib import Path
+from unittest import TestCase, skipUnless
+
+from lammps.simulation_task import SimulationTask
+from opt import GPUOpt, MPIOpt, OMPOpt
+from remote.execution_queue import retry_policy
+from remote.execution_queue.async_local_execution_queue import AsyncLocalExecutionQueue
+from remote.execution_queue.local_execution_queue import LocalExecutionQueue
+from remote.execution_queue.retry_policy import RetryPolicy
+from remote.machine.local_machine import LocalMachine
+
+# Stands in for LAMMPS: the "flaky" input is killed on its first run, the "bad" input is rejected
+FAKE_LAMMPS = f"""#!{sys.executable}
+import os, signal, sys
+name = os.path.basename(sys.argv[-1])
+if name == "flaky.in" and not os.path.exists("ran"):
+    open("ran", "w").close()
+    os.kill(os.getpid(), signal.SIGKILL)
+if name == "bad.in":
+    open("log.lammps", "w").write("ERROR: Unknown command: bad (src/input.cpp:232)\\n")
+    sys.exit(1)
+print(name)
+"""
+
+
+class TestRetryPolicy(TestCase):
+    def test_classify(self):
+        self.assertEqual(retry_policy.OUT_OF_MEMORY, retry_policy.classify(-signal.SIGKILL))
+        self.assertEqual(retry_policy.OUT_OF_MEMORY, retry_policy.classify(128 + signal.SIGKILL))
+        self.assertEqual(retry_policy.OUT_OF_MEMORY, retry_policy.classify(1, "ERROR on proc 3: Failed to allocate 8 bytes"))
+        self.assertEqual(retry_policy.INPUT_ERROR, retry_policy.classify(1, "Step Temp\nERROR: Unknown command: foo"))
+        self.assertEqual(retry_policy.TIME_LIMIT, retry_policy.classify(None, "*** JOB 42 CANCELLED AT 12:00 DUE TO TIME LIMIT ***"))
+        self.assertEqual(retry_policy.CONNECTION, retry_policy.classify(None, "", ConnectionResetError()))
+        self.assertEqual(retry_policy.CRASH, retry_policy.classify(1))
+
+    def test_backoff(self):
+        with tempfile.TemporaryDirectory() as folder:
+            policy = RetryPolicy(max_attempts=3, base_delay=10.0, max_delay=15.0, quarantine_path=Path(folder) / "q.jsonl")
+            task = SimulationTask("a.in", local_cwd=folder)
+            error = ConnectionResetError()
+            self.assertListEqual([10.0, 15.0, None], [policy.on_failure(task, error) for _ in range(3)])
+            self.assertFalse(task.ok)
+            self.assertTrue(policy.can_fail_over(task))
+            self.assertDictEqual({retry_policy.CONNECTION: 3, "retries": 2, "failovers": 0, "quarantined": 0}, policy.summary())
+            self.assertFalse(os.path.exists(policy.quarantine_path))
+
+    @skipUnless(sys.platform.startswith("linux"), "Uses a fake LAMMPS script")
+    def test_async_queue(self):
+        with tempfile.TemporaryDirectory() as folder:
+            folder = Path(folder)
+            fake_lammps = folder / "fake_lammps"
+            fake_lammps.write_text(FAKE_LAMMPS)
+            os.chmod(fake_lammps, 0o755)
+            queue = AsyncLocalExecutionQueue(LocalMachine(folder, fake_lammps), 2, pin_cores=False)
+            policy = RetryPolicy(base_delay=0.0, quarantine_path=folder / "quarantine.jsonl")
+            queue.set_retry_policy(policy)
+            results: dict[str, str | None] = {}
+            for name in ["ok", "flaky", "bad"]:
+                os.makedirs(folder / name)
+                task = SimulationTask(folder / name / f"{name}.in", GPUOpt(), MPIOpt(), OMPOpt(), folder / name)
+                task.add_callback(lambda result, name=name: results.setdefault(name, result))
+                queue.enqueue(task)
+            self.assertEqual(3, len(queue.run()))
+            self.assertIsNotNone(results["ok"])
+            self.assertIsNotNone(results["flaky"])
+            self.assertIsNone(results["bad"])
+            self.assertDictEqual({retry_policy.OUT_OF_MEMORY: 1, retry_policy.INPUT_ERROR: 1}, policy.failures)
+            self.assertEqual((1, 1), (policy.retries, policy.quarantined))
+            quarantined = [json.loads(line) for line in policy.quarantine_path.read_text().splitlines()]
+            self.assertListEqual([str(folder / "bad")], [entry["folder"] for entry in quarantined])
+
+    @skipUnless(sys.platform.startswith("linux"), "Uses a fake LAMMPS script")
+    def test_single_queue_backoff(self):
+        with tempfile.TemporaryDirectory() as folder:
+            folder = Path(folder)
+            fake_lammps = folder / "fake_lammps"
+            fake_lammps.write_text(FAKE_LAMMPS)
+            os.chmod(fake_lammps, 0o755)
+            queue = LocalExecutionQueue(LocalMachine(folder, fake_lammps))
+            queue.set_retry_policy(RetryPolicy(base_delay=1.0))
+            finished: dict[str, float] = {}
+            for name in ["flaky", "ok"]:
+                os.makedirs(folder / name)
+                task = SimulationTask(folder / name / f"{name}.in", GPUOpt(), MPIOpt(), OMPOpt(), folder / name)
+                task.add_callback(lambda result, name=name: finished.setdefault(name, time.perf_counter()))
+                queue.enqueue(task)
+            start = time.perf_counter()
+            self.assertEqual(2, len(queue.run()))
+            # The other task runs while the flaky one waits out its backoff
+            self.assertLess(finished["ok"] - start, 1.0)
+            self.assertGreaterEqual(finished["flaky"] - start, 1.0)
@@ -0,0 +1,60 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from lammps.simulation_task import SimulationTask
+from model.execution_metadata import ExecutionMetadata
+from opt import MPIOpt
+from remote.machine.local_machine import LocalMachine
+from service.runtime_model import RuntimeModel
+from service.scheduler_service import SchedulerService
+
+SCALE = 1e-6  # Seconds per atom step on one thread
+
+
+def write_execution(folder: Path, machine: str | None, atoms: int, procs: int, steps: int) -> None:
+    loop = SCALE * steps * atoms / procs
+    folder.mkdir()
+    (folder / "log.lammps").write_text(
+        "LAMMPS (2 Aug 2023)\n"
+        "Step Temp TotEng\n"
+        f"0 300 -4.2\n{steps} 300 -4.2\n"
+        f"Loop time of {loop} on {procs} procs for {steps} steps with {atoms} atoms\n\n"
+        f"99.8% CPU use with {procs} MPI tasks x 1 OpenMP threads\n\n"
+        f"Total wall time: 0:00:{int(loop) + 2:02d}\n"
+    )
+    if machine is not None:
+        ExecutionMetadata(0, loop + 2, None, None, machine).save(folder)
+
+
+class TestRuntimeModel(TestCase):
+    def test_fit(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            runs = [(1000, 1, 10000), (2000, 1, 10000), (2000, 2, 10000), (4000, 4, 10000), (3000, 1, 5000), (1000, 1, 0)]
+            for i, (atoms, procs, steps) in enumerate(runs):
+                write_execution(Path(tmp) / str(i), "local", atoms, procs, steps)
+            write_execution(Path(tmp) / "remote", None, 1000, 1, 10000)
+            write_execution(Path(tmp) / "unknown", None, 1000, 1, 10000)
+            samples = RuntimeModel.collect(Path(tmp), {str(Path(tmp) / "remote"): "toko/mini"})
+            self.assertEqual(len(runs) + 1, len(samples))
+            model = RuntimeModel.fit(samples)
+            self.assertListEqual(["local", "toko/mini"], list(model.machines))
+            local = model.machines["local"]
+            self.assertAlmostEqual(1.0, local.atom_exponent, places=2)
+            self.assertAlmostEqual(1.0, local.thread_exponent, places=2)
+            self.assertAlmostEqual(SCALE * 10000 * 8000 / 2, model.predict("local", 8000, 2, 10000) - local.overhead, places=3)
+            self.assertIsNone(model.predict("toko/XL", 8000, 2, 10000))
+            model.save(Path(tmp) / "model.json")
+            loaded = RuntimeModel.load(Path(tmp) / "model.json")
+            self.assertEqual(model.machines, loaded.machines)
+
+    def test_schedule(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            write_execution(Path(tmp) / "0", "local", 1000, 1, 10000)
+            model = RuntimeModel.fit(RuntimeModel.collect(Path(tmp)))
+        local = LocalMachine(Path("/tmp"), Path("/tmp/lmp"), single_core_completion_time=1e6)
+        tasks = [SimulationTask("a.in", mpi=MPIOpt(use=True, n_threads=2), estimated_atoms=1000) for _ in range(2)]
+        plan = SchedulerService.plan([(local, 4)], tasks, model=model)
+        minutes = model.predict("local", 1000, 2, 300000) / 60
+        self.assertAlmostEqual(minutes, plan.makespan)
+        self.assertAlmostEqual(minutes, plan.lower_bound)
@@ -0,0 +1,49 @@
+import random
+from pathlib import Path
+from unittest import TestCase
+
+from lammps.simulation_task import SimulationTask
+from remote.machine.local_machine import LocalMachine
+from service.runtime_model import RuntimeSample
+from service.schedule_simulator import SimulatedMachine, TaskTimes, simulate, compare
+from service.scheduler_service import SchedulerService
+
+
+def machine(name: str, seconds: float, cores: int) -> LocalMachine:
+    local = LocalMachine(Path("/tmp"), Path("/tmp/lmp"), single_core_completion_time=seconds)
+    local.name = name
+    local.cores = cores
+    return local
+
+
+class TestScheduleSimulator(TestCase):
+    def test_matches_plan(self):
+        # Without noise, queues that start a task whenever a slot is idle finish when the plan says
+        machines = [SimulatedMachine(machine("fast", 60.0, 4), 4), SimulatedMachine(machine("slow", 180.0, 8), 8)]
+        rng = random.Random(0)
+        tasks = [SimulationTask("a.in", estimated_atoms=rng.randint(100, 3000)) for _ in range(200)]
+        times = TaskTimes.of_model(machines, tasks)
+        report = simulate(machines, times, "lpt")
+        plan = SchedulerService.plan([(m.machine, m.parallelism) for m in machines], tasks)
+        for finish, planned in zip(report.finish, plan.finish_minutes):
+            self.assertAlmostEqual(planned, finish)
+        self.assertGreater(report.utilization, 0.9)
+        reports = {r.policy: r for r in compare(machines, times)}
+        self.assertLess(reports["lpt"].makespan, reports["proportional"].makespan)
+
+    def test_batch(self):
+        # Two ranks run tasks 0, 2 and 1, 3 after a one minute queue wait, the results are back when both end
+        remote = SimulatedMachine(machine("remote", 60.0, 2), 2, batched=True, queue_wait=60.0)
+        tasks = [SimulationTask("a.in", estimated_atoms=1000) for _ in range(4)]
+        times = TaskTimes(tasks, [[1.0]] * 4, [[1.0], [1.0], [3.0], [1.0]])
+        report = simulate([remote], times, "greedy")
+        self.assertAlmostEqual(5.0, report.makespan)
+        self.assertAlmostEqual(5.0, report.p50)
+        self.assertAlmostEqual(6.0 / 10.0, report.utilization)  # The queue wait counts as idle
+
+    def test_samples(self):
+        machines = [SimulatedMachine(machine("local", 60.0, 1), 1), SimulatedMachine(machine("other", 120.0, 1), 1)]
+        samples = [RuntimeSample("local", 1250, 1, 300000, 200.0, 240.0), RuntimeSample("unknown", 1250, 1, 300000, 60.0, None)]
+        times = TaskTimes.of_samples(machines, samples)
+        self.assertListEqual([4.0, 8.0], times.actual[0])
+        self.assertListEqual(times.predicted[1], times.actual[1])
@@ -0,0 +1,42 @@
+import time
+from pathlib import Path
+from unittest import TestCase
+
+from lammps.simulation_task import SimulationTask
+from opt import MPIOpt
+from remote.machine.local_machine import LocalMachine
+from service.scheduler_service import SchedulerService
+
+
+def machine(seconds: float, launch: float = 0.0) -> LocalMachine:
+    return LocalMachine(Path("/tmp"), Path("/tmp/lmp"), launch_time=launch, single_core_completion_time=seconds)
+
+
+class TestSchedulerService(TestCase):
+    def test_heterogeneous(self):
+        # The fast machine runs an average task in 1 minute, the slow one in 2
+        fast, slow = machine(60.0), machine(120.0)
+        tasks = [SimulationTask("a.in", estimated_atoms=atoms) for atoms in [100, 100, 100, 100, 400, 400]]
+        plan = SchedulerService.plan([(fast, 2), (slow, 2)], tasks)
+        self.assertListEqual([400, 400], [task.estimated_atoms for task in plan.assignments[0][:2]])
+        self.assertEqual(len(tasks), sum(len(assignment) for assignment in plan.assignments))
+        # The largest tasks cost 2 average tasks: 2 minutes on the fast machine
+        self.assertAlmostEqual(2.0, plan.lower_bound)
+        self.assertGreaterEqual(plan.makespan, plan.lower_bound)
+        self.assertLessEqual(plan.makespan, 4 / 3 * plan.lower_bound + 1e-9)
+
+    def test_launch_and_threads(self):
+        tasks = [SimulationTask("a.in", mpi=MPIOpt(use=True, n_threads=2)) for _ in range(4)]
+        plan = SchedulerService.plan([(machine(60.0, launch=60.0), 4)], tasks)
+        # Two tasks at a time, each takes 1 minute plus 1 minute to launch
+        self.assertAlmostEqual(4.0, plan.makespan)
+        self.assertAlmostEqual(4.0, plan.lower_bound)
+        test_plan = SchedulerService.plan([(machine(60.0), 4)], tasks, is_test=True)
+        self.assertAlmostEqual(2 * 2 / 60, test_plan.makespan)
+
+    def test_many_tasks(self):
+        tasks = [SimulationTask("a.in", estimated_atoms=1000 + i % 97) for i in range(50000)]
+        start = time.perf_counter()
+        plan = SchedulerService.plan([(machine(60.0), 64), (machine(30.0, launch=5.0), 128), (machine(90.0), 16)], tasks)
+        self.assertLess(time.perf_counter() - start, 5.0)
+        self.assertLess(plan.makespan, 1.01 * plan.lower_bound)
@@ -0,0 +1,49 @@
+import hashlib
+import io
+import tarfile
+import tempfile
+from pathlib import Path, PurePosixPath
+from unittest import TestCase
+
+from remote.machine.ssh_machine import tar_batch, TAR_CHUNK
+
+
+class TestTarBatch(TestCase):
+    def test_tar_batch(self):
+        with tempfile.TemporaryDirectory() as folder:
+            folder = Path(folder)
+            (folder / "nano" / "sub").mkdir(parents=True)
+            (folder / "nano" / "in.lmp").write_text("run 0\n")
+            (folder / "nano" / "sub" / "data").write_bytes(b"\x00" * 100)
+            (folder / "potential").write_text("potential\n")
+            entries = [(folder / "nano", PurePosixPath("simulations/nano")), (folder / "potential", PurePosixPath("potential"))]
+            for compression in [0, 1]:
+                buffer = io.BytesIO()
+                tar_batch(entries, PurePosixPath("simulations/sums"), buffer, compression)
+                buffer.seek(0)
+                with tarfile.open(fileobj=buffer) as tar:
+                    members = {member.name: member for member in tar.getmembers()}
+                    self.assertIn("simulations/nano/sub/data", members)
+                    checksums = dict(line.split("  ")[::-1] for line in tar.extractfile("simulations/sums").read().decode().splitlines())
+                    self.assertSetEqual({"simulations/nano/in.lmp", "simulations/nano/sub/data", "potential"}, set(checksums))
+                    for name, checksum in checksums.items():
+                        self.assertEqual(hashlib.sha256(tar.extractfile(name).read()).hexdigest(), checksum)
+
+    def test_streamed(self):
+        class Writer:
+            def __init__(self):
+                self.chunks: list[int] = []
+
+            def write(self, data: bytes) -> int:
+                self.chunks.append(len(data))
+                return len(data)
+
+        with tempfile.TemporaryDirectory() as folder:
+            folder = Path(folder)
+            (folder / "data").write_bytes(bytes(range(256)) * 4096)
+            for compression in [0, 1]:
+                writer = Writer()
+                tar_batch([(folder / "data", PurePosixPath("data"))], PurePosixPath("sums"), writer, compression)
+                # Written as it is built, never as a whole archive
+                self.assertGreater(len(writer.chunks), 1)
+                self.assertLessEqual(max(writer.chunks), TAR_CHUNK)
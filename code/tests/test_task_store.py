@@ -0,0 +1,50 @@
+import time
+from unittest import TestCase
+
+from lammps.simulation_task import SimulationTask
+from remote.execution_queue import task_store
+from remote.execution_queue.local_execution_queue import LocalExecutionQueue
+from remote.execution_queue.task_store import TaskStore
+from remote.machine.local_machine import LocalMachine
+from config.config import LOCAL_EXECUTION_PATH
+
+
+class TestTaskStore(TestCase):
+    def test_states(self):
+        now = [0.0]
+        store = TaskStore(clock=lambda: now[0])
+        first, second = SimulationTask("a.in"), SimulationTask("a.in")
+        store.add(first)
+        store.add(second)
+        self.assertIn(first, store)
+        with self.assertRaises(AssertionError):
+            store.add(first)
+        now[0] = 1.0
+        self.assertIs(first, store.pop())
+        self.assertEqual(task_store.RUNNING, store.state(first))
+        now[0] = 2.0
+        store.finish(first, ok=False)
+        self.assertListEqual([(task_store.PENDING, 0.0), (task_store.RUNNING, 1.0), (task_store.FAILED, 2.0)],
+                             store.history[first.task_id])
+        self.assertListEqual([second], store.pop_all())
+        self.assertIsNone(store.pop())
+        self.assertEqual(1, store.count(task_store.RUNNING))
+
+    def test_sort_pending(self):
+        store = TaskStore()
+        for atoms in [5, 20, 10]:
+            store.add(SimulationTask("a.in", estimated_atoms=atoms))
+        store.sort_pending(key=lambda task: task.estimated_atoms, reverse=True)
+        self.assertListEqual([20, 10, 5], [task.estimated_atoms for task in store.pending_tasks()])
+
+    def test_linear(self):
+        queue = LocalExecutionQueue(LocalMachine(LOCAL_EXECUTION_PATH, LOCAL_EXECUTION_PATH))
+        tasks = [SimulationTask("a.in") for _ in range(100_000)]
+        start = time.perf_counter()
+        for simulation_task in tasks:
+            queue.enqueue(simulation_task)
+        while queue._get_next_task() is not None:
+            pass
+        # Quadratic enqueue/dequeue takes minutes for this many tasks
+        self.assertLess(time.perf_counter() - start, 10)
+        self.assertEqual(100_000, queue.store.count(task_store.RUNNING))
@@ -0,0 +1,37 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from lammps.simulation_task import SimulationWrapper
+from template import CompiledTemplate, TemplateUtils
+
+
+class TestTemplate(TestCase):
+    def test_render(self):
+        compiled = CompiledTemplate.compile("# {{title}}\nrun {{run_steps}}\n{{title}}", "test")
+        self.assertEqual(("title", "run_steps", "title"), compiled.keys)
+        self.assertEqual("# a\nrun 0\na", compiled.render({"title": "a", "run_steps": "0", "unused": "x"}))
+        self.assertEqual("no placeholders", CompiledTemplate.compile("no placeholders").render({}))
+
+    def test_missing_key(self):
+        compiled = CompiledTemplate.compile("{{a}} {{b}} {{c}}", "test")
+        with self.assertRaises(KeyError) as context:
+            compiled.render({"b": "1"})
+        self.assertIn("['a', 'c']", str(context.exception))
+
+    def test_unreplaced_region(self):
+        # A shape region left with a {{x:min:max}} placeholder renders fine, generate still refuses it
+        code = CompiledTemplate.compile("{{region}}\nrun 0", "test").render({"region": "region r sphere 0 0 0 {{r:1:5}}"})
+        with tempfile.TemporaryDirectory() as folder:
+            with self.assertRaises(AssertionError):
+                SimulationWrapper.generate(code, Path(folder) / "in.lmp", {"cwd": Path(folder)})
+            self.assertFalse((Path(folder) / "in.lmp").exists())
+
+    def test_matches_replace_templates(self):
+        source = TemplateUtils.get_lammps_template()
+        replacements = {"region": "region reg0 sphere 0 0 0 10 units box\n", "run_steps": "0", "title": "Test"}
+        self.assertEqual(
+            TemplateUtils.replace_with_doc(source, replacements, "json_description"),
+            TemplateUtils.render_with_doc(TemplateUtils.get_compiled_lammps_template(), replacements, "json_description")
+        )
+        self.assertIs(TemplateUtils.get_compiled_lammps_template(), TemplateUtils.get_compiled_lammps_template())
@@ -0,0 +1,66 @@
+import json
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from lammps.simulation_task import SimulationTask
+from remote.machine.local_machine import LocalMachine
+from remote.machine.machine_factory import MachineFactory
+from service.scheduler_service import SchedulerService
+from service import transfer_model
+from service.transfer_model import TransferModel, TransferSample, MachineTransfer, UPLOAD, DOWNLOAD
+
+
+class TestTransferModel(TestCase):
+    def test_fit(self):
+        # 2 MB/s and half a second per operation, copies in flight share the link
+        samples = [TransferSample("toko/mini", UPLOAD, size, 0.5 + size * parallel / 2e6, parallel, 0.0)
+                   for size, parallel in [(10_000, 1), (1_000_000, 1), (500_000, 4), (5_000_000, 2)]]
+        link = MachineTransfer.fit(samples)
+        self.assertAlmostEqual(2e6, link.bandwidth, delta=1.0)
+        self.assertAlmostEqual(0.5, link.latency)
+
+    def test_collect(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "transfers.jsonl"
+            for i in range(5):
+                TransferModel.record(TransferSample("toko/mini", DOWNLOAD, 1000 * i, 1.0, 1, float(i)), path)
+            TransferModel.record(TransferSample("toko/XL", UPLOAD, 1000, 1.0, 1, 0.0), path)
+            samples = TransferModel.collect(path, recent=2)
+            self.assertListEqual([3.0, 4.0, 0.0], [sample.time for sample in samples])
+            model = TransferModel.fit(samples)
+            self.assertListEqual(["toko/XL", "toko/mini"], list(model.machines))
+
+    def test_compact(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "transfers.jsonl"
+            with patch.object(transfer_model, "TRANSFER_LOG_MAX_BYTES", 4096), patch.object(transfer_model, "TRANSFER_RECENT", 3):
+                for i in range(100):
+                    TransferModel.record(TransferSample(["toko/mini", "toko/XL"][i % 2], UPLOAD, 1000, 1.0, 1, float(i)), path)
+                self.assertLessEqual(path.stat().st_size, 4096)
+            # Every machine keeps its last copies, in the order they were recorded
+            times = [json.loads(line)["time"] for line in path.read_text().splitlines()]
+            self.assertListEqual(sorted(times), times)
+            self.assertListEqual([98.0, 99.0], times[-2:])
+            self.assertEqual({"toko/mini", "toko/XL"}, {sample.machine for sample in TransferModel.collect(path)})
+
+    def test_plan(self):
+        local = LocalMachine(Path("/tmp"), Path("/tmp/lmp"), single_core_completion_time=600.0)
+        remote = MachineFactory.toko("mini")
+        remote.single_core_completion_time, remote.launch_time = 60.0, 0.0
+        model = TransferModel({remote.name: MachineTransfer(10, 1e5, 1.0)})
+        self.assertIsNone(model.link(local))
+        self.assertGreater(model.batch_minutes(remote), 0.0)
+        slots = [(local, 4), (remote, 4)]
+        # Test runs are faster to run in place than to copy
+        tasks = [SimulationTask(f"{i}.in", is_test_run=True) for i in range(8)]
+        plan = SchedulerService.plan(slots, tasks, True, transfers=SchedulerService.transfers(slots, tasks, model),
+                                     ready=[model.batch_minutes(machine) for machine, _ in slots])
+        self.assertListEqual([8, 0], [len(assignment) for assignment in plan.assignments])
+        # Full runs are worth the copies to the faster machine
+        tasks = [SimulationTask(f"{i}.in") for i in range(8)]
+        plan = SchedulerService.plan(slots, tasks, transfers=SchedulerService.transfers(slots, tasks, model),
+                                     ready=[model.batch_minutes(machine) for machine, _ in slots])
+        self.assertGreater(len(plan.assignments[1]), len(plan.assignments[0]))
+        self.assertGreater(plan.transfer_minutes[1], 0.0)
@@ -1,5 +1,6 @@
 import asyncio
 import base64
+import hashlib
 import logging
 import os
 import random
@@ -119,6 +120,15 @@ def realpath(path):
     return os.path.realpath(path)
 
 
+def available_cpus() -> int:
+    """
+    CPUs this process may use (which can be fewer than the machine has, e.g. in containers or with taskset)
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
 def write_local_file(path: Path | str, content: str):
     with open(path, "wb") as f:
         f.write(content.encode("utf-8"))
@@ -133,6 +143,32 @@ def read_local_file(path: Path | str) -> str | None:
         return None
 
 
+def read_local_tail(path: Path | str, size: int = 4096) -> str:
+    """
+    Last bytes of a file (e.g. the summary or the error at the end of a log), empty if it does not exist
+    """
+    try:
+        with open(path, "rb") as f:
+            f.seek(max(0, os.path.getsize(path) - size))
+            return f.read().decode("utf-8", errors="replace")
+    except FileNotFoundError:
+        return ""
+
+
+def hash_content(content: str | bytes) -> str:
+    """
+    Stable (process independent) digest of some content
+    """
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.sha256(content).hexdigest()
+
+
+def hash_file(path: Path | str) -> str:
+    with open(path, "rb") as f:
+        return hash_content(f.read())
+
+
 T = TypeVar("T")
 V = TypeVar("V")
 